@@ -4,28 +4,40 @@ import logging
 import os
 import random
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from queue import Queue
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import dotenv
 
 from agents.tools import Tools
 from agents.tools_mcp import Tools as ToolsMCP
+from core.async_store import AsyncMessageStore
 from core.config import PromptConfig
 from core.embedding import (
+    EMBEDDING_BATCH_SIZE,
+    Collection,
     EmbeddingError,
     MessageData,
     MessageStore,
     PostgresConfig,
     PostgresVectorStorage,
+    RetentionPolicy,
     SQLiteConfig,
     SQLiteVectorStorage,
-    get_embedding,
+    WriteBehindConfig,
+    aget_embedding,
+    content_hash,
+    get_embedding_cache,
+    get_embeddings,
 )
 from core.imgen import generate_image_with_retry_smartgen
+from core.knowledge_base import chunk_text, count_tokens, item_text, iter_json_items
 from core.llm import LLMError, call_llm, call_llm_with_tools
+from core.segment_store import SegmentConfig, SegmentVectorStorage
+from core.vector_index import IndexedVectorStorage, IVFConfig
 from core.voice import speak_text, transcribe_audio
 
 # Set up logging
@@ -46,6 +58,18 @@ SMALL_MODEL_ID = os.getenv("SMALL_MODEL_ID")
 TWEET_WORD_LIMITS = [15, 20, 30, 35]
 IMAGE_GENERATION_PROBABILITY = 0.3
 BASE_IMAGE_PROMPT = ""
+# Maximum number of knowledge base entries injected into the system prompt
+KNOWLEDGE_BASE_TOP_K = int(os.getenv("KNOWLEDGE_BASE_TOP_K", 8))
+KNOWLEDGE_BASE_BATCH_SIZE = 500
+# Embedding requests in flight while the knowledge base is updated
+KNOWLEDGE_BASE_EMBEDDING_WORKERS = int(os.getenv("KNOWLEDGE_BASE_EMBEDDING_WORKERS", 4))
+# Knowledge base items are stored as chunks of at most this many tokens, consecutive chunks sharing the overlap
+KNOWLEDGE_BASE_CHUNK_TOKENS = int(os.getenv("KNOWLEDGE_BASE_CHUNK_TOKENS", 256))
+KNOWLEDGE_BASE_CHUNK_OVERLAP = int(os.getenv("KNOWLEDGE_BASE_CHUNK_OVERLAP", 32))
+# Maximum number of knowledge base tokens injected into the system prompt
+KNOWLEDGE_BASE_PROMPT_TOKENS = int(os.getenv("KNOWLEDGE_BASE_PROMPT_TOKENS", 2048))
+# Replies fall back to keyword-only knowledge base retrieval when embedding a message takes longer than this
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", 10))
 
 
 class CoreAgent:
@@ -60,6 +84,9 @@ class CoreAgent:
         self.last_tweet_id = 0
         self.last_raid_tweet_id = 0
 
+        # Threads scoring shards of the embedding matrix in parallel for in-process searches
+        search_workers = int(os.getenv("VECTOR_SEARCH_WORKERS", 1))
+
         # Use PostgreSQL if configured, otherwise default to SQLite
         if all([os.getenv(env) for env in ["VECTOR_DB_NAME", "VECTOR_DB_USER", "VECTOR_DB_PASSWORD"]]):
             vdb_config = PostgresConfig(
@@ -69,18 +96,106 @@ class CoreAgent:
                 user=os.getenv("VECTOR_DB_USER"),
                 password=os.getenv("VECTOR_DB_PASSWORD"),
                 table_name=os.getenv("VECTOR_DB_TABLE", "message_embeddings"),
+                index_type=os.getenv("VECTOR_DB_INDEX_TYPE", "ivfflat"),
+                probes=int(os.getenv("VECTOR_DB_PROBES", 0)) or None,
+                ef_search=int(os.getenv("VECTOR_DB_EF_SEARCH", 0)) or None,
+                partial_index_message_types=[
+                    message_type.strip()
+                    for message_type in os.getenv("VECTOR_DB_PARTIAL_INDEXES", "").split(",")
+                    if message_type.strip()
+                ],
+                min_connections=int(os.getenv("VECTOR_DB_POOL_MIN", 1)),
+                max_connections=int(os.getenv("VECTOR_DB_POOL_MAX", 10)),
             )
             storage = PostgresVectorStorage(vdb_config)
+            # The knowledge base is small and read on every message: a graph index works at any size
+            knowledge_base_storage = storage.collection(
+                "knowledge_base",
+                index_type=os.getenv("VECTOR_KB_INDEX_TYPE", "hnsw"),
+                partial_index_message_types=[],
+                max_connections=int(os.getenv("VECTOR_KB_POOL_MAX", 4)),
+                full_text_search=True,
+            )
         else:
-            config = SQLiteConfig()
+            config = SQLiteConfig(search_workers=search_workers)
             storage = SQLiteVectorStorage(config)
+            knowledge_base_storage = storage.collection("knowledge_base", full_text_search=True)
+
+        # Large static knowledge bases can live in memory-mapped segments shared by every bot process
+        knowledge_base_segments = os.getenv("VECTOR_KB_SEGMENTS_DIR")
+        if knowledge_base_segments:
+            knowledge_base_storage = SegmentVectorStorage(
+                SegmentConfig(
+                    directory=knowledge_base_segments,
+                    table_name="knowledge_base_embeddings",
+                    full_text_search=True,
+                    search_workers=search_workers,
+                )
+            )
+
+        # Optional approximate nearest-neighbour index in front of the storage provider
+        if os.getenv("VECTOR_INDEX_PATH"):
+            storage = IndexedVectorStorage(
+                storage,
+                IVFConfig(index_path=os.getenv("VECTOR_INDEX_PATH"), n_probe=int(os.getenv("VECTOR_INDEX_PROBES", 8))),
+            )
 
-        self.message_store = MessageStore(storage)
+        # Optional in-memory embedding cache, e.g. VECTOR_CACHE_MAX_MB=512
+        cache_max_mb = os.getenv("VECTOR_CACHE_MAX_MB")
+        cache_max_bytes = int(float(cache_max_mb) * 1024 * 1024) if cache_max_mb else None
+
+        # Optional write-behind persistence so storing messages does not delay replies
+        write_behind = None
+        if os.getenv("VECTOR_WRITE_BEHIND", "false").lower() == "true":
+            write_behind = WriteBehindConfig(max_queue_size=int(os.getenv("VECTOR_WRITE_QUEUE_SIZE", 1000)))
+
+        # Optional retention, e.g. VECTOR_RETENTION_MAX_AGE_DAYS=90; knowledge_base rows are never expired
+        retention = None
+        retention_limits = {
+            "max_age_days": os.getenv("VECTOR_RETENTION_MAX_AGE_DAYS"),
+            "max_rows_per_chat": os.getenv("VECTOR_RETENTION_MAX_ROWS_PER_CHAT"),
+            "max_rows_per_type": os.getenv("VECTOR_RETENTION_MAX_ROWS_PER_TYPE"),
+        }
+        if any(retention_limits.values()):
+            retention = RetentionPolicy(
+                max_age_days=float(retention_limits["max_age_days"]) if retention_limits["max_age_days"] else None,
+                max_rows_per_chat=int(retention_limits["max_rows_per_chat"] or 0) or None,
+                max_rows_per_type=int(retention_limits["max_rows_per_type"] or 0) or None,
+                compaction_interval=float(os.getenv("VECTOR_RETENTION_INTERVAL", 3600)),
+            )
+
+        # Knowledge base entries live in their own table so their search cost does not grow with chat history
+        # Mapped segments are already served from the page cache, so they get no private copy by default
+        knowledge_base_cache_mb = float(os.getenv("VECTOR_KB_CACHE_MAX_MB", 0 if knowledge_base_segments else 64))
+        collections = {
+            "knowledge_base": Collection(
+                knowledge_base_storage,
+                ["knowledge_base"],
+                cache_max_bytes=int(knowledge_base_cache_mb * 1024 * 1024) or None,
+            )
+        }
+
+        self.message_store = MessageStore(
+            storage,
+            cache_max_bytes=cache_max_bytes,
+            write_behind=write_behind,
+            retention=retention,
+            collections=collections,
+            search_workers=search_workers,
+        )
+        # Entries stored in the history table before the knowledge base had its own collection
+        self.message_store.migrate_collection("knowledge_base")
+        # Non-blocking view of the same store for use inside the event loop
+        self.async_message_store = AsyncMessageStore(self.message_store)
 
     async def initialize(self, server_url: str = "http://localhost:8000/sse"):
         await self.tools_mcp.initialize(server_url=server_url)
         self.tools_mcp_initialized = True
 
+    async def close(self) -> None:
+        """Flush queued messages and close the message store"""
+        await self.async_message_store.close()
+
     def register_interface(self, name, interface):
         with self._lock:
             self.interfaces[name] = interface
@@ -96,70 +211,50 @@ class CoreAgent:
         logger.info(f"Updating knowledge base from {json_file_path}")
 
         try:
-            # Read JSON file
-            with open(json_file_path, "r") as f:
-                data = json.load(f)
-
-            # Handle both list and dict formats
-            items = data if isinstance(data, list) else [data]
-
-            # Process each item
-            for item in items:
-                if not isinstance(item, dict):
-                    continue
-
-                # Create message content by combining all key-value pairs
-                message_parts = []
-                for key, value in item.items():
-                    if isinstance(value, (str, int, float, bool)):
-                        message_parts.append(f"{key}: {value}")
-                    elif isinstance(value, (list, dict)):
-                        # Handle nested structures by converting to string
-                        message_parts.append(f"{key}: {json.dumps(value)}")
-
-                message = "\n\n".join(message_parts)
-
-                # Generate embedding for the message
-                message_embedding = get_embedding(message)
-
-                # Check if this exact message already exists
-                existing_entries = self.message_store.find_similar_messages(
-                    message_embedding,
-                    threshold=0.99,  # Very high threshold to match nearly identical content
-                )
+            # First chunks of entries an interrupted update did not finish; those entries are stored again below
+            self.message_store.delete_orphaned_chunks("knowledge_base")
+            # Items are streamed from the file and handled KNOWLEDGE_BASE_BATCH_SIZE entries at a time
+            pending: List[Tuple[str, str, List[str]]] = []
+            pending_hashes = set()
+            stored, unchanged = 0, 0
+
+            with ThreadPoolExecutor(
+                max_workers=KNOWLEDGE_BASE_EMBEDDING_WORKERS, thread_name_prefix="knowledge-base-embedding"
+            ) as executor:
+                # A top-level array yields its elements, a single object is one item
+                for item in iter_json_items(json_file_path):
+                    if not isinstance(item, dict):
+                        continue
 
-                if existing_entries:
-                    logger.info("Similar content already exists in knowledge base, skipping...")
-                    continue
+                    message = item_text(item)
+                    message_hash = content_hash(message)
+                    # Duplicates in earlier batches are already stored and found by their hash
+                    if message_hash in pending_hashes:
+                        logger.info("Duplicate content in knowledge base file, skipping...")
+                        continue
 
-                try:
                     # Extract potential key topics from the first few keys
-                    key_topics = list(item.keys())[:3]  # Use first 3 keys as topics
-
-                    # Create MessageData object
-                    message_data = MessageData(
-                        message=message,
-                        embedding=message_embedding,
-                        timestamp=datetime.now().isoformat(),
-                        message_type="knowledge_base",
-                        chat_id=None,
-                        source_interface="knowledge_base",
-                        original_query=None,
-                        original_embedding=None,
-                        tool_call=None,
-                        response_type="FACTUAL",
-                        key_topics=key_topics,
-                    )
-
-                    # Store in vector database
-                    self.message_store.add_message(message_data)
-                    logger.info(f"Stored knowledge base entry with keys: {', '.join(key_topics)}")
-
-                except EmbeddingError as e:
-                    logger.error(f"Failed to generate embedding: {str(e)}")
-                    continue
-
-            logger.info("Knowledge base update completed successfully")
+                    pending.append((message, message_hash, list(item.keys())[:3]))
+                    pending_hashes.add(message_hash)
+                    if len(pending) >= KNOWLEDGE_BASE_BATCH_SIZE:
+                        batch_stored, batch_unchanged = self._store_knowledge_base_entries(pending, executor)
+                        stored, unchanged = stored + batch_stored, unchanged + batch_unchanged
+                        pending, pending_hashes = [], set()
+
+                if pending:
+                    batch_stored, batch_unchanged = self._store_knowledge_base_entries(pending, executor)
+                    stored, unchanged = stored + batch_stored, unchanged + batch_unchanged
+
+            logger.info(
+                f"Knowledge base update completed successfully: {stored} entries stored, {unchanged} unchanged"
+            )
+            embedding_cache = get_embedding_cache()
+            if embedding_cache:
+                stats = embedding_cache.stats()
+                logger.info(
+                    f"Embedding cache: {stats['hit_rate']:.1%} hit rate over {stats['lookups']} lookups, "
+                    f"{stats['evictions']} evicted"
+                )
 
         except FileNotFoundError:
             logger.error(f"JSON file not found: {json_file_path}")
@@ -168,6 +263,96 @@ class CoreAgent:
         except Exception as e:
             logger.error(f"Error updating knowledge base: {str(e)}")
 
+    def _store_knowledge_base_entries(
+        self, entries: List[Tuple[str, str, List[str]]], executor: ThreadPoolExecutor
+    ) -> Tuple[int, int]:
+        """
+        Chunk, embed and store the knowledge base entries whose content is not stored yet.
+
+        Unchanged entries are recognized by their content hash and cost no embedding call. The
+        others are split into token-bounded chunks, embedded in concurrent requests and written
+        with bulk inserts; every chunk after the first references the first chunk as its parent.
+
+        Args:
+            entries: (message, content_hash, key_topics) tuples with distinct hashes
+            executor: Runs the embedding requests
+
+        Returns:
+            Tuple[int, int]: Number of stored entries and number of unchanged entries
+        """
+        stored_hashes = self.message_store.find_content_hashes(
+            [message_hash for _, message_hash, _ in entries], message_type="knowledge_base"
+        )
+        new_entries = [entry for entry in entries if entry[1] not in stored_hashes]
+
+        chunks = [
+            (entry[1], chunk)
+            for entry in new_entries
+            for chunk in chunk_text(entry[0], KNOWLEDGE_BASE_CHUNK_TOKENS, KNOWLEDGE_BASE_CHUNK_OVERLAP)
+        ]
+        size = EMBEDDING_BATCH_SIZE
+        requests = [chunks[start : start + size] for start in range(0, len(chunks), size)]
+        futures = [executor.submit(get_embeddings, [chunk for _, chunk in request]) for request in requests]
+
+        embedded: Dict[str, List[Tuple[str, List[float]]]] = {}
+        failed = set()
+        for request, future in zip(requests, futures):
+            try:
+                embeddings = future.result()
+            except EmbeddingError as e:
+                # Nothing is stored for these entries, so the next update retries them
+                logger.error(f"Failed to generate embeddings for {len(request)} knowledge base chunks: {str(e)}")
+                failed.update(message_hash for message_hash, _ in request)
+                continue
+            for (message_hash, chunk), chunk_embedding in zip(request, embeddings):
+                embedded.setdefault(message_hash, []).append((chunk, chunk_embedding))
+
+        # An entry is only stored with all of its chunks
+        complete = [
+            (key_topics, message_hash, embedded[message_hash])
+            for _, message_hash, key_topics in new_entries
+            if message_hash in embedded and message_hash not in failed
+        ]
+
+        def knowledge_base_row(chunk, chunk_embedding, key_topics, message_hash, parent_id=None) -> MessageData:
+            return MessageData(
+                message=chunk,
+                embedding=chunk_embedding,
+                timestamp=datetime.now().isoformat(),
+                message_type="knowledge_base",
+                chat_id=None,
+                source_interface="knowledge_base",
+                original_query=None,
+                original_embedding=None,
+                tool_call=None,
+                response_type="FACTUAL",
+                key_topics=key_topics,
+                content_hash=message_hash,
+                parent_id=parent_id,
+            )
+
+        if not complete:
+            return 0, len(entries) - len(new_entries)
+
+        # First chunks are written first so the other chunks can reference their rows. A split
+        # entry only gets its hash with its remaining chunks: if the update stops in between, the
+        # entry is not considered stored, and the next update deletes its first chunk and stores it again
+        parent_ids = self.message_store.add_messages(
+            [
+                knowledge_base_row(*entry_chunks[0], key_topics, message_hash if len(entry_chunks) == 1 else None)
+                for key_topics, message_hash, entry_chunks in complete
+            ]
+        )
+        continuations = [
+            knowledge_base_row(chunk, chunk_embedding, key_topics, message_hash, parent_id)
+            for (key_topics, message_hash, entry_chunks), parent_id in zip(complete, parent_ids)
+            for chunk, chunk_embedding in entry_chunks[1:]
+        ]
+        if continuations:
+            self.message_store.add_messages(continuations)
+        logger.info(f"Stored {len(complete)} knowledge base entries in {len(parent_ids) + len(continuations)} chunks")
+        return len(complete), len(entries) - len(new_entries)
+
     def basic_personality_settings(self) -> str:
         system_prompt = "Use the following settings as part of your personality and voice if applicable in the conversation context: "
         basic_options = random.sample(self.prompt_config.get_basic_settings(), 2)
@@ -374,15 +559,16 @@ class CoreAgent:
             return None, None, None
 
         try:
-            message_embedding = get_embedding(message)
-            logger.info(f"Generated embedding for message: {message[:50]}...")
-            system_prompt_context = self.get_knowledge_base(message, message_embedding)
+            message_embedding = await self._embed_message(message)
+            system_prompt_context = await self.get_knowledge_base(message, message_embedding)
 
             if not skip_conversation_context:
-                system_prompt += self.get_conversation_context(chat_id)
+                system_prompt += await self.get_conversation_context(chat_id)
 
-            if not skip_similar:
-                system_prompt_context += self.get_similar_messages(message, message_embedding, message_type, chat_id)
+            if not skip_similar and message_embedding is not None:
+                system_prompt_context += await self.get_similar_messages(
+                    message, message_embedding, message_type, chat_id
+                )
 
             system_prompt += system_prompt_context
 
@@ -462,7 +648,7 @@ class CoreAgent:
                         {"tool_call": tool_name, "processed": False, "args": args}, default=str
                     )  # default=str handles any non-JSON serializable objects
 
-            if not skip_embedding:
+            if not skip_embedding and message_embedding is not None:
                 # moved to post post processing as it is not relevant until finished processing
                 # Create MessageData for incoming message
                 message_data = MessageData(
@@ -480,12 +666,12 @@ class CoreAgent:
                 )
 
                 # Store the incoming message
-                self.message_store.add_message(message_data)
+                query_row = await self.async_message_store.queue_message(message_data)
                 logger.info("Stored message and embedding in database")
                 # Create and store MessageData for the response
                 response_data = MessageData(
                     message=text_response,
-                    embedding=get_embedding(text_response),
+                    embedding=await aget_embedding(text_response),
                     timestamp=datetime.now().isoformat(),
                     message_type="agent_response",
                     chat_id=chat_id,
@@ -496,9 +682,13 @@ class CoreAgent:
                     key_topics=await self._extract_key_topics(text_response),
                     tool_call=tool_back,
                 )
+                # Reference the stored query row instead of storing its embedding again; a query still
+                # waiting in the write-behind queue keeps the inline copy
+                if query_row.done() and not query_row.exception():
+                    response_data.original_message_id = query_row.result()
 
                 # Store the response
-                self.message_store.add_message(response_data)
+                await self.async_message_store.queue_message(response_data)
 
             # Notify other interfaces if needed
             # if source_interface and chat_id:
@@ -689,24 +879,44 @@ class CoreAgent:
             logger.error(f"Error processing reply: {str(e)}")
             return None, None
 
-    def get_knowledge_base(self, message: str, message_embedding: List[float]) -> str:
+    async def _embed_message(self, message: str) -> Optional[List[float]]:
         """
-        Get knowledge base data from the message embedding
+        Embed the incoming message, or return None when the embedding service fails or is too slow
+        """
+        try:
+            message_embedding = await asyncio.wait_for(aget_embedding(message), timeout=EMBEDDING_TIMEOUT_SECONDS)
+        except (EmbeddingError, asyncio.TimeoutError) as e:
+            logger.warning(f"Embedding unavailable, continuing with keyword retrieval only: {str(e) or 'timeout'}")
+            return None
+        logger.info(f"Generated embedding for message: {message[:50]}...")
+        return message_embedding
+
+    async def get_knowledge_base(self, message: str, message_embedding: Optional[List[float]]) -> str:
+        """
+        Get knowledge base data by fusing keyword (BM25) and embedding matches.
+        Without an embedding only keyword matches are used.
         """
-        if message_embedding is None:
-            message_embedding = get_embedding(message)
         system_prompt_context = ""
-        knowledge_base_data = self.message_store.find_similar_messages(
-            message_embedding, threshold=0.6, message_type="knowledge_base"
+        knowledge_base_data = await self.async_message_store.hybrid_search(
+            message, message_embedding, threshold=0.6, message_type="knowledge_base", top_k=KNOWLEDGE_BASE_TOP_K
         )
         logger.info(f"Found {len(knowledge_base_data)} relevant items from knowledge base")
-        if knowledge_base_data:
+
+        # Most relevant first; an entry that does not fit the remaining budget is skipped for smaller ones
+        budget = KNOWLEDGE_BASE_PROMPT_TOKENS
+        facts = []
+        for data in knowledge_base_data:
+            tokens = count_tokens(data["message"])
+            if tokens <= budget:
+                facts.append(data["message"])
+                budget -= tokens
+        if facts:
             system_prompt_context = "\n\nConsider the Following As Facts and use them to answer the question if applicable and relevant:\nKnowledge base data:\n"
-            for data in knowledge_base_data:
-                system_prompt_context += f"{data['message']}\n"
+            for fact in facts:
+                system_prompt_context += f"{fact}\n"
         return system_prompt_context
 
-    def get_conversation_context(self, chat_id: str) -> str:
+    async def get_conversation_context(self, chat_id: str) -> str:
         """
         Get conversation context from the chat ID
         """
@@ -714,7 +924,7 @@ class CoreAgent:
             return ""
         system_prompt_conversation_context = "\n\nPrevious conversation history (in chronological order):\n"
         # Get last 10 messages (will be in DESC order)
-        conversation_messages = self.message_store.find_messages(
+        conversation_messages = await self.async_message_store.find_messages(
             message_type="agent_response", chat_id=chat_id, limit=10
         )
 
@@ -730,16 +940,16 @@ class CoreAgent:
         # print("system_prompt_conversation_context: ", system_prompt_conversation_context)
         return system_prompt_conversation_context
 
-    def get_similar_messages(
+    async def get_similar_messages(
         self, message: str, message_embedding: List[float], message_type: str = None, chat_id: str = None
-    ) -> List[Dict[str, Any]]:
+    ) -> str:
         """
         Get similar messages from the message embedding
         """
         if message_embedding is None:
-            message_embedding = get_embedding(message)
-        similar_messages = self.message_store.find_similar_messages(
-            message_embedding, threshold=0.9, message_type=message_type, chat_id=chat_id
+            message_embedding = await aget_embedding(message)
+        similar_messages = await self.async_message_store.find_similar_messages(
+            message_embedding, threshold=0.9, message_type=message_type, chat_id=chat_id, top_k=10
         )
         logger.info(f"Found {len(similar_messages)} similar messages")
         if similar_messages:
@@ -748,7 +958,7 @@ class CoreAgent:
             message_count = 0
             for similar_msg in similar_messages:
                 # Find the agent's response where this similar message was the original_query
-                agent_responses = self.message_store.find_messages(
+                agent_responses = await self.async_message_store.find_messages(
                     message_type="agent_response", original_query=similar_msg["message"]
                 )
 
@@ -0,0 +1,187 @@
+"""
+Benchmark CoreAgent.handle_message end to end against the offline stub API.
+
+Starts benchmarks.stub_server in-process, points the agent's LLM, embedding and image endpoints at
+it and replays a synthetic workload with a fixed number of messages in flight. The agent runs in a
+temporary working directory with every VECTOR_* setting cleared, so its SQLite files never touch
+the real ones and no configured database is written to. Reported latencies therefore measure the
+agent's own overhead plus the configured stub latency, which makes changes to batching, caching and
+storage comparable without network noise or API cost.
+
+Every message goes through pre-validation (a filter_message tool call), embedding, knowledge base
+and similar-message retrieval, the main completion, response classification, topic extraction
+and storage.
+
+Usage:
+    python -m benchmarks.agent_pipeline --messages 500 --concurrency 16 --latency-ms 150 --jitter-ms 50
+    python -m benchmarks.agent_pipeline --error-rate 0.02 --embedding-cache --output agent.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.stub_server import StubConfig, StubServer
+
+logger = logging.getLogger(__name__)
+
+STUB_MODEL_ID = "stub-model"
+TOPICS = ["token launch", "gas fees", "image generation", "staking rewards", "wallet security", "node setup"]
+TEMPLATES = [
+    "What do you think about {topic}?",
+    "Can you explain {topic} like I'm five?",
+    "Any news on {topic} this week?",
+    "How does {topic} work on Heurist?",
+]
+
+
+def synthetic_messages(count: int, seed: int = 0) -> List[str]:
+    """Short user messages drawn from a small vocabulary, so some of them repeat like real chat traffic"""
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(topic=rng.choice(TOPICS)) for _ in range(count)]
+
+
+def configure_agent(module, server_url: str, embedding_cache: bool) -> None:
+    """
+    Point an imported agents.core_agent at the stub.
+
+    The agent modules reload .env on import and read their endpoints into module constants, so
+    the overrides are applied after the import. Storage settings from .env are dropped, so the
+    agent uses its default SQLite storage in the temporary working directory instead of a
+    configured Postgres database, segment directory or index.
+    """
+    import core.imgen
+
+    for name in [name for name in os.environ if name.startswith("VECTOR_")]:
+        del os.environ[name]
+    os.environ["HEURIST_BASE_URL"] = f"{server_url}/v1"
+    os.environ["HEURIST_API_KEY"] = "stub"
+    os.environ["HEURIST_SEQUENCER_URL"] = server_url
+    if not embedding_cache:
+        os.environ["EMBEDDING_CACHE_PATH"] = ""
+    module.HEURIST_BASE_URL = f"{server_url}/v1"
+    module.HEURIST_API_KEY = "stub"
+    module.LARGE_MODEL_ID = STUB_MODEL_ID
+    module.SMALL_MODEL_ID = STUB_MODEL_ID
+    core.imgen.HEURIST_API_KEY = "stub"
+    core.imgen.HEURIST_SEQUENCER_URL = server_url
+    core.imgen.SEQUENCER_API_ENDPOINT = f"{server_url}/submit_job"
+
+
+async def replay(agent, messages: List[str], concurrency: int, chats: int) -> Dict[str, Any]:
+    """Send every message through handle_message with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings: List[float] = []
+    outcomes = {"replied": 0, "filtered": 0, "failed": 0}
+
+    async def send(i: int, message: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await agent.handle_message(
+                    message, source_interface="benchmark", chat_id=f"chat-{i % chats}", model_id=STUB_MODEL_ID
+                )
+            except Exception as e:
+                logger.warning(f"Message {i} failed: {str(e)}")
+                outcomes["failed"] += 1
+                return
+            timings.append((time.perf_counter() - start) * 1000)
+            outcomes["replied" if result and result[0] else "filtered"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i, message) for i, message in enumerate(messages)))
+    elapsed = time.perf_counter() - start
+    return {
+        **outcomes,
+        "seconds": elapsed,
+        "messages_per_second": len(messages) / elapsed,
+        "mean_ms": float(np.mean(timings)) if timings else None,
+        "p50_ms": float(np.percentile(timings, 50)) if timings else None,
+        "p90_ms": float(np.percentile(timings, 90)) if timings else None,
+        "p99_ms": float(np.percentile(timings, 99)) if timings else None,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = StubServer(
+        StubConfig(
+            port=0,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            tool_call_rate=args.tool_call_rate,
+            seed=args.seed,
+        )
+    )
+    workdir = tempfile.TemporaryDirectory(prefix="agent-bench-")
+    cwd = os.getcwd()
+    with stub:
+        import agents.core_agent as core_agent
+        from core.embedding import get_embedding_cache
+
+        configure_agent(core_agent, stub.url, args.embedding_cache)
+        os.chdir(workdir.name)
+        try:
+            agent = core_agent.CoreAgent()
+            messages = synthetic_messages(args.messages, args.seed)
+
+            async def main() -> Dict[str, Any]:
+                if args.warmup:
+                    await replay(agent, synthetic_messages(args.warmup, args.seed + 1), args.concurrency, args.chats)
+                    stub.stats.clear()
+                result = await replay(agent, messages, args.concurrency, args.chats)
+                await agent.close()
+                return result
+
+            result = asyncio.run(main())
+            cache = get_embedding_cache()
+            result["embedding_cache"] = cache.stats() if cache else None
+            result["stub_requests"] = dict(stub.stats)
+        finally:
+            os.chdir(cwd)
+            workdir.cleanup()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="Messages sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0)
+    parser.add_argument("--embedding-cache", action="store_true", help="Keep the persistent embedding cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "result": run(args),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
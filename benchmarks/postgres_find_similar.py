@@ -0,0 +1,149 @@
+"""
+Benchmark PostgresVectorStorage.find_similar on a local Postgres with pgvector.
+
+Compares the previous threshold-in-WHERE query (always a sequential scan) with the index-friendly
+ORDER BY distance LIMIT k query, for ivfflat and hnsw indexes, and reports recall against the
+exact result. Connection settings come from the VECTOR_DB_* environment variables; the benchmark
+creates and drops its own table.
+
+Usage:
+    python -m benchmarks.postgres_find_similar --rows 100000 --queries 50 --top-k 10
+"""
+
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from core.embedding import PostgresConfig, PostgresVectorStorage
+
+TABLE_NAME = "bench_message_embeddings"
+# Matches the vector(1024) column created by PostgresVectorStorage
+DIM = 1024
+
+
+def legacy_find_similar(storage: PostgresVectorStorage, embedding: list, threshold: float, top_k: int) -> list:
+    """The query used before the rewrite: threshold in WHERE, ORDER BY a computed alias"""
+    with storage.connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT message, 1 - (embedding <=> %s::vector) as similarity
+            FROM {TABLE_NAME}
+            WHERE 1 - (embedding <=> %s::vector) >= %s
+            ORDER BY similarity DESC
+            LIMIT %s
+        """,
+            (embedding, embedding, threshold, top_k),
+        )
+        return [message for message, _ in cur.fetchall()]
+
+
+def populate(storage: PostgresVectorStorage, vectors: np.ndarray, rng: np.random.Generator) -> None:
+    timestamp = datetime.now().isoformat()
+    message_types = rng.choice(
+        ["user_message", "agent_response", "knowledge_base"], len(vectors), p=[0.45, 0.45, 0.1]
+    )
+    with storage.connection() as conn, conn.cursor() as cur:
+        for start in range(0, len(vectors), 5000):
+            execute_values(
+                cur,
+                f"INSERT INTO {TABLE_NAME} (message, embedding, timestamp, message_type, chat_id) VALUES %s",
+                [
+                    (f"message {i}", str(vectors[i].tolist()), timestamp, message_types[i], str(i % 100))
+                    for i in range(start, min(start + 5000, len(vectors)))
+                ],
+                template="(%s, %s::vector, %s, %s, %s)",
+            )
+
+
+def uses_index(storage: PostgresVectorStorage, embedding: list, top_k: int) -> bool:
+    with storage.connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"EXPLAIN SELECT message FROM {TABLE_NAME} ORDER BY embedding <=> %s::vector LIMIT %s", (embedding, top_k)
+        )
+        return any("Index Scan" in row[0] for row in cur.fetchall())
+
+
+def time_queries(search, queries: np.ndarray) -> tuple:
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query.tolist()))
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--probes", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, default=40)
+    args = parser.parse_args()
+
+    logging.getLogger("core.embedding").setLevel(logging.WARNING)
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(args.rows // 1000, 1), DIM))
+    vectors = centers[rng.integers(0, len(centers), args.rows)] + 0.5 * rng.standard_normal((args.rows, DIM))
+    queries = vectors[rng.choice(args.rows, args.queries)] + 0.2 * rng.standard_normal((args.queries, DIM))
+
+    base = dict(
+        host=os.getenv("VECTOR_DB_HOST", "localhost"),
+        port=int(os.getenv("VECTOR_DB_PORT", 5432)),
+        database=os.getenv("VECTOR_DB_NAME"),
+        user=os.getenv("VECTOR_DB_USER"),
+        password=os.getenv("VECTOR_DB_PASSWORD"),
+        table_name=TABLE_NAME,
+    )
+    # Sequential-scan baseline: no index is built below ivfflat_min_rows
+    storage = PostgresVectorStorage(PostgresConfig(**base, ivfflat_min_rows=args.rows + 1))
+    storage.initialize()
+    try:
+        with storage.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {TABLE_NAME}")
+        populate(storage, vectors, rng)
+
+        p50, p99, exact = time_queries(lambda q: legacy_find_similar(storage, q, args.threshold, args.top_k), queries)
+        print(f"rows={args.rows} dim={DIM} queries={args.queries} top_k={args.top_k}")
+        print(f"{'legacy (seq scan)':24s} p50={p50:8.1f} ms  p99={p99:8.1f} ms  recall=1.000")
+        storage.close()
+
+        for index_type in ("ivfflat", "hnsw"):
+            storage = PostgresVectorStorage(
+                PostgresConfig(**base, index_type=index_type, probes=args.probes, ef_search=args.ef_search)
+            )
+            # initialize builds the index now that the table is populated
+            start = time.perf_counter()
+            storage.initialize()
+            build_seconds = time.perf_counter() - start
+
+            p50, p99, results = time_queries(
+                lambda q: [
+                    row["message"] for row in storage.find_similar(q, threshold=args.threshold, top_k=args.top_k)
+                ],
+                queries,
+            )
+            recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(results, exact)])
+            print(
+                f"{index_type + ' index':24s} p50={p50:8.1f} ms  p99={p99:8.1f} ms  recall={recall:.3f}  "
+                f"build={build_seconds:.1f}s  index_scan={uses_index(storage, queries[0].tolist(), args.top_k)}"
+            )
+            with storage.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"DROP INDEX IF EXISTS {TABLE_NAME}_embedding_{index_type}_idx")
+            storage.close()
+    finally:
+        storage = PostgresVectorStorage(PostgresConfig(**base, ivfflat_min_rows=args.rows + 1))
+        storage.initialize()
+        with storage.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark quantized SQLite storage: recall@k, latency and size for float32, float16 and int8.
+
+Each variant stores the same clustered corpus; recall is measured against the float32 result.
+"int8 (no rescore)" uses store_full_precision=False, which is the configuration that cuts disk use.
+
+Usage:
+    python -m benchmarks.quantized_search --rows 20000 --dim 1024 --queries 50 --top-k 10
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from core.embedding import MessageData, SQLiteConfig, SQLiteVectorStorage
+
+VARIANTS = [
+    ("float32", dict()),
+    ("float16 + rescore", dict(quantization="float16")),
+    ("int8 + rescore", dict(quantization="int8")),
+    ("float16 (no rescore)", dict(quantization="float16", store_full_precision=False)),
+    ("int8 (no rescore)", dict(quantization="int8", store_full_precision=False)),
+]
+
+
+def build(db_path: str, vectors: np.ndarray, **config) -> SQLiteVectorStorage:
+    storage = SQLiteVectorStorage(SQLiteConfig(db_path=db_path, **config))
+    storage.initialize()
+    timestamp = datetime.now().isoformat()
+    for start in range(0, len(vectors), 1000):
+        storage.store_embeddings(
+            [
+                MessageData(
+                    message=f"message {i}",
+                    embedding=vectors[i].tolist(),
+                    timestamp=timestamp,
+                    message_type="knowledge_base",
+                    chat_id=None,
+                    source_interface=None,
+                    original_query=None,
+                    original_embedding=None,
+                    response_type=None,
+                    key_topics=None,
+                    tool_call=None,
+                )
+                for i in range(start, min(start + 1000, len(vectors)))
+            ]
+        )
+    # Fold the WAL into the main file so the reported size is comparable
+    storage.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.getLogger("core.embedding").setLevel(logging.WARNING)
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(args.rows // 500, 1), args.dim))
+    vectors = centers[rng.integers(0, len(centers), args.rows)] + 0.7 * rng.standard_normal((args.rows, args.dim))
+    queries = vectors[rng.choice(args.rows, args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim))
+
+    print(f"rows={args.rows} dim={args.dim} queries={args.queries} top_k={args.top_k}")
+    exact = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, config in VARIANTS:
+            db_path = os.path.join(tmp, f"{name.split()[0]}-{len(config)}.db")
+            storage = build(db_path, vectors, **config)
+            latencies, results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                matches = storage.find_similar(query.tolist(), threshold=-1.0, top_k=args.top_k)
+                latencies.append(time.perf_counter() - start)
+                results.append([match["message"] for match in matches])
+            storage.close()
+            if exact is None:
+                exact = results
+            recall = np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(results, exact)])
+            print(
+                f"{name:22s} recall@{args.top_k}={recall:.3f}  p50={np.percentile(latencies, 50) * 1000:8.1f} ms  "
+                f"db={os.path.getsize(db_path) / 2**20:8.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
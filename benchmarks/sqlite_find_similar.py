@@ -0,0 +1,110 @@
+"""
+Benchmark SQLiteVectorStorage.find_similar against the previous JSON text + per-row cosine path.
+
+Usage:
+    python -m benchmarks.sqlite_find_similar --rows 20000 --dim 1024 --queries 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from core.embedding import MessageData, SQLiteConfig, SQLiteVectorStorage
+
+
+def legacy_find_similar(conn: sqlite3.Connection, table_name: str, embedding: list, threshold: float) -> list:
+    """The search path used before binary storage: json.loads and one cosine call per row"""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    results = []
+    for message, embedding_json in conn.execute(f"SELECT message, embedding FROM {table_name}").fetchall():
+        similarity = cosine_similarity([embedding], [json.loads(embedding_json)])[0][0]
+        if similarity >= threshold:
+            results.append({"message": message, "similarity": similarity})
+    results.sort(key=lambda x: x["similarity"], reverse=True)
+    return results
+
+
+def build_legacy_table(db_path: str, vectors: np.ndarray) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE message_embeddings (id INTEGER PRIMARY KEY, message TEXT, embedding TEXT)")
+    conn.executemany(
+        "INSERT INTO message_embeddings (message, embedding) VALUES (?, ?)",
+        ((f"message {i}", json.dumps(vector.tolist())) for i, vector in enumerate(vectors)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def build_binary_table(db_path: str, vectors: np.ndarray) -> SQLiteVectorStorage:
+    storage = SQLiteVectorStorage(SQLiteConfig(db_path=db_path))
+    storage.initialize()
+    timestamp = datetime.now().isoformat()
+    for i, vector in enumerate(vectors):
+        storage.store_embedding(
+            MessageData(
+                message=f"message {i}",
+                embedding=vector.tolist(),
+                timestamp=timestamp,
+                message_type="knowledge_base",
+                chat_id=None,
+                source_interface=None,
+                original_query=None,
+                original_embedding=None,
+                response_type=None,
+                key_topics=None,
+                tool_call=None,
+            )
+        )
+    return storage
+
+
+def time_queries(search, queries: np.ndarray) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        search(query.tolist())
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    args = parser.parse_args()
+
+    logging.getLogger("core.embedding").setLevel(logging.WARNING)
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    queries = vectors[rng.choice(args.rows, args.queries)] + 0.1 * rng.standard_normal((args.queries, args.dim))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        build_legacy_table(legacy_path, vectors)
+        storage = build_binary_table(os.path.join(tmp, "binary.db"), vectors)
+
+        legacy_conn = sqlite3.connect(legacy_path)
+        legacy = time_queries(
+            lambda q: legacy_find_similar(legacy_conn, "message_embeddings", q, args.threshold), queries
+        )
+        binary = time_queries(lambda q: storage.find_similar(q, threshold=args.threshold), queries)
+        legacy_conn.close()
+        storage.close()
+
+    print(f"rows={args.rows} dim={args.dim} queries={args.queries}")
+    print(f"json + per-row cosine : {legacy * 1000:9.1f} ms/query")
+    print(f"float32 blob + matvec : {binary * 1000:9.1f} ms/query")
+    print(f"speedup               : {legacy / binary:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
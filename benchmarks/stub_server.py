@@ -0,0 +1,322 @@
+"""
+Offline OpenAI-compatible stub of the Heurist API for load testing.
+
+Serves the endpoints the agent uses behind HEURIST_BASE_URL and HEURIST_SEQUENCER_URL:
+
+    POST .../chat/completions   chat replies, tool_calls and SSE streaming
+    POST .../embeddings         deterministic unit vectors derived from (model, text)
+    POST .../submit_job         image jobs, answered with a placeholder image URL
+    GET  /stats                 request counters per endpoint
+
+Every response waits a configurable latency (with jitter) and fails with a configurable error
+rate, so retry and timeout paths can be exercised too. The same text always gets the same
+embedding, which keeps similarity search results reproducible between runs.
+
+Tool calls are only made for tools listed in --always-call (by default the pre-validation
+filter) or, at --tool-call-rate, for any offered tool; arguments are filled from the tool's JSON
+schema with neutral values (false, 0, "stub", [], {}).
+
+Usage:
+    python -m benchmarks.stub_server --port 8089 --latency-ms 150 --jitter-ms 50 --error-rate 0.01
+    HEURIST_BASE_URL=http://127.0.0.1:8089/v1 HEURIST_SEQUENCER_URL=http://127.0.0.1:8089 python main_telegram.py
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StubConfig:
+    host: str = "127.0.0.1"
+    # 0 picks a free port
+    port: int = 8089
+    # Delay before every response, uniformly jittered by +/- jitter_ms
+    latency_ms: float = 100.0
+    jitter_ms: float = 0.0
+    # Fraction of requests answered with HTTP 500
+    error_rate: float = 0.0
+    # Embedding dimension, matches BAAI/bge-large-en-v1.5
+    dim: int = 1024
+    # Probability of calling an offered tool that is not in always_call
+    tool_call_rate: float = 0.0
+    always_call: List[str] = field(default_factory=lambda: ["filter_message"])
+    # Delay between streamed chunks
+    stream_chunk_ms: float = 10.0
+    reply: str = "This is a stub reply about {topic}."
+    seed: int = 0
+
+
+def stub_embedding(model: str, text: str, dim: int) -> List[float]:
+    """Deterministic unit vector for (model, text)"""
+    seed = int.from_bytes(hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def stub_arguments(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Neutral values for every required (or, without required, every) property of a JSON schema"""
+    neutral = {"boolean": False, "integer": 0, "number": 0.0, "string": "stub", "array": [], "object": {}}
+    properties = schema.get("properties", {})
+    names = schema.get("required", list(properties))
+    arguments = {}
+    for name in names:
+        spec = properties.get(name, {})
+        if spec.get("enum"):
+            arguments[name] = spec["enum"][0]
+        else:
+            arguments[name] = neutral.get(spec.get("type"), "stub")
+    return arguments
+
+
+class StubServer:
+    """The stub API in a background thread, for use from benchmarks or a terminal"""
+
+    def __init__(self, config: StubConfig = None):
+        self.config = config or StubConfig()
+        self.stats: Dict[str, int] = {}
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.httpd = ThreadingHTTPServer((self.config.host, self.config.port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Stub API listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _chance(self, probability: float) -> bool:
+        with self._lock:
+            return self._random.random() < probability
+
+    def _delay(self) -> None:
+        with self._lock:
+            jitter = self._random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        time.sleep(max(self.config.latency_ms + jitter, 0) / 1000)
+
+    def chat_completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a chat.completion response for a request body"""
+        messages = request.get("messages") or []
+        last = next((message for message in reversed(messages) if message.get("role") == "user"), {})
+        content = last.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        message: Dict[str, Any] = {"role": "assistant", "content": self.config.reply.format(topic=content[:60])}
+        finish_reason = "stop"
+
+        tools = [tool["function"] for tool in request.get("tools") or [] if tool.get("type") == "function"]
+        tool_choice = request.get("tool_choice")
+        forced = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+        if tools and tool_choice != "none":
+            called = [tool for tool in tools if tool["name"] == forced or tool["name"] in self.config.always_call]
+            if not called and (tool_choice == "required" or self._chance(self.config.tool_call_rate)):
+                with self._lock:
+                    called = [self._random.choice(tools)]
+            if called:
+                tool = called[0]
+                message = {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{uuid.uuid4().hex[:24]}",
+                            "type": "function",
+                            "function": {
+                                "name": tool["name"],
+                                "arguments": json.dumps(stub_arguments(tool.get("parameters") or {})),
+                            },
+                        }
+                    ],
+                }
+                finish_reason = "tool_calls"
+
+        prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in messages)
+        completion_tokens = len((message["content"] or "").split())
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "stub",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def stream_chunks(self, completion: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Split a completion into chat.completion.chunk events, word by word"""
+        choice = completion["choices"][0]
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+        deltas: List[Dict[str, Any]] = [{"role": "assistant", "content": ""}]
+        if choice["message"].get("tool_calls"):
+            call = choice["message"]["tool_calls"][0]
+            deltas.append({"tool_calls": [{"index": 0, **call}]})
+        else:
+            words = choice["message"]["content"].split(" ")
+            deltas.extend({"content": word if i == 0 else f" {word}"} for i, word in enumerate(words))
+        chunks = [{**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]} for delta in deltas]
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]})
+        return chunks
+
+    def embeddings(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        texts = request.get("input")
+        texts = [texts] if isinstance(texts, str) else list(texts or [])
+        model = request.get("model") or "stub"
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": stub_embedding(model, str(text), self.config.dim)}
+                for i, text in enumerate(texts)
+            ],
+            "model": model,
+            "usage": {"prompt_tokens": sum(len(str(text).split()) for text in texts), "total_tokens": 0},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send_json(self, status: int, body: Any) -> None:
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/stats":
+                    with server._lock:
+                        self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+
+            def do_POST(self):
+                path = self.path.split("?")[0].rstrip("/")
+                endpoint = next(
+                    (name for name in ("chat/completions", "embeddings", "submit_job") if path.endswith(name)), None
+                )
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+                    return
+                if endpoint is None:
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                    return
+
+                server._count(endpoint)
+                server._delay()
+                if server._chance(server.config.error_rate):
+                    server._count(f"{endpoint} errors")
+                    self._send_json(500, {"error": {"message": "Injected stub failure", "type": "server_error"}})
+                    return
+
+                if endpoint == "embeddings":
+                    self._send_json(200, server.embeddings(request))
+                elif endpoint == "submit_job":
+                    # The sequencer answers with the image URL as a JSON string
+                    job_id = request.get("job_id") or uuid.uuid4().hex
+                    self._send_json(200, f"https://stub.invalid/images/{job_id}.png")
+                elif request.get("stream"):
+                    self._stream(server.chat_completion(request))
+                else:
+                    self._send_json(200, server.chat_completion(request))
+
+            def _stream(self, completion: Dict[str, Any]) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                # No Content-Length: the stream ends when the connection closes
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for chunk in server.stream_chunks(completion):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.config.stream_chunk_ms / 1000)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0)
+    parser.add_argument("--always-call", default="filter_message", help="Comma-separated tools called whenever offered")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    config = StubConfig(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        dim=args.dim,
+        tool_call_rate=args.tool_call_rate,
+        always_call=[name.strip() for name in args.always_call.split(",") if name.strip()],
+        seed=args.seed,
+    )
+    server = StubServer(config)
+    logger.info(f"Stub API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
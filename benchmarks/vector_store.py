@@ -0,0 +1,297 @@
+"""
+Benchmark the vector storage providers as the corpus grows.
+
+Every (provider, size) run builds a fresh synthetic corpus in its own process and measures insert
+throughput, find_similar p50/p99 (unfiltered, one chat, knowledge base only), find_messages
+latency, peak resident memory and size on disk. Results are written as JSON so runs can be
+compared over time.
+
+The corpus mimics the bot's history: user messages and agent responses spread over chats whose
+activity follows a Zipf distribution, responses carrying the query they answer, and ~10%
+knowledge base rows without a chat. Vectors are clustered so nearest neighbours are meaningful.
+
+Postgres providers need the VECTOR_DB_* environment variables and a 1024-dim corpus; the
+benchmark creates and drops its own table. Sizes of 1M rows need several GB of disk and time.
+
+Usage:
+    python -m benchmarks.vector_store --sizes 1000,10000,100000 --providers sqlite,sqlite-int8,segment
+    python -m benchmarks.vector_store --sizes 1000000 --providers sqlite-sharded --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from core.embedding import (
+    MessageData,
+    PostgresConfig,
+    PostgresVectorStorage,
+    SQLiteConfig,
+    SQLiteVectorStorage,
+    VectorStorageProvider,
+)
+from core.segment_store import SegmentConfig, SegmentVectorStorage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+POSTGRES_TABLE = "bench_vector_store"
+# Matches the vector(1024) column created by PostgresVectorStorage
+POSTGRES_DIM = 1024
+BATCH_SIZE = 1000
+SEED = 0
+
+
+def _postgres_config(**overrides) -> PostgresConfig:
+    return PostgresConfig(
+        host=os.getenv("VECTOR_DB_HOST", "localhost"),
+        port=int(os.getenv("VECTOR_DB_PORT", 5432)),
+        database=os.getenv("VECTOR_DB_NAME"),
+        user=os.getenv("VECTOR_DB_USER"),
+        password=os.getenv("VECTOR_DB_PASSWORD"),
+        table_name=POSTGRES_TABLE,
+        **overrides,
+    )
+
+
+# name -> factory(working directory) building an uninitialized provider
+PROVIDERS: Dict[str, Callable[[str], VectorStorageProvider]] = {
+    "sqlite": lambda tmp: SQLiteVectorStorage(SQLiteConfig(db_path=os.path.join(tmp, "bench.db"))),
+    "sqlite-int8": lambda tmp: SQLiteVectorStorage(
+        SQLiteConfig(db_path=os.path.join(tmp, "bench.db"), quantization="int8")
+    ),
+    "sqlite-sharded": lambda tmp: SQLiteVectorStorage(
+        SQLiteConfig(db_path=os.path.join(tmp, "bench.db"), search_workers=os.cpu_count() or 1)
+    ),
+    "segment": lambda tmp: SegmentVectorStorage(SegmentConfig(directory=os.path.join(tmp, "segments"))),
+    "segment-sharded": lambda tmp: SegmentVectorStorage(
+        SegmentConfig(directory=os.path.join(tmp, "segments"), search_workers=os.cpu_count() or 1)
+    ),
+    "postgres-hnsw": lambda tmp: PostgresVectorStorage(_postgres_config(index_type="hnsw")),
+    "postgres-ivfflat": lambda tmp: PostgresVectorStorage(_postgres_config(index_type="ivfflat")),
+}
+
+
+def generate_corpus(rows: int, dim: int) -> Iterator[List[MessageData]]:
+    """
+    Yield the synthetic corpus in batches; the same (rows, dim) always yields the same data.
+
+    Vectors are generated batch by batch so a 1M x 1024 corpus never has to fit in memory.
+    """
+    rng = np.random.default_rng(SEED)
+    centers = rng.standard_normal((max(rows // 500, 8), dim)).astype(np.float32)
+    chats = max(rows // 200, 1)
+    start_time = datetime(2024, 1, 1)
+    last_query: Dict[str, str] = {}
+    for start in range(0, rows, BATCH_SIZE):
+        count = min(BATCH_SIZE, rows - start)
+        vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.standard_normal((count, dim))
+        kinds = rng.choice(["user_message", "agent_response", "knowledge_base"], count, p=[0.45, 0.45, 0.1])
+        chat_ids = np.minimum(rng.zipf(1.3, count), chats) - 1
+        batch = []
+        for offset in range(count):
+            i = start + offset
+            message_type = str(kinds[offset])
+            chat_id = None if message_type == "knowledge_base" else f"chat-{chat_ids[offset]}"
+            message = f"message {i} about topic {i % 97}"
+            original_query = last_query.get(chat_id) if message_type == "agent_response" else None
+            if message_type == "user_message":
+                last_query[chat_id] = message
+            batch.append(
+                MessageData(
+                    message=message,
+                    embedding=vectors[offset].tolist(),
+                    timestamp=(start_time + timedelta(seconds=i)).isoformat(),
+                    message_type=message_type,
+                    chat_id=chat_id,
+                    source_interface="benchmark" if chat_id else "knowledge_base",
+                    original_query=original_query,
+                    original_embedding=None,
+                    response_type="text" if message_type == "agent_response" else None,
+                    key_topics=None,
+                    tool_call=None,
+                )
+            )
+        yield batch
+
+
+def generate_queries(rows: int, dim: int, count: int) -> np.ndarray:
+    """Query vectors drawn near the corpus clusters"""
+    rng = np.random.default_rng(SEED)
+    centers = rng.standard_normal((max(rows // 500, 8), dim)).astype(np.float32)
+    query_rng = np.random.default_rng(SEED + 1)
+    return centers[query_rng.integers(0, len(centers), count)] + 0.5 * query_rng.standard_normal((count, dim))
+
+
+def latency(call: Callable[[Any], Any], inputs: List[Any]) -> Dict[str, float]:
+    """p50/p99/mean latency of call over inputs, in milliseconds"""
+    timings = []
+    for value in inputs:
+        start = time.perf_counter()
+        call(value)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "mean_ms": float(np.mean(timings)),
+    }
+
+
+def disk_usage(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def peak_rss_bytes() -> Any:
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(provider_name: str, rows: int, dim: int, queries: int, top_k: int, threshold: float) -> Dict[str, Any]:
+    """Build one corpus with one provider and measure it; runs in a fresh process"""
+    logging.disable(logging.WARNING)
+    tmp = tempfile.mkdtemp(prefix="vector-bench-")
+    storage = PROVIDERS[provider_name](tmp)
+    try:
+        storage.initialize()
+        if provider_name.startswith("postgres"):
+            with storage.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"TRUNCATE {POSTGRES_TABLE}")
+
+        insert_seconds = 0.0
+        chat_counts: Dict[str, int] = {}
+        original_queries = []
+        for batch in generate_corpus(rows, dim):
+            for message_data in batch:
+                if message_data.chat_id:
+                    chat_counts[message_data.chat_id] = chat_counts.get(message_data.chat_id, 0) + 1
+                if message_data.original_query and len(original_queries) < queries:
+                    original_queries.append(message_data.original_query)
+            start = time.perf_counter()
+            storage.store_embeddings(batch)
+            insert_seconds += time.perf_counter() - start
+        if provider_name.startswith("postgres"):
+            # Indexes are built on initialize once the table holds enough rows
+            start = time.perf_counter()
+            storage.initialize()
+            index_seconds = time.perf_counter() - start
+        else:
+            index_seconds = 0.0
+
+        busiest_chat = max(chat_counts, key=chat_counts.get) if chat_counts else None
+        vectors = [query.tolist() for query in generate_queries(rows, dim, queries)]
+        find_similar = {
+            "all": latency(lambda q: storage.find_similar(q, threshold, top_k=top_k), vectors),
+            "chat": latency(lambda q: storage.find_similar(q, threshold, chat_id=busiest_chat, top_k=top_k), vectors),
+            "knowledge_base": latency(
+                lambda q: storage.find_similar(q, threshold, message_type="knowledge_base", top_k=top_k), vectors
+            ),
+        }
+        find_messages = {
+            "chat_history": latency(lambda _: storage.find_messages(chat_id=busiest_chat, limit=20), range(queries)),
+            "response_lookup": latency(
+                lambda q: storage.find_messages(message_type="agent_response", original_query=q, limit=1),
+                original_queries or [""],
+            ),
+        }
+        return {
+            "provider": provider_name,
+            "rows": rows,
+            "dim": dim,
+            "insert_rows_per_second": rows / insert_seconds if insert_seconds else None,
+            "index_build_seconds": index_seconds,
+            "find_similar": find_similar,
+            "find_messages": find_messages,
+            "busiest_chat_rows": chat_counts.get(busiest_chat, 0),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "disk_bytes": None if provider_name.startswith("postgres") else disk_usage(tmp),
+        }
+    finally:
+        if provider_name.startswith("postgres"):
+            with storage.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+        storage.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def summary(result: Dict[str, Any]) -> str:
+    rss = result["peak_rss_bytes"]
+    return (
+        f"{result['provider']:18s} rows={result['rows']:>8d}  "
+        f"insert={result['insert_rows_per_second'] or 0:9.0f} rows/s  "
+        f"similar p50={result['find_similar']['all']['p50_ms']:8.1f} ms "
+        f"p99={result['find_similar']['all']['p99_ms']:8.1f} ms  "
+        f"history p50={result['find_messages']['chat_history']['p50_ms']:6.2f} ms  "
+        f"rss={rss / 2**20 if rss else float('nan'):7.0f} MiB"
+    )
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(float(size)) for size in value.split(",") if size.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("1000,10000,100000"))
+    parser.add_argument("--providers", default="sqlite,sqlite-int8,sqlite-sharded,segment,segment-sharded")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--output", default=f"vector_store_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    args = parser.parse_args()
+
+    providers = [name.strip() for name in args.providers.split(",") if name.strip()]
+    unknown = [name for name in providers if name not in PROVIDERS]
+    if unknown:
+        parser.error(f"Unknown providers {unknown}, choose from {sorted(PROVIDERS)}")
+    if any(name.startswith("postgres") for name in providers):
+        if not os.getenv("VECTOR_DB_NAME"):
+            parser.error("Postgres providers need the VECTOR_DB_* environment variables")
+        if args.dim != POSTGRES_DIM:
+            parser.error(f"Postgres providers need --dim {POSTGRES_DIM}")
+
+    runs: List[Tuple[str, int]] = [(name, rows) for rows in args.sizes for name in providers]
+    report = {"environment": environment(), "parameters": vars(args), "results": []}
+    for name, rows in runs:
+        # A fresh process per run keeps peak RSS and the page cache state of one run out of the next
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run, name, rows, args.dim, args.queries, args.top_k, args.threshold).result()
+        report["results"].append(result)
+        print(summary(result), flush=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from core.embedding import MessageData, MessageStore, RetentionPolicy, VectorStorageProvider
+
+
+class AsyncVectorStorageProvider(ABC):
+    """Abstract base class for storage providers that can be awaited from the event loop"""
+
+    @abstractmethod
+    async def initialize(self) -> None:
+        """Initialize the storage (create tables, indexes, etc.)"""
+        pass
+
+    @abstractmethod
+    async def store_embedding(self, message_data: MessageData) -> int:
+        """Store a message and its metadata with embedding, returning the id of the new row"""
+        pass
+
+    @abstractmethod
+    async def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        """Store a batch of messages in a single transaction, returning the new row ids in batch order"""
+        pass
+
+    @abstractmethod
+    async def find_similar(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+    ) -> List[Dict[str, Any]]:
+        """Find similar messages based on embedding similarity"""
+        pass
+
+    @abstractmethod
+    async def find_messages(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Find messages matching the given criteria"""
+        pass
+
+    @abstractmethod
+    async def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Fetch stored messages by row id"""
+        pass
+
+    @abstractmethod
+    async def delete_messages(self, ids: List[int]) -> int:
+        """Delete stored messages by row id, returning the number of deleted rows"""
+        pass
+
+    @abstractmethod
+    async def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Keyword search over message text, ranked by relevance"""
+        pass
+
+    @abstractmethod
+    async def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        """Delete every row the retention policy expires, returning their ids"""
+        pass
+
+    @abstractmethod
+    async def compact(self, reindex: bool = False) -> None:
+        """Reclaim the space left by deleted rows"""
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Clean up resources"""
+        pass
+
+
+class _ExecutorMixin:
+    """Runs blocking calls on a dedicated thread pool so they never stall the event loop"""
+
+    def _init_executor(self, max_workers: int, thread_name_prefix: str) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+
+class ExecutorVectorStorage(_ExecutorMixin, AsyncVectorStorageProvider):
+    """
+    Async provider wrapping any blocking VectorStorageProvider.
+
+    Both SQLiteVectorStorage (a connection per thread) and PostgresVectorStorage (a connection
+    pool) are thread-safe, so calls from several chats run concurrently on the executor.
+    """
+
+    def __init__(self, storage_provider: VectorStorageProvider, max_workers: int = 8):
+        self.storage_provider = storage_provider
+        self._init_executor(max_workers, "vector-storage")
+
+    async def initialize(self) -> None:
+        await self._run(self.storage_provider.initialize)
+
+    async def store_embedding(self, message_data: MessageData) -> int:
+        return await self._run(self.storage_provider.store_embedding, message_data)
+
+    async def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        return await self._run(self.storage_provider.store_embeddings, batch)
+
+    async def find_similar(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.storage_provider.find_similar, embedding, threshold, message_type, chat_id, top_k)
+
+    async def find_messages(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict[str, Any]]:
+        return await self._run(
+            self.storage_provider.find_messages, message_type, original_query, chat_id, limit, include_embeddings
+        )
+
+    async def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        return await self._run(self.storage_provider.fetch_messages, ids, include_metadata)
+
+    async def delete_messages(self, ids: List[int]) -> int:
+        return await self._run(self.storage_provider.delete_messages, ids)
+
+    async def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.storage_provider.search_text, text, message_type, chat_id, limit)
+
+    async def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        return await self._run(self.storage_provider.delete_expired, policy)
+
+    async def compact(self, reindex: bool = False) -> None:
+        await self._run(self.storage_provider.compact, reindex)
+
+    async def close(self) -> None:
+        await self._run(self.storage_provider.close)
+        self.executor.shutdown(wait=False)
+
+
+class AsyncMessageStore(_ExecutorMixin):
+    """
+    Awaitable facade over a MessageStore.
+
+    Retrieval and persistence run on a dedicated executor, so a slow query for one chat no longer
+    blocks the event loop that serves every other chat. The wrapped store keeps its cache and
+    index behaviour.
+    """
+
+    def __init__(self, message_store: MessageStore, max_workers: int = 8):
+        self.message_store = message_store
+        self._init_executor(max_workers, "message-store")
+
+    async def add_message(self, message_data: MessageData) -> int:
+        """Add a message and its embedding to the store"""
+        return await self._run(self.message_store.add_message, message_data)
+
+    async def add_messages(self, batch: List[MessageData]) -> List[int]:
+        """Add a batch of messages to the store in a single transaction"""
+        return await self._run(self.message_store.add_messages, batch)
+
+    async def queue_message(self, message_data: MessageData) -> "Future[int]":
+        """Hand a message to the write-behind queue, or write it if write-behind is disabled"""
+        return await self._run(self.message_store.queue_message, message_data)
+
+    async def find_similar_messages(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+    ) -> List[Dict[str, Any]]:
+        """Find messages similar to the given embedding"""
+        return await self._run(
+            self.message_store.find_similar_messages, embedding, threshold, message_type, chat_id, top_k
+        )
+
+    async def find_messages(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict]:
+        """Find messages matching the given criteria"""
+        return await self._run(
+            self.message_store.find_messages, message_type, original_query, chat_id, limit, include_embeddings
+        )
+
+    async def hybrid_search(
+        self,
+        text: str,
+        embedding: Optional[List[float]] = None,
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """Combine keyword and embedding search, keyword-only when no embedding is given"""
+        return await self._run(
+            self.message_store.hybrid_search, text, embedding, threshold, message_type, chat_id, top_k
+        )
+
+    async def close(self) -> None:
+        """Flush queued messages, close the wrapped store and shut down the executor"""
+        await self._run(self.message_store.close)
+        self.executor.shutdown(wait=True)
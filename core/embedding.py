@@ -1,14 +1,46 @@
+import asyncio
+import atexit
+import functools
+import hashlib
 import json
 import logging
 import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import psycopg2
-from openai import OpenAI
-from sklearn.metrics.pairwise import cosine_similarity
+import psycopg2.pool
+from openai import AsyncOpenAI, OpenAI
+from psycopg2.extras import execute_values
+
+from core.embedding_cache import EmbeddingCache, cache_config_from_env
+from core.vector_cache import EmbeddingMatrixCache
+from core.vector_search import (
+    DEFAULT_SHARD_ROWS,
+    cosine_scores,
+    decode_embedding,
+    dequantize_embedding,
+    encode_embedding,
+    fill_norms,
+    quantize_embedding,
+    quantized_cosine_scores,
+    reciprocal_rank_fusion,
+    select_top,
+    sharded_top,
+    stack_embeddings,
+    stack_quantized,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -38,6 +70,32 @@ class PostgresConfig(StorageConfig):
     user: str
     password: str
     table_name: str = "message_embeddings"
+    # Vector index: "ivfflat" or "hnsw"
+    index_type: str = "ivfflat"
+    # ivfflat lists, derived from the row count when the index is built if unset
+    ivfflat_lists: Optional[int] = None
+    # ivfflat is only built once the table has enough rows to train meaningful lists
+    ivfflat_min_rows: int = 1000
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    # Query-time recall/latency knobs, pgvector defaults when unset
+    probes: Optional[int] = None
+    ef_search: Optional[int] = None
+    # Message types that get their own partial vector index, e.g. ["knowledge_base"]
+    partial_index_message_types: List[str] = field(default_factory=list)
+    # Candidates fetched by find_similar when no top_k is given
+    max_results: int = 1000
+    # Connection pool bounds, callers block once max_connections are checked out
+    min_connections: int = 1
+    max_connections: int = 10
+    connect_timeout: int = 10
+    # Pooled connections idle for longer than this are pinged before being handed out
+    health_check_interval: float = 30.0
+    # GIN full-text index on message, required by search_text
+    full_text_search: bool = False
+    # ts_rank_cd score a keyword-only match needs to enter hybrid_search results; ts_rank_cd ignores how
+    # common a word is and adds about 0.1 per matched occurrence, so 0.2 asks for two of them
+    min_text_score: float = 0.2
 
 
 @dataclass
@@ -46,6 +104,33 @@ class SQLiteConfig(StorageConfig):
 
     db_path: str = "embeddings.db"
     table_name: str = "message_embeddings"
+    # Write-ahead logging lets readers run concurrently with the writer
+    wal: bool = True
+    # Page cache size in KiB and memory-mapped I/O size in bytes
+    cache_size_kb: int = 65536
+    mmap_size: int = 268435456
+    # Quantized copy used for the first search pass: None, "float16" or "int8"
+    quantization: Optional[str] = None
+    # Rescore the quantized shortlist with the full-precision vectors
+    rescore: bool = True
+    # Shortlist size is top_k * rescore_factor; candidates within rescore_margin of the threshold are kept
+    rescore_factor: int = 4
+    rescore_margin: float = 0.02
+    # Keep the float32 vector next to the quantized one. Enabled by default so rescoring keeps float32
+    # recall, at 1.25x (int8) to 1.5x (float16) the disk use; disabling it stores an empty embedding,
+    # which ties the table to its quantization mode
+    store_full_precision: bool = True
+    # Vectors are kept outside the table, as for the segment store metadata: rows store an empty
+    # embedding and no quantized codes, and are never taken for reduced-precision rows
+    external_vectors: bool = False
+    # FTS5 (BM25) index on message kept in sync by triggers, required by search_text
+    full_text_search: bool = False
+    # BM25 score a keyword-only match needs to enter hybrid_search results, about one query word found
+    # in under a quarter of the rows
+    min_text_score: float = 1.0
+    # Threads scoring shards of shard_rows rows in parallel during find_similar, 1 scores inline
+    search_workers: int = 1
+    shard_rows: int = DEFAULT_SHARD_ROWS
 
 
 @dataclass
@@ -61,6 +146,125 @@ class MessageData:
     response_type: Optional[str]
     key_topics: Optional[List[str]]
     tool_call: Optional[str]
+    # Row id of the query this message answers; when set, original_embedding is not stored again
+    original_message_id: Optional[int] = None
+    # content_hash() of the source the row was built from, lets ingestion skip unchanged content
+    content_hash: Optional[str] = None
+    # Row id of the first chunk when the source was split into several chunks. Used to find first chunks
+    # whose other chunks were never written; retrieval ranks every chunk on its own
+    parent_id: Optional[int] = None
+
+
+@dataclass
+class RetentionPolicy:
+    # Delete rows older than this many days
+    max_age_days: Optional[float] = None
+    # Keep only the newest rows of every chat_id / message_type
+    max_rows_per_chat: Optional[int] = None
+    max_rows_per_type: Optional[int] = None
+    # Message types that are never deleted
+    exempt_message_types: List[str] = field(default_factory=lambda: ["knowledge_base"])
+    # Seconds between two runs of the compaction job
+    compaction_interval: float = 3600.0
+    # Reclaim space (VACUUM) once this many rows were deleted since the last compaction
+    vacuum_min_deleted: int = 1000
+    # Also rebuild the indexes when compacting
+    reindex: bool = False
+
+
+def content_hash(text: str) -> str:
+    """Hex SHA-256 of a text, the value stored in the content_hash column"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def timestamp_key(value: Any) -> datetime:
+    """
+    Comparable form of a message timestamp.
+
+    SQLite rows and queued messages carry ISO strings, Postgres rows timezone-aware datetimes. Naive
+    values are taken as local time, as Postgres does when it stores them into TIMESTAMPTZ.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.astimezone()
+
+
+# Words too common to say anything about a message, dropped from keyword queries
+_STOPWORDS = frozenset(
+    """
+    a about after all also am an and any are as at be because been before being but by can could did do does
+    doing for from had has have having he her here hers him his how i if in into is it its just me more most
+    my no nor not now of on once only or other our ours out over own same she should so some such than that
+    the their theirs them then there these they this those through to too under until up very was we were
+    what when where which while who whom why will with would you your yours
+    """.split()
+)
+
+
+def _keywords(text: str) -> List[str]:
+    """Distinct lower-cased words of a free-text query without stopwords, safe to pass to a full-text query parser"""
+    return [word for word in dict.fromkeys(re.findall(r"\w+", text.lower())) if word not in _STOPWORDS]
+
+
+def _expired_ids_query(table: str, policy: RetentionPolicy, placeholder: str, cutoff: datetime) -> tuple:
+    """
+    Build the query selecting the ids of every row a retention policy expires.
+
+    Query rows referenced by a response that is kept are left out, they expire once the response does.
+
+    Args:
+        table (str): Table holding the messages
+        policy (RetentionPolicy): The policy to enforce
+        placeholder (str): Parameter placeholder of the driver ("?" or "%s")
+        cutoff: Rows with an older timestamp expire when max_age_days is set
+
+    Returns:
+        tuple: (sql, params), sql is None when the policy expires nothing
+    """
+    exempt_clause, exempt_params = "1=1", []
+    if policy.exempt_message_types:
+        exempt_clause = f"message_type NOT IN ({', '.join([placeholder] * len(policy.exempt_message_types))})"
+        exempt_params = list(policy.exempt_message_types)
+
+    subqueries, params = [], []
+    if policy.max_age_days is not None:
+        subqueries.append(f"SELECT id FROM {table} WHERE {exempt_clause} AND timestamp < {placeholder}")
+        params += exempt_params + [cutoff]
+    for column, max_rows in (("chat_id", policy.max_rows_per_chat), ("message_type", policy.max_rows_per_type)):
+        if max_rows is None:
+            continue
+        subqueries.append(
+            f"""SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY timestamp DESC, id DESC) AS row_rank
+                FROM {table}
+                WHERE {column} IS NOT NULL AND {exempt_clause}
+            ) ranked WHERE row_rank > {placeholder}"""
+        )
+        params += exempt_params + [max_rows]
+    if not subqueries:
+        return None, []
+    # A query row stays while a surviving response still reads its embedding through original_message_id
+    query = f"""WITH expired AS ({" UNION ".join(subqueries)})
+        SELECT id FROM expired WHERE id NOT IN (
+            SELECT original_message_id FROM {table}
+            WHERE original_message_id IS NOT NULL AND id NOT IN (SELECT id FROM expired)
+        )"""
+    return query, params
+
+
+# Fields returned by fetch_messages(include_metadata=True) on top of message, message_type and chat_id
+_METADATA_COLUMNS = [
+    "timestamp",
+    "source_interface",
+    "original_query",
+    "original_message_id",
+    "original_embedding",
+    "response_type",
+    "key_topics",
+    "tool_call",
+    "content_hash",
+    "parent_id",
+]
 
 
 class VectorStorageProvider(ABC):
@@ -72,15 +276,36 @@ class VectorStorageProvider(ABC):
         pass
 
     @abstractmethod
-    def store_embedding(self, message_data: MessageData) -> None:
-        """Store a message and its metadata with embedding"""
+    def store_embedding(self, message_data: MessageData) -> int:
+        """Store a message and its metadata with embedding, returning the id of the new row"""
+        pass
+
+    @abstractmethod
+    def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        """Store a batch of messages in a single transaction, returning the new row ids in batch order"""
         pass
 
     @abstractmethod
     def find_similar(
-        self, embedding: List[float], threshold: float = 0.8, message_type: str = None, chat_id: str = None
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
     ) -> List[Dict[str, Any]]:
-        """Find similar messages based on embedding similarity"""
+        """Find similar messages based on embedding similarity
+
+        Args:
+            embedding (list): The query embedding
+            threshold (float): Minimum similarity (0-1) of returned messages
+            message_type (str, optional): Filter by message type
+            chat_id (str, optional): Filter by chat ID
+            top_k (int, optional): Return at most this many messages, the most similar first
+
+        Returns:
+            List[Dict]: Messages with their similarity, most similar first
+        """
         pass
 
     @abstractmethod
@@ -90,7 +315,12 @@ class VectorStorageProvider(ABC):
 
     @abstractmethod
     def find_messages(
-        self, message_type: str = None, original_query: str = None, chat_id: str = None, limit: int = None
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
     ) -> List[Dict[str, Any]]:
         """Find messages matching the given criteria
 
@@ -99,30 +329,221 @@ class VectorStorageProvider(ABC):
             original_query (str, optional): The original query to match against
             chat_id (str, optional): The chat ID to filter by
             limit (int, optional): Maximum number of messages to return, ordered by most recent
+            include_embeddings (bool): Also load original_embedding, resolved through original_message_id
 
         Returns:
             List[Dict]: List of matching messages with their metadata
         """
         pass
 
+    @abstractmethod
+    def iter_embeddings(
+        self, message_type: str = None, chat_id: str = None, batch_size: int = 1000, after_id: int = 0
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Stream stored embeddings in id order, one batch at a time
+
+        Args:
+            message_type (str, optional): Filter by message type
+            chat_id (str, optional): Filter by chat ID
+            batch_size (int): Number of rows per batch
+            after_id (int): Only return rows with an id greater than this
+
+        Yields:
+            List[Dict]: Rows with id, message, message_type, chat_id and a float32 numpy embedding
+        """
+        pass
+
+    @abstractmethod
+    def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Fetch stored messages by row id
+
+        Args:
+            ids (list): Row ids to fetch
+            include_metadata (bool): Also return every other stored field except the embedding
+
+        Returns:
+            Dict[int, Dict]: Rows with message, message_type and chat_id keyed by id, missing ids are omitted
+        """
+        pass
+
+    @abstractmethod
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        """Find which content hashes are already stored
+
+        Args:
+            hashes (list): content_hash() values to look up
+            message_type (str, optional): Filter by message type
+
+        Returns:
+            Set[str]: The given hashes held by at least one stored row
+        """
+        pass
+
+    @abstractmethod
+    def find_message_timestamps(self, messages: List[str], message_type: str) -> List[Tuple[int, str, Any]]:
+        """Find the stored rows holding the given message texts
+
+        Args:
+            messages (list): Message texts to look up
+            message_type (str): Type of the rows to look up
+
+        Returns:
+            List[Tuple[int, str, Any]]: (id, message, timestamp) of every matching row
+        """
+        pass
+
+    @abstractmethod
+    def find_orphaned_chunks(self, message_type: str) -> List[int]:
+        """Find first chunks whose other chunks were never written
+
+        The first chunk of a split source is stored without content_hash and before the chunks
+        referencing it through parent_id, so one that no row references is left over from an
+        interrupted write. Only meaningful for message types whose other rows all carry a content_hash.
+
+        Args:
+            message_type (str): Type of the chunked rows, e.g. 'knowledge_base'
+
+        Returns:
+            List[int]: Ids of the orphaned first chunks
+        """
+        pass
+
+    @abstractmethod
+    def delete_messages(self, ids: List[int]) -> int:
+        """Delete stored messages by row id, returning the number of deleted rows"""
+        pass
+
+    @abstractmethod
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Keyword search over message text, ranked by relevance
+
+        Only available when the provider was configured with full_text_search, otherwise nothing is found.
+
+        Args:
+            text (str): Free text; every word but stopwords is matched, punctuation is ignored
+            message_type (str, optional): Filter by message type
+            chat_id (str, optional): Filter by chat ID
+            limit (int): Maximum number of messages to return
+
+        Returns:
+            List[Dict]: Messages with id, score and relevant (the score reaches min_text_score), most relevant first
+        """
+        pass
+
+    @abstractmethod
+    def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        """Delete every row the retention policy expires
+
+        Args:
+            policy (RetentionPolicy): Age and row-count limits to enforce
+
+        Returns:
+            List[int]: Ids of the deleted rows
+        """
+        pass
+
+    @abstractmethod
+    def compact(self, reindex: bool = False) -> None:
+        """Reclaim the space left by deleted rows and refresh planner statistics"""
+        pass
+
+
+def _reconnecting(method):
+    """Retry a read once on a fresh pooled connection when the server connection was lost"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.warning(f"PostgreSQL connection lost, retrying on a new connection: {str(e)}")
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 class PostgresVectorStorage(VectorStorageProvider):
+    """
+    pgvector-backed storage sharing a thread-safe connection pool.
+
+    Every call checks its own connection out of the pool, so reads and writes from several
+    chats run in parallel. Broken connections are discarded and replaced transparently.
+    """
+
     def __init__(self, config: PostgresConfig):
         self.config = config
-        self.conn = None
+        self.pool = None
+        self._slots = threading.BoundedSemaphore(config.max_connections)
+        self._last_used: Dict[int, float] = {}
+
+    @contextmanager
+    def connection(self):
+        """Check a healthy connection out of the pool for one transaction, committed on success"""
+        with self._slots:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._discard(conn)
+                conn = None
+                raise
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if conn is not None:
+                    self._last_used[id(conn)] = time.monotonic()
+                    self.pool.putconn(conn)
+
+    def _checkout(self):
+        for _ in range(self.config.max_connections + 1):
+            conn = self.pool.getconn()
+            if conn.closed:
+                self._discard(conn)
+                continue
+            idle = time.monotonic() - self._last_used.get(id(conn), time.monotonic())
+            if idle < self.config.health_check_interval:
+                return conn
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                logger.warning("Discarding broken PostgreSQL connection")
+                self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy PostgreSQL connection")
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
 
     def initialize(self) -> None:
-        """Initialize PostgreSQL connection and create necessary tables"""
+        """Initialize the PostgreSQL connection pool and create necessary tables"""
         try:
-            self.conn = psycopg2.connect(
+            # Query-time index settings are applied to every pooled session at connect time
+            options = []
+            if self.config.probes:
+                options.append(f"-c ivfflat.probes={int(self.config.probes)}")
+            if self.config.ef_search:
+                options.append(f"-c hnsw.ef_search={int(self.config.ef_search)}")
+
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                self.config.min_connections,
+                self.config.max_connections,
                 host=self.config.host,
                 port=self.config.port,
                 database=self.config.database,
                 user=self.config.user,
                 password=self.config.password,
+                connect_timeout=self.config.connect_timeout,
+                options=" ".join(options) or None,
             )
 
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 # Enable pgvector extension
                 cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
 
@@ -143,59 +564,218 @@ class PostgresVectorStorage(VectorStorageProvider):
                         response_type VARCHAR(50),
                         key_topics TEXT[],
                         tool_call TEXT,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        original_message_id INTEGER,
+                        content_hash TEXT,
+                        parent_id INTEGER
                     )
                 """)
+                self._add_original_message_id(cur)
+                self._add_content_hash(cur)
+                cur.execute(f"ALTER TABLE {self.config.table_name} ADD COLUMN IF NOT EXISTS parent_id INTEGER")
+                if self.config.full_text_search:
+                    cur.execute(f"""
+                        CREATE INDEX IF NOT EXISTS {self.config.table_name}_message_fts_idx
+                        ON {self.config.table_name} USING gin (to_tsvector('simple', message))
+                    """)
+
+            self.build_index()
+        except Exception as e:
+            logger.error(f"Failed to initialize PostgreSQL storage: {str(e)}")
+            raise
 
-                # Create vector similarity index
-                cur.execute(f"""
-                    CREATE INDEX IF NOT EXISTS embedding_idx
-                    ON {self.config.table_name}
-                    USING ivfflat (embedding vector_cosine_ops)
-                """)
+    def _add_original_message_id(self, cur) -> None:
+        """Add original_message_id to tables created before it existed and link their responses"""
+        table = self.config.table_name
+        cur.execute(
+            """SELECT 1 FROM information_schema.columns
+            WHERE table_name = %s AND column_name = 'original_message_id'""",
+            (table,),
+        )
+        if cur.fetchone():
+            return
+        logger.info(f"Adding original_message_id to {table}")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN original_message_id INTEGER")
+        # Responses were written right after their query, so the latest matching earlier row is the query
+        cur.execute(f"""
+            UPDATE {table} AS r
+            SET original_message_id = q.query_id, original_embedding = NULL
+            FROM (
+                SELECT r2.id AS response_id, MAX(q2.id) AS query_id
+                FROM {table} r2
+                JOIN {table} q2
+                    ON q2.message = r2.original_query
+                    AND q2.chat_id IS NOT DISTINCT FROM r2.chat_id
+                    AND q2.id < r2.id
+                    AND q2.message_type <> 'agent_response'
+                WHERE r2.message_type = 'agent_response'
+                GROUP BY r2.id
+            ) q
+            WHERE r.id = q.response_id
+        """)
+
+    def _add_content_hash(self, cur) -> None:
+        """Add content_hash to tables created before it existed and index it"""
+        table = self.config.table_name
+        cur.execute(
+            """SELECT data_type FROM information_schema.columns
+            WHERE table_name = %s AND column_name = 'content_hash'""",
+            (table,),
+        )
+        row = cur.fetchone()
+        if not row:
+            logger.info(f"Adding content_hash to {table}")
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN content_hash TEXT")
+            # Knowledge base entries were stored whole, so their hash is the hash of the message
+            cur.execute(f"""
+                UPDATE {table} SET content_hash = encode(sha256(convert_to(message, 'UTF8')), 'hex')
+                WHERE message_type = 'knowledge_base'
+            """)
+        elif row[0] == "character":
+            # Compared with the text[] parameter of find_content_hashes a CHAR(64) column is cast
+            # row by row, which keeps the planner off the index
+            logger.info(f"Changing content_hash of {table} to TEXT")
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN content_hash TYPE TEXT")
+        # Partial: chat history rows carry no hash and would only bloat the index
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {table}_content_hash_idx
+            ON {table} (content_hash, message_type) WHERE content_hash IS NOT NULL
+        """)
+
+    def _index_definitions(self, row_count: int) -> List[tuple]:
+        """(name, method, options, message_type) of every vector index the config asks for"""
+        table = self.config.table_name
+        if self.config.index_type == "hnsw":
+            method = "hnsw"
+            options = f"m = {int(self.config.hnsw_m)}, ef_construction = {int(self.config.hnsw_ef_construction)}"
+        elif self.config.index_type == "ivfflat":
+            method = "ivfflat"
+            # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond
+            lists = self.config.ivfflat_lists or max(
+                1, row_count // 1000 if row_count <= 1_000_000 else int(row_count**0.5)
+            )
+            options = f"lists = {int(lists)}"
+        else:
+            raise ValueError(f"Unsupported index type: {self.config.index_type}")
+
+        definitions = [(f"{table}_embedding_{method}_idx", method, options, None)]
+        for message_type in self.config.partial_index_message_types:
+            suffix = re.sub(r"\W", "_", message_type).lower()
+            definitions.append((f"{table}_{suffix}_embedding_{method}_idx", method, options, message_type))
+        return definitions
 
-            self.conn.commit()
+    def build_index(self, rebuild: bool = False) -> None:
+        """
+        Create the configured vector indexes.
+
+        ivfflat clusters the rows present at build time, so it is skipped until the table holds
+        ivfflat_min_rows rows and should be rebuilt once the table has grown substantially.
+        HNSW needs no training and is created straight away.
+
+        Args:
+            rebuild (bool): Drop and recreate the indexes, including the legacy "embedding_idx"
+        """
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {self.config.table_name}")
+                row_count = cur.fetchone()[0]
+                if self.config.index_type == "ivfflat" and row_count < self.config.ivfflat_min_rows:
+                    logger.info(
+                        f"Deferring ivfflat index until {self.config.ivfflat_min_rows} rows ({row_count} now)"
+                    )
+                    return
+
+                definitions = self._index_definitions(row_count)
+                if rebuild:
+                    cur.execute("DROP INDEX IF EXISTS embedding_idx")
+                    for name, _, _, _ in definitions:
+                        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+                for name, method, options, message_type in definitions:
+                    where_clause = "WHERE message_type = %s" if message_type else ""
+                    cur.execute(
+                        f"""
+                        CREATE INDEX IF NOT EXISTS {name}
+                        ON {self.config.table_name}
+                        USING {method} (embedding vector_cosine_ops)
+                        WITH ({options})
+                        {where_clause}
+                    """,
+                        (message_type,) if message_type else None,
+                    )
+            logger.info(f"Vector indexes ready on {self.config.table_name} ({self.config.index_type})")
         except Exception as e:
-            logger.error(f"Failed to initialize PostgreSQL storage: {str(e)}")
+            logger.error(f"Failed to build vector index: {str(e)}")
             raise
 
-    def store_embedding(self, message_data: MessageData) -> None:
+    def store_embedding(self, message_data: MessageData) -> int:
         """Store a message and its embedding in PostgreSQL"""
+        return self.store_embeddings([message_data])[0]
+
+    def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        """Store a batch of messages with multi-row INSERTs (execute_values) in one transaction"""
+        if not batch:
+            return []
         try:
-            with self.conn.cursor() as cur:
-                cur.execute(
+            with self.connection() as conn, conn.cursor() as cur:
+                row_ids = execute_values(
+                    cur,
                     f"""INSERT INTO {self.config.table_name}
-                    (message, embedding, timestamp, message_type, chat_id,
-                    source_interface, original_query, original_embedding, response_type, key_topics, tool_call)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (
-                        message_data.message,
-                        message_data.embedding,
-                        message_data.timestamp,
-                        message_data.message_type,
-                        message_data.chat_id,
-                        message_data.source_interface,
-                        message_data.original_query,
-                        message_data.original_embedding,
-                        message_data.response_type,
-                        message_data.key_topics,
-                        message_data.tool_call,
-                    ),
+                    (message, embedding, timestamp, message_type, chat_id, source_interface, original_query,
+                    original_embedding, response_type, key_topics, tool_call, original_message_id, content_hash,
+                    parent_id)
+                    VALUES %s
+                    RETURNING id""",
+                    [
+                        (
+                            message_data.message,
+                            message_data.embedding,
+                            message_data.timestamp,
+                            message_data.message_type,
+                            message_data.chat_id,
+                            message_data.source_interface,
+                            message_data.original_query,
+                            # The query row already holds this vector
+                            None if message_data.original_message_id else message_data.original_embedding,
+                            message_data.response_type,
+                            message_data.key_topics,
+                            message_data.tool_call,
+                            message_data.original_message_id,
+                            message_data.content_hash,
+                            message_data.parent_id,
+                        )
+                        for message_data in batch
+                    ],
+                    template="(%s, %s::vector, %s, %s, %s, %s, %s, %s::vector, %s, %s, %s, %s, %s, %s)",
+                    page_size=500,
+                    fetch=True,
                 )
-            self.conn.commit()
-            logger.info("Successfully stored message with metadata in database")
+            logger.info(f"Successfully stored {len(batch)} message(s) with metadata in database")
+            return [row_id for (row_id,) in row_ids]
         except Exception as e:
             logger.error(f"Failed to store message: {str(e)}")
             raise
 
+    @_reconnecting
     def find_similar(
-        self, embedding: List[float], threshold: float = 0.8, message_type: str = None, chat_id: str = None
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
     ) -> List[Dict[str, Any]]:
-        """Find similar messages using vector similarity search"""
+        """
+        Find similar messages using vector similarity search.
+
+        The inner query orders by the raw distance operator with a LIMIT so pgvector can answer it
+        from the ivfflat/hnsw index; the threshold is applied to those candidates afterwards. Without
+        top_k at most config.max_results candidates are considered.
+        """
         try:
-            with self.conn.cursor() as cur:
-                query_conditions = ["1 - (embedding <=> %s::vector) >= %s"]
-                query_params = [embedding, embedding, threshold]
+            with self.connection() as conn, conn.cursor() as cur:
+                query_conditions = []
+                query_params = [embedding]
 
                 if message_type:
                     query_conditions.append("message_type = %s")
@@ -205,14 +785,21 @@ class PostgresVectorStorage(VectorStorageProvider):
                     query_conditions.append("chat_id = %s")
                     query_params.append(chat_id)
 
-                where_clause = " AND ".join(query_conditions)
+                where_clause = " AND ".join(query_conditions) if query_conditions else "TRUE"
+                query_params += [embedding, top_k if top_k is not None else self.config.max_results, 1 - threshold]
 
                 cur.execute(
                     f"""
-                    SELECT message, 1 - (embedding <=> %s::vector) as similarity
-                    FROM {self.config.table_name}
-                    WHERE {where_clause}
-                    ORDER BY similarity DESC
+                    SELECT message, 1 - distance AS similarity
+                    FROM (
+                        SELECT message, embedding <=> %s::vector AS distance
+                        FROM {self.config.table_name}
+                        WHERE {where_clause}
+                        ORDER BY embedding <=> %s::vector
+                        LIMIT %s
+                    ) candidates
+                    WHERE distance <= %s
+                    ORDER BY distance
                 """,
                     tuple(query_params),
                 )
@@ -226,40 +813,54 @@ class PostgresVectorStorage(VectorStorageProvider):
             raise
 
     def close(self) -> None:
-        """Close PostgreSQL connection"""
-        if self.conn:
-            self.conn.close()
+        """Close all pooled PostgreSQL connections"""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
 
+    @_reconnecting
     def find_messages(
-        self, message_type: str = None, original_query: str = None, chat_id: str = None, limit: int = None
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
     ) -> List[Dict[str, Any]]:
-        """Find messages matching the given criteria"""
+        """Find messages matching the given criteria, loading original_embedding only when asked to"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 query_conditions = []
                 query_params = []
 
                 if message_type:
-                    query_conditions.append("message_type = %s")
+                    query_conditions.append("m.message_type = %s")
                     query_params.append(message_type)
 
                 if original_query:
-                    query_conditions.append("original_query = %s")
+                    query_conditions.append("m.original_query = %s")
                     query_params.append(original_query)
 
                 if chat_id:
-                    query_conditions.append("chat_id = %s")
+                    query_conditions.append("m.chat_id = %s")
                     query_params.append(chat_id)
 
                 where_clause = " AND ".join(query_conditions) if query_conditions else "1=1"
                 limit_clause = f" LIMIT {limit}" if limit else ""
+                # Responses reference their query row instead of storing its embedding again
+                embedding_column, join_clause = "NULL", ""
+                if include_embeddings:
+                    embedding_column = "COALESCE(m.original_embedding, q.embedding)"
+                    join_clause = f"LEFT JOIN {self.config.table_name} q ON q.id = m.original_message_id"
 
                 cur.execute(
                     f"""
-                    SELECT message, timestamp, source_interface, response_type, key_topics, original_query, original_embedding, tool_call
-                    FROM {self.config.table_name}
+                    SELECT m.message, m.timestamp, m.source_interface, m.response_type, m.key_topics, m.original_query,
+                        m.original_message_id, {embedding_column}, m.tool_call
+                    FROM {self.config.table_name} m
+                    {join_clause}
                     WHERE {where_clause}
-                    ORDER BY timestamp DESC
+                    ORDER BY m.timestamp DESC
                     {limit_clause}
                 """,
                     tuple(query_params),
@@ -273,6 +874,7 @@ class PostgresVectorStorage(VectorStorageProvider):
                     response_type,
                     key_topics,
                     orig_query,
+                    orig_message_id,
                     orig_embedding,
                     tool_call,
                 ) in cur.fetchall():
@@ -284,6 +886,7 @@ class PostgresVectorStorage(VectorStorageProvider):
                             "response_type": response_type,
                             "key_topics": key_topics,
                             "original_query": orig_query,
+                            "original_message_id": orig_message_id,
                             "original_embedding": orig_embedding,
                             "tool_call": tool_call,
                         }
@@ -293,78 +896,496 @@ class PostgresVectorStorage(VectorStorageProvider):
             logger.error(f"Failed to find messages: {str(e)}")
             raise
 
+    def iter_embeddings(
+        self, message_type: str = None, chat_id: str = None, batch_size: int = 1000, after_id: int = 0
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Stream stored embeddings using keyset pagination on id"""
+        query_conditions = ["id > %s"]
+        filter_params = []
+
+        if message_type:
+            query_conditions.append("message_type = %s")
+            filter_params.append(message_type)
+
+        if chat_id:
+            query_conditions.append("chat_id = %s")
+            filter_params.append(chat_id)
+
+        where_clause = " AND ".join(query_conditions)
+        last_id = after_id
+        while True:
+            try:
+                with self.connection() as conn, conn.cursor() as cur:
+                    cur.execute(
+                        f"""
+                        SELECT id, message, message_type, chat_id, embedding::text
+                        FROM {self.config.table_name}
+                        WHERE {where_clause}
+                        ORDER BY id
+                        LIMIT %s
+                    """,
+                        tuple([last_id] + filter_params + [batch_size]),
+                    )
+                    rows = cur.fetchall()
+            except Exception as e:
+                logger.error(f"Failed to read embeddings: {str(e)}")
+                raise
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [
+                {
+                    "id": row_id,
+                    "message": message,
+                    "message_type": row_message_type,
+                    "chat_id": row_chat_id,
+                    "embedding": decode_embedding(embedding),
+                }
+                for row_id, message, row_message_type, row_chat_id, embedding in rows
+            ]
+
+    @_reconnecting
+    def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Fetch stored messages by row id"""
+        if not ids:
+            return {}
+        columns = ["message", "message_type", "chat_id"] + (_METADATA_COLUMNS if include_metadata else [])
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT id, {', '.join(columns)} FROM {self.config.table_name} WHERE id = ANY(%s)",
+                    (list(ids),),
+                )
+                results = {row[0]: dict(zip(columns, row[1:])) for row in cur.fetchall()}
+            for row in results.values():
+                if row.get("original_embedding"):
+                    row["original_embedding"] = json.loads(row["original_embedding"])
+            return results
+        except Exception as e:
+            logger.error(f"Failed to fetch messages: {str(e)}")
+            raise
+
+    @_reconnecting
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        """Find which content hashes are already stored"""
+        if not hashes:
+            return set()
+        query = f"SELECT DISTINCT content_hash FROM {self.config.table_name} WHERE content_hash = ANY(%s)"
+        params: List[Any] = [list(hashes)]
+        if message_type:
+            query += " AND message_type = %s"
+            params.append(message_type)
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(query, params)
+                return {row[0] for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"Failed to look up content hashes: {str(e)}")
+            raise
+
+    def find_message_timestamps(self, messages: List[str], message_type: str) -> List[Tuple[int, str, Any]]:
+        """Find the stored rows holding the given message texts"""
+        if not messages:
+            return []
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    f"""SELECT id, message, timestamp FROM {self.config.table_name}
+                    WHERE message_type = %s AND message = ANY(%s)""",
+                    (message_type, list(messages)),
+                )
+                return cur.fetchall()
+        except Exception as e:
+            logger.error(f"Failed to look up messages: {str(e)}")
+            raise
+
+    def find_orphaned_chunks(self, message_type: str) -> List[int]:
+        """Find first chunks whose other chunks were never written"""
+        table = self.config.table_name
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    f"""SELECT id FROM {table}
+                    WHERE message_type = %s AND content_hash IS NULL
+                    AND id NOT IN (SELECT parent_id FROM {table} WHERE parent_id IS NOT NULL)""",
+                    (message_type,),
+                )
+                return [row_id for (row_id,) in cur.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to look up orphaned chunks: {str(e)}")
+            raise
+
+    def delete_messages(self, ids: List[int]) -> int:
+        """Delete stored messages by row id"""
+        if not ids:
+            return 0
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.config.table_name} WHERE id = ANY(%s)", (list(ids),))
+                return cur.rowcount
+        except Exception as e:
+            logger.error(f"Failed to delete messages: {str(e)}")
+            raise
+
+    @_reconnecting
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Keyword search ranked by ts_rank_cd, served by the GIN index on to_tsvector(message)"""
+        keywords = _keywords(text)
+        if not self.config.full_text_search or not keywords:
+            return []
+        query_conditions = ["to_tsvector('simple', message) @@ query"]
+        query_params: List[Any] = [" | ".join(keywords)]
+        if message_type:
+            query_conditions.append("message_type = %s")
+            query_params.append(message_type)
+        if chat_id:
+            query_conditions.append("chat_id = %s")
+            query_params.append(chat_id)
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT id, message, ts_rank_cd(to_tsvector('simple', message), query) AS score
+                    FROM {self.config.table_name}, to_tsquery('simple', %s) query
+                    WHERE {" AND ".join(query_conditions)}
+                    ORDER BY score DESC
+                    LIMIT %s
+                """,
+                    tuple(query_params + [limit]),
+                )
+                return [
+                    {"id": row_id, "message": message, "score": score, "relevant": score >= self.config.min_text_score}
+                    for row_id, message, score in cur.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Failed to search messages: {str(e)}")
+            raise
+
+    def collection(self, name: str, **overrides) -> "PostgresVectorStorage":
+        """
+        Storage for a named collection in its own table, e.g. knowledge_base_embeddings.
+
+        Args:
+            name (str): Collection name, used as the table prefix
+            **overrides: PostgresConfig fields that differ for this collection (index type, pool size, ...)
+        """
+        return PostgresVectorStorage(replace(self.config, **{"table_name": f"{name}_embeddings", **overrides}))
+
+    def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        """Delete expired rows in one transaction"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=policy.max_age_days or 0)
+        query, params = _expired_ids_query(self.config.table_name, policy, "%s", cutoff)
+        if query is None:
+            return []
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.config.table_name} WHERE id IN ({query}) RETURNING id", params)
+                deleted = [row_id for (row_id,) in cur.fetchall()]
+            logger.info(f"Deleted {len(deleted)} expired message(s) from {self.config.table_name}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Failed to delete expired messages: {str(e)}")
+            raise
+
+    def compact(self, reindex: bool = False) -> None:
+        """VACUUM ANALYZE the table, optionally rebuilding its indexes without blocking writes"""
+        try:
+            with self.connection() as conn:
+                # VACUUM and REINDEX CONCURRENTLY cannot run inside a transaction block
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(f"VACUUM ANALYZE {self.config.table_name}")
+                        if reindex:
+                            cur.execute(f"REINDEX TABLE CONCURRENTLY {self.config.table_name}")
+                finally:
+                    conn.autocommit = False
+            logger.info(f"Compacted {self.config.table_name}")
+        except Exception as e:
+            logger.error(f"Failed to compact PostgreSQL storage: {str(e)}")
+            raise
+
 
 class SQLiteVectorStorage(VectorStorageProvider):
+    """
+    SQLite-backed storage that is safe to share between threads.
+
+    Every thread gets its own connection so readers run concurrently under WAL, while writes are
+    serialized in-process to avoid busy retries. In-memory databases cannot be shared between
+    connections and use a single connection for all threads.
+    """
+
     def __init__(self, config: SQLiteConfig):
         self.config = config
-        self.conn = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._search_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def search_executor(self) -> Optional[ThreadPoolExecutor]:
+        """Pool for sharded scoring, started on first use when search_workers > 1"""
+        if self.config.search_workers > 1 and self._search_executor is None:
+            with self._connections_lock:
+                if self._search_executor is None:
+                    self._search_executor = ThreadPoolExecutor(
+                        max_workers=self.config.search_workers, thread_name_prefix="sqlite-search"
+                    )
+        return self._search_executor
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's connection, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._connections_lock:
+                if self.config.db_path == ":memory:" and self._connections:
+                    conn = self._connections[0]
+                else:
+                    conn = sqlite3.connect(self.config.db_path, check_same_thread=False, timeout=30)
+                    self._apply_pragmas(conn)
+                    self._connections.append(conn)
+            self._local.conn = conn
+        return conn
 
     def initialize(self) -> None:
-        """Initialize SQLite connection and create necessary tables"""
+        """Initialize SQLite connection, apply pragmas and migrate the table to the latest schema"""
         try:
-            self.conn = sqlite3.connect(self.config.db_path, check_same_thread=False)
-            with self.conn:
-                cur = self.conn.cursor()
-                cur.execute(f"""
-                    CREATE TABLE IF NOT EXISTS {self.config.table_name} (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message TEXT NOT NULL,
-                        embedding TEXT NOT NULL,
-                        timestamp TEXT NOT NULL,
-                        message_type TEXT NOT NULL,
-                        chat_id TEXT,
-                        source_interface TEXT,
-                        original_query TEXT,
-                        original_embedding TEXT,
-                        response_type TEXT,
-                        key_topics TEXT,
-                        tool_call TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+            self._migrate()
+            self._check_quantization()
+            if self.config.full_text_search:
+                self._create_full_text_index()
             logger.info(f"Initialized SQLite storage at {self.config.db_path}")
         except Exception as e:
             logger.error(f"Failed to initialize SQLite storage: {str(e)}")
             raise
 
-    def store_embedding(self, message_data: MessageData) -> None:
-        """Store a message and its embedding in SQLite"""
-        try:
-            embedding_json = json.dumps(message_data.embedding)
-            original_embedding_json = (
-                json.dumps(message_data.original_embedding) if message_data.original_embedding else None
+    def _check_quantization(self) -> None:
+        """
+        Refuse a quantization setting that cannot read the rows stored without full precision.
+
+        Those rows hold an empty embedding and only their quantized codes, which are decoded with
+        the configured mode: disabling quantization or switching mode would misread them. Rows with
+        an empty embedding and no codes keep their vector elsewhere and are not checked.
+        """
+        if self.config.external_vectors:
+            return
+        # int8 codes are stored with a scale, float16 codes without
+        modes = {
+            "int8" if scaled else "float16"
+            for (scaled,) in self.conn.execute(
+                f"""SELECT DISTINCT embedding_scale IS NOT NULL FROM {self.config.table_name}
+                WHERE length(embedding) = 0 AND embedding_q IS NOT NULL"""
+            )
+        }
+        if modes - {self.config.quantization}:
+            raise ValueError(
+                f"{self.config.table_name} has rows stored without full precision as {', '.join(sorted(modes))}, "
+                f"which quantization={self.config.quantization!r} cannot read"
             )
-            key_topics_json = json.dumps(message_data.key_topics) if message_data.key_topics else None
 
-            with self.conn:
-                self.conn.execute(
+    def _apply_pragmas(self, conn: sqlite3.Connection) -> None:
+        if self.config.wal and self.config.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+            # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(self.config.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.config.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+    def _migrations(self) -> List[Callable[[sqlite3.Cursor], None]]:
+        """Schema migrations in order, a table's schema version is the number of migrations applied to it"""
+        return [
+            self._create_table,
+            self._add_embedding_norm,
+            self._add_lookup_indexes,
+            self._add_quantized_columns,
+            self._add_original_message_id,
+            self._add_content_hash,
+            self._add_parent_id,
+            self._add_reduced_precision_index,
+        ]
+
+    def _migrate(self) -> None:
+        """Bring the table up to the latest schema version, upgrading existing databases in place"""
+        table = self.config.table_name
+        migrations = self._migrations()
+        with self._write_lock, self.conn:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS schema_versions (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            row = cur.execute("SELECT version FROM schema_versions WHERE table_name = ?", (table,)).fetchone()
+            version = row[0] if row else 0
+            if version > len(migrations):
+                raise RuntimeError(f"{table} has schema version {version}, newer than this code supports")
+            for number, migration in enumerate(migrations[version:], start=version + 1):
+                logger.info(f"Migrating {table} to schema version {number}")
+                migration(cur)
+            cur.execute("INSERT OR REPLACE INTO schema_versions VALUES (?, ?)", (table, len(migrations)))
+
+    def _create_table(self, cur: sqlite3.Cursor) -> None:
+        # NOTE: embeddings are raw float32 blobs, rows written by older versions hold JSON text
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.config.table_name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                embedding_norm REAL,
+                timestamp TEXT NOT NULL,
+                message_type TEXT NOT NULL,
+                chat_id TEXT,
+                source_interface TEXT,
+                original_query TEXT,
+                original_embedding BLOB,
+                response_type TEXT,
+                key_topics TEXT,
+                tool_call TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def _add_embedding_norm(self, cur: sqlite3.Cursor) -> None:
+        # Tables created before binary storage have no norm column
+        columns = [row[1] for row in cur.execute(f"PRAGMA table_info({self.config.table_name})")]
+        if "embedding_norm" not in columns:
+            cur.execute(f"ALTER TABLE {self.config.table_name} ADD COLUMN embedding_norm REAL")
+
+    def _add_lookup_indexes(self, cur: sqlite3.Cursor) -> None:
+        # Serves find_similar filters and the per-chat "latest N messages" history query
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {self.config.table_name}_type_chat_time_idx
+            ON {self.config.table_name} (message_type, chat_id, timestamp)
+        """)
+        # Serves the agent_response lookup by original_query in get_similar_messages
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {self.config.table_name}_original_query_idx
+            ON {self.config.table_name} (original_query)
+        """)
+        cur.execute(f"ANALYZE {self.config.table_name}")
+
+    def _add_quantized_columns(self, cur: sqlite3.Cursor) -> None:
+        # Quantized codes are only written when SQLiteConfig.quantization is set
+        cur.execute(f"ALTER TABLE {self.config.table_name} ADD COLUMN embedding_q BLOB")
+        cur.execute(f"ALTER TABLE {self.config.table_name} ADD COLUMN embedding_scale REAL")
+
+    def _add_original_message_id(self, cur: sqlite3.Cursor) -> None:
+        # Responses reference their query row instead of storing a second copy of its embedding
+        table = self.config.table_name
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN original_message_id INTEGER")
+        # Link existing responses to the latest earlier row holding their query, then drop the copies
+        cur.execute(f"CREATE INDEX {table}_link_tmp_idx ON {table} (chat_id, message)")
+        cur.execute(f"""
+            UPDATE {table} AS r SET original_message_id = (
+                SELECT MAX(q.id) FROM {table} q
+                WHERE q.chat_id IS r.chat_id AND q.message = r.original_query
+                AND q.id < r.id AND q.message_type <> 'agent_response'
+            )
+            WHERE r.message_type = 'agent_response' AND r.original_query IS NOT NULL
+        """)
+        cur.execute(f"UPDATE {table} SET original_embedding = NULL WHERE original_message_id IS NOT NULL")
+        cur.execute(f"DROP INDEX {table}_link_tmp_idx")
+
+    def _add_content_hash(self, cur: sqlite3.Cursor) -> None:
+        # Lets knowledge base ingestion skip unchanged entries without embedding them again
+        table = self.config.table_name
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN content_hash TEXT")
+        # Knowledge base entries were stored whole, so their hash is the hash of the message
+        self.conn.create_function("content_hash", 1, content_hash, deterministic=True)
+        cur.execute(f"UPDATE {table} SET content_hash = content_hash(message) WHERE message_type = 'knowledge_base'")
+        # Partial: chat history rows carry no hash and would only bloat the index
+        cur.execute(f"""
+            CREATE INDEX {table}_content_hash_idx ON {table} (content_hash, message_type)
+            WHERE content_hash IS NOT NULL
+        """)
+
+    def _add_parent_id(self, cur: sqlite3.Cursor) -> None:
+        # Chunks of a split source reference the row of its first chunk
+        cur.execute(f"ALTER TABLE {self.config.table_name} ADD COLUMN parent_id INTEGER")
+
+    def _add_reduced_precision_index(self, cur: sqlite3.Cursor) -> None:
+        # Keeps the quantization check in initialize from scanning the table, such rows are rare
+        table = self.config.table_name
+        cur.execute(f"""
+            CREATE INDEX {table}_reduced_precision_idx ON {table} (embedding_scale)
+            WHERE length(embedding) = 0 AND embedding_q IS NOT NULL
+        """)
+
+    def store_embedding(self, message_data: MessageData) -> int:
+        """Store a message and its embedding in SQLite"""
+        return self.store_embeddings([message_data])[0]
+
+    def _row_params(self, message_data: MessageData) -> tuple:
+        embedding_q, embedding_scale = None, None
+        if self.config.external_vectors:
+            embedding_blob, embedding_norm = b"", None
+        else:
+            embedding_blob, embedding_norm = encode_embedding(message_data.embedding)
+        if self.config.quantization and not self.config.external_vectors:
+            embedding_q, embedding_scale = quantize_embedding(message_data.embedding, self.config.quantization)
+            if not self.config.store_full_precision:
+                embedding_blob = b""
+        original_embedding_blob = None
+        # The query row already holds this vector when the response references it
+        if message_data.original_embedding and not message_data.original_message_id:
+            original_embedding_blob = encode_embedding(message_data.original_embedding)[0]
+        key_topics_json = json.dumps(message_data.key_topics) if message_data.key_topics else None
+        return (
+            message_data.message,
+            embedding_blob,
+            embedding_norm,
+            message_data.timestamp,
+            message_data.message_type,
+            message_data.chat_id,
+            message_data.source_interface,
+            message_data.original_query,
+            original_embedding_blob,
+            message_data.response_type,
+            key_topics_json,
+            message_data.tool_call,
+            embedding_q,
+            embedding_scale,
+            message_data.original_message_id,
+            message_data.content_hash,
+            message_data.parent_id,
+        )
+
+    def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        """Store a batch of messages with executemany in a single transaction"""
+        if not batch:
+            return []
+        try:
+            rows = [self._row_params(message_data) for message_data in batch]
+            with self._write_lock, self.conn:
+                self.conn.executemany(
                     f"""INSERT INTO {self.config.table_name}
-                    (message, embedding, timestamp, message_type, chat_id,
-                    source_interface, original_query, original_embedding, response_type, key_topics, tool_call)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        message_data.message,
-                        embedding_json,
-                        message_data.timestamp,
-                        message_data.message_type,
-                        message_data.chat_id,
-                        message_data.source_interface,
-                        message_data.original_query,
-                        original_embedding_json,
-                        message_data.response_type,
-                        key_topics_json,
-                        message_data.tool_call,
-                    ),
+                    (message, embedding, embedding_norm, timestamp, message_type, chat_id, source_interface,
+                    original_query, original_embedding, response_type, key_topics, tool_call, embedding_q,
+                    embedding_scale, original_message_id, content_hash, parent_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows,
                 )
-            logger.info("Successfully stored message with metadata in database")
+                # AUTOINCREMENT ids are consecutive while the transaction holds the write lock
+                last_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            logger.info(f"Successfully stored {len(batch)} message(s) with metadata in database")
+            return list(range(last_id - len(batch) + 1, last_id + 1))
         except Exception as e:
             logger.error(f"Failed to store message: {str(e)}")
             raise
 
     def find_similar(
-        self, embedding: List[float], threshold: float = 0.8, message_type: str = None, chat_id: str = None
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
     ) -> List[Dict[str, Any]]:
-        """Find similar messages using cosine similarity"""
+        """Find similar messages by scoring all candidate rows in one matrix-vector product"""
         try:
             with self.conn:
                 cur = self.conn.cursor()
@@ -380,31 +1401,152 @@ class SQLiteVectorStorage(VectorStorageProvider):
                     query_params.append(chat_id)
 
                 where_clause = " AND ".join(query_conditions) if query_conditions else "1=1"
+                if self.config.quantization:
+                    return self._find_similar_quantized(embedding, threshold, where_clause, query_params, top_k)
 
                 cur.execute(
-                    f"SELECT message, embedding FROM {self.config.table_name} WHERE {where_clause}", tuple(query_params)
+                    f"SELECT message, embedding, embedding_norm FROM {self.config.table_name} WHERE {where_clause}",
+                    tuple(query_params),
                 )
-                results = []
-                for message, embedding_json in cur.fetchall():
-                    stored_embedding = json.loads(embedding_json)
-                    similarity = compute_similarity(embedding, stored_embedding)
-                    if similarity >= threshold:
-                        results.append({"message": message, "similarity": similarity})
-                results.sort(key=lambda x: x["similarity"], reverse=True)
-                return results
+                rows = cur.fetchall()
+            if not rows:
+                return []
+
+            messages, embeddings, norms = zip(*rows)
+            matrix = stack_embeddings(list(embeddings))
+            matches, scores = sharded_top(
+                matrix,
+                fill_norms(matrix, list(norms)),
+                embedding,
+                threshold,
+                top_k,
+                self.search_executor,
+                self.config.shard_rows,
+            )
+            return [{"message": messages[i], "similarity": float(score)} for i, score in zip(matches, scores)]
         except Exception as e:
             logger.error(f"Failed to find similar messages: {str(e)}")
             raise
 
+    def _find_similar_quantized(
+        self, embedding: List[float], threshold: float, where_clause: str, query_params: list, top_k: int = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Two-pass search: score the quantized codes, then rescore a shortlist with the float32 vectors.
+
+        Rows stored before quantization was enabled have no codes and are scored at full precision.
+        """
+        mode = self.config.quantization
+        rows = self.conn.execute(
+            f"""
+            SELECT id, message, embedding_q, CASE WHEN embedding_q IS NULL THEN embedding END, embedding_norm
+            FROM {self.config.table_name}
+            WHERE {where_clause}
+        """,
+            tuple(query_params),
+        ).fetchall()
+        if not rows:
+            return []
+
+        ids, messages, codes, embeddings, norms = zip(*rows)
+        scores = np.empty(len(rows), dtype=np.float32)
+        quantized = np.array([value is not None for value in codes])
+        if quantized.any():
+            scores[quantized] = quantized_cosine_scores(
+                stack_quantized([value for value in codes if value is not None], mode), embedding
+            )
+        if not quantized.all():
+            unquantized = np.flatnonzero(~quantized)
+            matrix = stack_embeddings([embeddings[i] for i in unquantized])
+            scores[unquantized] = cosine_scores(matrix, fill_norms(matrix, [norms[i] for i in unquantized]), embedding)
+
+        if not (self.config.rescore and self.config.store_full_precision):
+            matches = select_top(scores, threshold, top_k)
+            return [{"message": messages[i], "similarity": float(scores[i])} for i in matches]
+
+        shortlist = select_top(
+            scores, threshold - self.config.rescore_margin, top_k * self.config.rescore_factor if top_k else None
+        )
+        rescore = [i for i in shortlist if quantized[i]]
+        exact = self._exact_scores([ids[i] for i in rescore], embedding)
+        for i in rescore:
+            scores[i] = exact.get(ids[i], scores[i])
+        matches = shortlist[select_top(scores[shortlist], threshold, top_k)]
+        return [{"message": messages[i], "similarity": float(scores[i])} for i in matches]
+
+    def _exact_scores(self, ids: List[int], embedding: List[float]) -> Dict[int, float]:
+        """Full-precision cosine similarity of the given rows, rows stored without full precision are left out"""
+        scores = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"""SELECT id, embedding, embedding_norm FROM {self.config.table_name}
+                WHERE id IN ({placeholders}) AND length(embedding) > 0""",
+                tuple(chunk),
+            ).fetchall()
+            if not rows:
+                continue
+            row_ids, embeddings, norms = zip(*rows)
+            matrix = stack_embeddings(list(embeddings))
+            chunk_scores = cosine_scores(matrix, fill_norms(matrix, list(norms)), embedding)
+            scores.update(zip(row_ids, chunk_scores.tolist()))
+        return scores
+
+    def quantize_existing(self, batch_size: int = 1000) -> int:
+        """
+        Backfill quantized codes for rows written before quantization was enabled.
+
+        Returns:
+            int: Number of rows updated
+        """
+        mode = self.config.quantization
+        if not mode:
+            return 0
+        updated = 0
+        while True:
+            rows = self.conn.execute(
+                f"SELECT id, embedding FROM {self.config.table_name} WHERE embedding_q IS NULL LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+            if not rows:
+                return updated
+            params = []
+            for row_id, embedding in rows:
+                codes, scale = quantize_embedding(decode_embedding(embedding), mode)
+                full = embedding if self.config.store_full_precision else b""
+                params.append((codes, scale, full, row_id))
+            with self._write_lock, self.conn:
+                self.conn.executemany(
+                    f"""UPDATE {self.config.table_name}
+                    SET embedding_q = ?, embedding_scale = ?, embedding = ? WHERE id = ?""",
+                    params,
+                )
+            updated += len(rows)
+            logger.info(f"Quantized {updated} existing rows to {mode}")
+
     def close(self) -> None:
-        """Close SQLite connection"""
-        if self.conn:
-            self.conn.close()
+        """Close the SQLite connections of every thread"""
+        with self._connections_lock:
+            for conn in self._connections:
+                # Refresh planner statistics that changed during this session
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            self._connections = []
+            if self._search_executor is not None:
+                self._search_executor.shutdown(wait=False)
+                self._search_executor = None
+        self._local = threading.local()
 
     def find_messages(
-        self, message_type: str = None, original_query: str = None, chat_id: str = None, limit: int = None
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
     ) -> List[Dict[str, Any]]:
-        """Find messages matching the given criteria"""
+        """Find messages matching the given criteria, loading original_embedding only when asked to"""
         try:
             with self.conn:
                 cur = self.conn.cursor()
@@ -412,26 +1554,33 @@ class SQLiteVectorStorage(VectorStorageProvider):
                 query_params = []
 
                 if message_type:
-                    query_conditions.append("message_type = ?")
+                    query_conditions.append("m.message_type = ?")
                     query_params.append(message_type)
 
                 if original_query:
-                    query_conditions.append("original_query = ?")
+                    query_conditions.append("m.original_query = ?")
                     query_params.append(original_query)
 
                 if chat_id:
-                    query_conditions.append("chat_id = ?")
+                    query_conditions.append("m.chat_id = ?")
                     query_params.append(chat_id)
 
                 where_clause = " AND ".join(query_conditions) if query_conditions else "1=1"
                 limit_clause = f" LIMIT {limit}" if limit else ""
+                # Responses reference their query row instead of storing its embedding again
+                embedding_column, join_clause = "NULL", ""
+                if include_embeddings:
+                    embedding_column = "COALESCE(m.original_embedding, q.embedding)"
+                    join_clause = f"LEFT JOIN {self.config.table_name} q ON q.id = m.original_message_id"
 
                 cur.execute(
                     f"""
-                    SELECT message, timestamp, source_interface, response_type, key_topics, original_query, original_embedding, tool_call
-                    FROM {self.config.table_name}
+                    SELECT m.message, m.timestamp, m.source_interface, m.response_type, m.key_topics, m.original_query,
+                        m.original_message_id, {embedding_column}, m.tool_call
+                    FROM {self.config.table_name} m
+                    {join_clause}
                     WHERE {where_clause}
-                    ORDER BY timestamp DESC
+                    ORDER BY m.timestamp DESC
                     {limit_clause}
                 """,
                     tuple(query_params),
@@ -445,11 +1594,12 @@ class SQLiteVectorStorage(VectorStorageProvider):
                     response_type,
                     key_topics,
                     orig_query,
+                    orig_message_id,
                     orig_embedding,
                     tool_call,
                 ) in cur.fetchall():
                     key_topics_list = json.loads(key_topics) if key_topics else None
-                    original_embedding_list = json.loads(orig_embedding) if orig_embedding else None
+                    original_embedding_list = decode_embedding(orig_embedding).tolist() if orig_embedding else None
                     results.append(
                         {
                             "message": message,
@@ -458,6 +1608,7 @@ class SQLiteVectorStorage(VectorStorageProvider):
                             "response_type": response_type,
                             "key_topics": key_topics_list,
                             "original_query": orig_query,
+                            "original_message_id": orig_message_id,
                             "original_embedding": original_embedding_list,
                             "tool_call": tool_call,
                         }
@@ -467,6 +1618,355 @@ class SQLiteVectorStorage(VectorStorageProvider):
             logger.error(f"Failed to find messages: {str(e)}")
             raise
 
+    def iter_embeddings(
+        self, message_type: str = None, chat_id: str = None, batch_size: int = 1000, after_id: int = 0
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Stream stored embeddings using keyset pagination on id"""
+        query_conditions = ["id > ?"]
+        filter_params = []
+
+        if message_type:
+            query_conditions.append("message_type = ?")
+            filter_params.append(message_type)
+
+        if chat_id:
+            query_conditions.append("chat_id = ?")
+            filter_params.append(chat_id)
+
+        where_clause = " AND ".join(query_conditions)
+        last_id = after_id
+        while True:
+            try:
+                rows = self.conn.execute(
+                    f"""
+                    SELECT id, message, message_type, chat_id, embedding, embedding_q, embedding_scale
+                    FROM {self.config.table_name}
+                    WHERE {where_clause}
+                    ORDER BY id
+                    LIMIT ?
+                """,
+                    tuple([last_id] + filter_params + [batch_size]),
+                ).fetchall()
+            except Exception as e:
+                logger.error(f"Failed to read embeddings: {str(e)}")
+                raise
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [
+                {
+                    "id": row_id,
+                    "message": message,
+                    "message_type": row_message_type,
+                    "chat_id": row_chat_id,
+                    # Rows stored without full precision only have their quantized codes
+                    "embedding": (
+                        decode_embedding(embedding)
+                        if embedding
+                        else dequantize_embedding(codes, self.config.quantization, scale)
+                    ),
+                }
+                for row_id, message, row_message_type, row_chat_id, embedding, codes, scale in rows
+            ]
+
+    def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Fetch stored messages by row id"""
+        results = {}
+        columns = ["message", "message_type", "chat_id"] + (_METADATA_COLUMNS if include_metadata else [])
+        try:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for start in range(0, len(ids), 500):
+                chunk = list(ids[start : start + 500])
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"""SELECT id, {', '.join(columns)} FROM {self.config.table_name}
+                    WHERE id IN ({placeholders})""",
+                    tuple(chunk),
+                )
+                for row in rows:
+                    results[row[0]] = dict(zip(columns, row[1:]))
+            if include_metadata:
+                for row in results.values():
+                    row["key_topics"] = json.loads(row["key_topics"]) if row["key_topics"] else None
+                    if row["original_embedding"]:
+                        row["original_embedding"] = decode_embedding(row["original_embedding"]).tolist()
+            return results
+        except Exception as e:
+            logger.error(f"Failed to fetch messages: {str(e)}")
+            raise
+
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        """Find which content hashes are already stored"""
+        found = set()
+        try:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for start in range(0, len(hashes), 500):
+                chunk = list(hashes[start : start + 500])
+                query = f"""SELECT DISTINCT content_hash FROM {self.config.table_name}
+                    WHERE content_hash IS NOT NULL AND content_hash IN ({', '.join('?' * len(chunk))})"""
+                if message_type:
+                    query += " AND message_type = ?"
+                    chunk.append(message_type)
+                found.update(row[0] for row in self.conn.execute(query, chunk))
+            return found
+        except Exception as e:
+            logger.error(f"Failed to look up content hashes: {str(e)}")
+            raise
+
+    def find_message_timestamps(self, messages: List[str], message_type: str) -> List[Tuple[int, str, Any]]:
+        """Find the stored rows holding the given message texts"""
+        found = []
+        try:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for start in range(0, len(messages), 500):
+                chunk = list(messages[start : start + 500])
+                found += self.conn.execute(
+                    f"""SELECT id, message, timestamp FROM {self.config.table_name}
+                    WHERE message_type = ? AND message IN ({', '.join('?' * len(chunk))})""",
+                    [message_type] + chunk,
+                ).fetchall()
+            return found
+        except Exception as e:
+            logger.error(f"Failed to look up messages: {str(e)}")
+            raise
+
+    def find_orphaned_chunks(self, message_type: str) -> List[int]:
+        """Find first chunks whose other chunks were never written"""
+        table = self.config.table_name
+        try:
+            rows = self.conn.execute(
+                f"""SELECT id FROM {table}
+                WHERE message_type = ? AND content_hash IS NULL
+                AND id NOT IN (SELECT parent_id FROM {table} WHERE parent_id IS NOT NULL)""",
+                (message_type,),
+            ).fetchall()
+            return [row_id for (row_id,) in rows]
+        except Exception as e:
+            logger.error(f"Failed to look up orphaned chunks: {str(e)}")
+            raise
+
+    def delete_messages(self, ids: List[int]) -> int:
+        """Delete stored messages by row id in one transaction"""
+        deleted = 0
+        try:
+            with self._write_lock, self.conn:
+                for start in range(0, len(ids), 500):
+                    chunk = list(ids[start : start + 500])
+                    cur = self.conn.execute(
+                        f"DELETE FROM {self.config.table_name} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+                    deleted += cur.rowcount
+            return deleted
+        except Exception as e:
+            logger.error(f"Failed to delete messages: {str(e)}")
+            raise
+
+    def _create_full_text_index(self) -> None:
+        """Create the external-content FTS5 table over message and the triggers keeping it in sync"""
+        table = self.config.table_name
+        fts = f"{table}_fts"
+        with self._write_lock, self.conn:
+            if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone():
+                return
+            logger.info(f"Building full-text index {fts}")
+            self.conn.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(message, content='{table}', content_rowid='id')")
+            self.conn.execute(f"""
+                CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts}(rowid, message) VALUES (new.id, new.message);
+                END
+            """)
+            self.conn.execute(f"""
+                CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, message) VALUES ('delete', old.id, old.message);
+                END
+            """)
+            self.conn.execute(f"""
+                CREATE TRIGGER {fts}_update AFTER UPDATE OF message ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, message) VALUES ('delete', old.id, old.message);
+                    INSERT INTO {fts}(rowid, message) VALUES (new.id, new.message);
+                END
+            """)
+            # Index the rows stored before full-text search was enabled
+            self.conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Keyword search ranked by FTS5 BM25"""
+        keywords = _keywords(text)
+        if not self.config.full_text_search or not keywords:
+            return []
+        table = self.config.table_name
+        query_conditions = [f"{table}_fts MATCH ?"]
+        # Quoted terms are matched literally, OR ranks documents by how many (and how rare) terms they contain
+        query_params: List[Any] = [" OR ".join(f'"{keyword}"' for keyword in keywords)]
+        if message_type:
+            query_conditions.append("m.message_type = ?")
+            query_params.append(message_type)
+        if chat_id:
+            query_conditions.append("m.chat_id = ?")
+            query_params.append(chat_id)
+        try:
+            rows = self.conn.execute(
+                f"""
+                SELECT m.id, m.message, bm25({table}_fts) AS rank
+                FROM {table}_fts JOIN {table} m ON m.id = {table}_fts.rowid
+                WHERE {" AND ".join(query_conditions)}
+                ORDER BY rank
+                LIMIT ?
+            """,
+                tuple(query_params + [limit]),
+            ).fetchall()
+            # bm25() is lower-is-better, flip it so every provider reports higher-is-better scores
+            return [
+                {"id": row_id, "message": message, "score": -rank, "relevant": -rank >= self.config.min_text_score}
+                for row_id, message, rank in rows
+            ]
+        except Exception as e:
+            logger.error(f"Failed to search messages: {str(e)}")
+            raise
+
+    def collection(self, name: str, **overrides) -> "SQLiteVectorStorage":
+        """
+        Storage for a named collection in its own table of the same database, e.g. knowledge_base_embeddings.
+
+        Args:
+            name (str): Collection name, used as the table prefix
+            **overrides: SQLiteConfig fields that differ for this collection (quantization, ...)
+        """
+        return SQLiteVectorStorage(replace(self.config, **{"table_name": f"{name}_embeddings", **overrides}))
+
+    def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        """Delete expired rows in one transaction"""
+        # Timestamps are stored as naive local ISO strings, which compare in time order
+        cutoff = (datetime.now() - timedelta(days=policy.max_age_days or 0)).isoformat()
+        query, params = _expired_ids_query(self.config.table_name, policy, "?", cutoff)
+        if query is None:
+            return []
+        try:
+            with self._write_lock, self.conn:
+                deleted = [row_id for (row_id,) in self.conn.execute(query, params).fetchall()]
+                for start in range(0, len(deleted), 500):
+                    chunk = deleted[start : start + 500]
+                    self.conn.execute(
+                        f"DELETE FROM {self.config.table_name} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+            logger.info(f"Deleted {len(deleted)} expired message(s) from {self.config.table_name}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Failed to delete expired messages: {str(e)}")
+            raise
+
+    def compact(self, reindex: bool = False) -> None:
+        """VACUUM the database file and truncate the WAL"""
+        try:
+            with self._write_lock:
+                if reindex:
+                    self.conn.execute(f"REINDEX {self.config.table_name}")
+                self.conn.execute("VACUUM")
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self.conn.execute("PRAGMA optimize")
+            logger.info(f"Compacted {self.config.db_path}")
+        except Exception as e:
+            logger.error(f"Failed to compact SQLite storage: {str(e)}")
+            raise
+
+
+# Default number of texts sent per embeddings request, e.g. EMBEDDING_BATCH_SIZE=64
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+# Embedding requests in flight at once from one event loop
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 8))
+
+_embedding_client: Optional[OpenAI] = None
+_embedding_client_lock = threading.Lock()
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_loaded = False
+
+
+def get_embedding_client() -> OpenAI:
+    """
+    The long-lived client shared by every embedding call.
+
+    It is created on first use, so the environment is read after dotenv has loaded it, and its
+    HTTP connection pool is then reused instead of opening a new connection per request.
+    """
+    global _embedding_client
+    if _embedding_client is None:
+        with _embedding_client_lock:
+            if _embedding_client is None:
+                _embedding_client = OpenAI(
+                    api_key=os.environ.get("HEURIST_API_KEY"), base_url=os.environ.get("HEURIST_BASE_URL")
+                )
+    return _embedding_client
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    The persistent embedding cache shared by every embedding call, None when it is disabled.
+
+    Configured from the EMBEDDING_CACHE_* environment variables on first use.
+    """
+    global _embedding_cache, _embedding_cache_loaded
+    if not _embedding_cache_loaded:
+        with _embedding_client_lock:
+            if not _embedding_cache_loaded:
+                config = cache_config_from_env()
+                try:
+                    _embedding_cache = EmbeddingCache(config) if config else None
+                except sqlite3.Error as e:
+                    logger.warning(f"Embedding cache unavailable, embedding without it: {str(e)}")
+                _embedding_cache_loaded = True
+    return _embedding_cache
+
+
+def get_embeddings(
+    texts: List[str], model: str = "BAAI/bge-large-en-v1.5", batch_size: Optional[int] = None, use_cache: bool = True
+) -> List[list]:
+    """
+    Generate embeddings for several texts, batch_size texts per request.
+
+    Texts found in the embedding cache are not sent again, and duplicates are only requested once.
+
+    Args:
+        texts (List[str]): The texts to generate embeddings for
+        model (str): The model to use for embedding generation
+        batch_size (int, optional): Texts per request, EMBEDDING_BATCH_SIZE by default
+        use_cache (bool): Read and fill the persistent embedding cache
+
+    Returns:
+        List[list]: One embedding vector per text, in input order
+
+    Raises:
+        EmbeddingError: If embedding generation fails
+    """
+    cache = get_embedding_cache() if use_cache else None
+    embeddings = cache.get_many(model, texts) if cache else [None] * len(texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    if not missing:
+        return embeddings
+
+    generated = dict(zip(missing, _request_embeddings(missing, model, batch_size or EMBEDDING_BATCH_SIZE)))
+    if cache:
+        cache.put_many(model, missing, [generated[text] for text in missing])
+    return [generated[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+
+
+def _request_embeddings(texts: List[str], model: str, batch_size: int) -> List[list]:
+    embeddings = []
+    try:
+        client = get_embedding_client()
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start : start + batch_size]
+            response = client.embeddings.create(model=model, input=chunk, encoding_format="float")
+            if len(response.data) != len(chunk):
+                raise ValueError(f"Expected {len(chunk)} embeddings, got {len(response.data)}")
+            # The API reports the input position of every vector; do not rely on response order
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return embeddings
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings: {str(e)}")
+        raise EmbeddingError(f"Embedding generation failed: {str(e)}")
+
 
 def get_embedding(text: str, model: str = "BAAI/bge-large-en-v1.5") -> list:
     """
@@ -482,17 +1982,133 @@ def get_embedding(text: str, model: str = "BAAI/bge-large-en-v1.5") -> list:
     Raises:
         EmbeddingError: If embedding generation fails
     """
+    return get_embeddings([text], model)[0]
+
+
+class _AsyncEmbeddingState:
+    """Client, concurrency limit and in-flight requests of one event loop"""
+
+    def __init__(self):
+        self.client = AsyncOpenAI(
+            api_key=os.environ.get("HEURIST_API_KEY"), base_url=os.environ.get("HEURIST_BASE_URL")
+        )
+        self.semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        self.in_flight: Dict[Tuple[str, str], "asyncio.Future[list]"] = {}
+        # The loop only keeps weak references to tasks, so running requests are held here
+        self.tasks: Set["asyncio.Task[None]"] = set()
+
+
+# The async client and its connections belong to the loop that created them
+_async_embedding_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncEmbeddingState]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _async_embedding_state() -> _AsyncEmbeddingState:
+    loop = asyncio.get_running_loop()
+    state = _async_embedding_states.get(loop)
+    if state is None:
+        state = _async_embedding_states[loop] = _AsyncEmbeddingState()
+    return state
+
+
+async def _fetch_embeddings(
+    state: _AsyncEmbeddingState, model: str, texts: List[str], futures: List["asyncio.Future[list]"]
+) -> None:
+    """Request one batch and resolve the futures every caller waiting for these texts shares"""
     try:
-        client = OpenAI(api_key=os.environ.get("HEURIST_API_KEY"), base_url=os.environ.get("HEURIST_BASE_URL"))
+        async with state.semaphore:
+            response = await state.client.embeddings.create(model=model, input=texts, encoding_format="float")
+        if len(response.data) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(response.data)}")
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        for future, embedding in zip(futures, embeddings):
+            future.set_result(embedding)
+        cache = get_embedding_cache()
+        if cache:
+            await asyncio.to_thread(cache.put_many, model, texts, embeddings)
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings: {str(e)}")
+        for future in futures:
+            if not future.done():
+                future.set_exception(EmbeddingError(f"Embedding generation failed: {str(e)}"))
+    finally:
+        for text in texts:
+            state.in_flight.pop((model, text), None)
 
-        response = client.embeddings.create(model=model, input=text, encoding_format="float")
 
-        # Return the embedding vector for the input text
-        return response.data[0].embedding
+def _cached_embeddings(model: str, texts: List[str]) -> List[Optional[list]]:
+    """Embedding cache lookup, None for every text that is not cached"""
+    cache = get_embedding_cache()
+    return cache.get_many(model, texts) if cache else [None] * len(texts)
 
+
+async def aget_embeddings(
+    texts: List[str], model: str = "BAAI/bge-large-en-v1.5", batch_size: Optional[int] = None
+) -> List[list]:
+    """
+    Generate embeddings for several texts without blocking the event loop.
+
+    Cached texts are served from the embedding cache. A text that another coroutine is already
+    embedding shares that request instead of starting a new one, and at most
+    EMBEDDING_MAX_CONCURRENCY requests run at once.
+
+    Args:
+        texts (List[str]): The texts to generate embeddings for
+        model (str): The model to use for embedding generation
+        batch_size (int, optional): Texts per request, EMBEDDING_BATCH_SIZE by default
+
+    Returns:
+        List[list]: One embedding vector per text, in input order
+
+    Raises:
+        EmbeddingError: If embedding generation fails
+    """
+    # Opening and reading the SQLite cache file would block the event loop
+    embeddings = await asyncio.to_thread(_cached_embeddings, model, texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    if not missing:
+        return embeddings
+
+    try:
+        state = _async_embedding_state()
     except Exception as e:
-        logger.error(f"Failed to generate embedding: {str(e)}")
+        logger.error(f"Failed to create embedding client: {str(e)}")
         raise EmbeddingError(f"Embedding generation failed: {str(e)}")
+    loop = asyncio.get_running_loop()
+    futures: Dict[str, "asyncio.Future[list]"] = {}
+    new_texts = []
+    for text in missing:
+        future = state.in_flight.get((model, text))
+        if future is None:
+            future = state.in_flight[(model, text)] = loop.create_future()
+            # Mark failures as retrieved even when every waiter has given up
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            new_texts.append(text)
+        futures[text] = future
+
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    for start in range(0, len(new_texts), batch_size):
+        chunk = new_texts[start : start + batch_size]
+        # A separate task, so a caller that times out does not cancel a request others are waiting for
+        task = asyncio.ensure_future(_fetch_embeddings(state, model, chunk, [futures[text] for text in chunk]))
+        state.tasks.add(task)
+        task.add_done_callback(state.tasks.discard)
+
+    generated = {}
+    for text, future in futures.items():
+        generated[text] = await asyncio.shield(future)
+    return [generated[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+
+
+async def aget_embedding(text: str, model: str = "BAAI/bge-large-en-v1.5") -> list:
+    """
+    Generate an embedding for the given text without blocking the event loop.
+
+    Raises:
+        EmbeddingError: If embedding generation fails
+    """
+    return (await aget_embeddings([text], model))[0]
 
 
 def compute_similarity(embedding1: list, embedding2: list) -> float:
@@ -506,26 +2122,429 @@ def compute_similarity(embedding1: list, embedding2: list) -> float:
     Returns:
         float: Cosine similarity score between 0 and 1
     """
-    return cosine_similarity([embedding1], [embedding2])[0][0]
+    norms = np.linalg.norm(embedding1) * np.linalg.norm(embedding2)
+    return float(np.dot(embedding1, embedding2) / norms) if norms else 0.0
+
+
+@dataclass
+class WriteBehindConfig:
+    # Maximum number of queued messages; queue_message blocks once it is full
+    max_queue_size: int = 1000
+    # Maximum number of messages written per transaction
+    batch_size: int = 100
+    # Seconds the worker waits for more messages before writing a partial batch
+    flush_interval: float = 0.5
+    # Attempts per batch before it is dropped and logged
+    max_retries: int = 3
+
+
+@dataclass
+class Collection:
+    """Message types kept by their own provider (own table and index settings) with their own cache policy"""
+
+    storage_provider: VectorStorageProvider
+    message_types: List[str]
+    # Enables the in-memory embedding cache of this collection, bounded to this many bytes
+    cache_max_bytes: Optional[int] = None
+
+
+DEFAULT_COLLECTION = "default"
 
 
 class MessageStore:
-    def __init__(self, storage_provider: VectorStorageProvider):
-        """Initialize the store with a storage provider."""
+    def __init__(
+        self,
+        storage_provider: VectorStorageProvider,
+        cache_max_bytes: Optional[int] = None,
+        write_behind: Optional[WriteBehindConfig] = None,
+        retention: Optional[RetentionPolicy] = None,
+        collections: Optional[Dict[str, Collection]] = None,
+        search_workers: int = 1,
+    ):
+        """
+        Initialize the store with a storage provider.
+
+        Args:
+            storage_provider (VectorStorageProvider): Backend that persists the messages
+            cache_max_bytes (int, optional): Enables the in-memory embedding cache, bounded to this many bytes
+            write_behind (WriteBehindConfig, optional): Persist queue_message calls from a background worker
+            retention (RetentionPolicy, optional): Expire old rows from a periodic compaction job
+            collections (Dict[str, Collection], optional): Message types routed to their own providers,
+                e.g. {"knowledge_base": Collection(storage.collection("knowledge_base"), ["knowledge_base"])}
+            search_workers (int): Threads scoring shards of a cached partition in parallel, 1 scores inline
+        """
         self.storage_provider = storage_provider
-        self.storage_provider.initialize()
+        self.collections: Dict[str, Collection] = {
+            DEFAULT_COLLECTION: Collection(storage_provider, [], cache_max_bytes),
+            **(collections or {}),
+        }
+        self._routes = {
+            message_type: name
+            for name, collection in self.collections.items()
+            for message_type in collection.message_types
+        }
+        self._caches: Dict[str, Optional[EmbeddingMatrixCache]] = {}
+        self._search_executor = (
+            ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="cache-search")
+            if search_workers > 1
+            else None
+        )
+        for name, collection in self.collections.items():
+            collection.storage_provider.initialize()
+            cache_max_bytes = collection.cache_max_bytes
+            self._caches[name] = EmbeddingMatrixCache(cache_max_bytes) if cache_max_bytes else None
+        self.cache = self._caches[DEFAULT_COLLECTION]
+
+        self.write_behind = write_behind
+        self._closed = False
+        if write_behind:
+            self._queue: "queue.Queue[Optional[MessageData]]" = queue.Queue(maxsize=write_behind.max_queue_size)
+            # Queued messages not yet committed, consulted by find_messages for read-your-writes
+            self._pending: List[MessageData] = []
+            self._pending_lock = threading.Lock()
+            self._worker = threading.Thread(target=self._write_worker, name="message-store-writer", daemon=True)
+            self._worker.start()
+
+        self.retention = retention
+        self._deleted_since_compaction: Dict[str, int] = {}
+        if retention:
+            self._stop_compaction = threading.Event()
+            self._compactor = threading.Thread(
+                target=self._compaction_worker, name="message-store-compactor", daemon=True
+            )
+            self._compactor.start()
+
+        if write_behind or retention:
+            atexit.register(self.close)
+
+    def queue_message(self, message_data: MessageData) -> "Future[int]":
+        """
+        Persist a message without waiting for the write when write-behind is enabled.
+
+        The message is visible to find_messages immediately and to similarity search once the worker
+        has flushed it. Blocks only while the queue is full. Without write-behind the message is written
+        synchronously.
 
-    def add_message(self, message_data: MessageData) -> None:
+        Args:
+            message_data (MessageData): The message data to store
+
+        Returns:
+            Future[int]: Resolves to the id of the stored row once it has been written
+        """
+        row_id: "Future[int]" = Future()
+        if not self.write_behind:
+            row_id.set_result(self.add_message(message_data))
+            return row_id
+        if self._closed:
+            raise RuntimeError("MessageStore is closed")
+        with self._pending_lock:
+            self._pending.append(message_data)
+        self._queue.put((message_data, row_id))
+        return row_id
+
+    def flush(self) -> None:
+        """Block until every queued message has been written"""
+        if self.write_behind:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Flush queued messages and close the storage provider"""
+        # Also reached from __del__ when __init__ failed part way
+        if getattr(self, "_closed", True):
+            return
+        self._closed = True
+        if self.retention:
+            self._stop_compaction.set()
+            self._compactor.join()
+        if self.write_behind:
+            self._queue.put(None)
+            self._worker.join()
+        if self.write_behind or self.retention:
+            atexit.unregister(self.close)
+        for collection in self.collections.values():
+            collection.storage_provider.close()
+        if self._search_executor is not None:
+            self._search_executor.shutdown(wait=False)
+
+    def _collection_name(self, message_type: Optional[str]) -> str:
+        return self._routes.get(message_type, DEFAULT_COLLECTION)
+
+    def _searched_collections(self, message_type: Optional[str]) -> List[str]:
+        """Collections holding rows of message_type, every collection when no type is given"""
+        if message_type:
+            return [self._collection_name(message_type)]
+        return list(self.collections)
+
+    def migrate_collection(self, name: str, batch_size: int = 500) -> int:
+        """
+        Move rows of a collection's message types out of the default provider into the collection.
+
+        Rows are copied one batch at a time, then deleted from the newest, so an interrupted run can simply
+        be repeated: rows copied but not deleted yet are found in the collection and only deleted this
+        time, and the parents of the chunks left behind are still there to map their parent_id.
+
+        Returns:
+            int: Number of moved rows
+        """
+        collection = self.collections[name]
+        source = self.storage_provider
+        target = collection.storage_provider
+        moved = 0
+        # New ids of moved rows, so chunks keep pointing at their first chunk
+        new_ids: Dict[int, int] = {}
+        for message_type in collection.message_types:
+            last_id = 0
+            copied_ids: List[int] = []
+            # Only the leading batches can have been copied by an interrupted run
+            resuming = True
+            while True:
+                batch = next(source.iter_embeddings(message_type, batch_size=batch_size, after_id=last_id), [])
+                if not batch:
+                    break
+                ids = [row["id"] for row in batch]
+                last_id = ids[-1]
+                rows = source.fetch_messages(ids, include_metadata=True)
+                if resuming:
+                    copied = {
+                        (message, timestamp_key(timestamp)): row_id
+                        for row_id, message, timestamp in target.find_message_timestamps(
+                            [row["message"] for row in batch], message_type
+                        )
+                    }
+                    for row in batch:
+                        key = (row["message"], timestamp_key(rows[row["id"]]["timestamp"]))
+                        if key in copied:
+                            new_ids[row["id"]] = copied[key]
+                    resuming = any(row_id in new_ids for row_id in ids)
+                    batch = [row for row in batch if row["id"] not in new_ids]
+                added = self.add_messages(
+                    [
+                        MessageData(
+                            message=row["message"],
+                            embedding=row["embedding"].tolist(),
+                            timestamp=rows[row["id"]]["timestamp"],
+                            message_type=row["message_type"],
+                            chat_id=row["chat_id"],
+                            source_interface=rows[row["id"]]["source_interface"],
+                            original_query=rows[row["id"]]["original_query"],
+                            original_embedding=rows[row["id"]]["original_embedding"],
+                            response_type=rows[row["id"]]["response_type"],
+                            key_topics=rows[row["id"]]["key_topics"],
+                            tool_call=rows[row["id"]]["tool_call"],
+                            content_hash=rows[row["id"]]["content_hash"],
+                            parent_id=new_ids.get(rows[row["id"]]["parent_id"]),
+                        )
+                        for row in batch
+                    ]
+                )
+                new_ids.update(zip([row["id"] for row in batch], added))
+                copied_ids += ids
+            # Chunks have higher ids than their first chunk
+            for end in range(len(copied_ids), 0, -batch_size):
+                ids = copied_ids[max(end - batch_size, 0) : end]
+                source.delete_messages(ids)
+                if self.cache:
+                    self.cache.remove(ids)
+            moved += len(copied_ids)
+        if moved:
+            logger.info(f"Moved {moved} message(s) to the {name} collection")
+        return moved
+
+    def apply_retention(self) -> int:
+        """
+        Delete the rows expired by the retention policy and compact the storage once enough were deleted.
+
+        Deleted rows are dropped from the embedding cache as well; providers with an ANN index remove
+        them from it themselves.
+
+        Returns:
+            int: Number of deleted rows
+        """
+        if not self.retention:
+            return 0
+        total = 0
+        for name, collection in self.collections.items():
+            deleted = collection.storage_provider.delete_expired(self.retention)
+            if deleted and self._caches[name]:
+                self._caches[name].remove(deleted)
+            total += len(deleted)
+            self._deleted_since_compaction[name] = self._deleted_since_compaction.get(name, 0) + len(deleted)
+            if self._deleted_since_compaction[name] >= self.retention.vacuum_min_deleted:
+                collection.storage_provider.compact(self.retention.reindex)
+                self._deleted_since_compaction[name] = 0
+        return total
+
+    def _compaction_worker(self) -> None:
+        """Run apply_retention every compaction_interval seconds until the store is closed"""
+        while not self._stop_compaction.wait(self.retention.compaction_interval):
+            try:
+                self.apply_retention()
+            except Exception as e:
+                logger.error(f"Retention job failed: {str(e)}")
+
+    def _write_worker(self) -> None:
+        """Drain the queue in batches until the shutdown sentinel arrives"""
+        config = self.write_behind
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + config.flush_interval
+            while len(batch) < config.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_batch(self, batch: List[tuple]) -> None:
+        messages = [message_data for message_data, _ in batch]
+        error = None
+        for attempt in range(1, self.write_behind.max_retries + 1):
+            try:
+                row_ids = self.add_messages(messages)
+                break
+            except Exception as e:
+                error = e
+                logger.error(f"Write-behind flush of {len(batch)} message(s) failed (attempt {attempt}): {str(e)}")
+                time.sleep(min(2**attempt * 0.1, 2.0))
+        else:
+            row_ids = None
+            logger.error(f"Dropped {len(batch)} queued message(s) after {self.write_behind.max_retries} attempts")
+        with self._pending_lock:
+            written = {id(message_data) for message_data in messages}
+            self._pending = [message_data for message_data in self._pending if id(message_data) not in written]
+        for index, (_, future) in enumerate(batch):
+            if row_ids is None:
+                future.set_exception(error)
+            else:
+                future.set_result(row_ids[index])
+
+    def _pending_matches(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict]:
+        """Queued messages matching the find_messages criteria, in the same shape as stored rows"""
+        with self._pending_lock:
+            pending = list(self._pending)
+        return [
+            {
+                "message": message_data.message,
+                "timestamp": message_data.timestamp,
+                "source_interface": message_data.source_interface,
+                "response_type": message_data.response_type,
+                "key_topics": message_data.key_topics,
+                "original_query": message_data.original_query,
+                "original_message_id": message_data.original_message_id,
+                "original_embedding": message_data.original_embedding if include_embeddings else None,
+                "tool_call": message_data.tool_call,
+            }
+            for message_data in pending
+            if (not message_type or message_data.message_type == message_type)
+            and (not original_query or message_data.original_query == original_query)
+            and (not chat_id or message_data.chat_id == chat_id)
+        ]
+
+    def add_message(self, message_data: MessageData) -> int:
         """
         Add a message and its embedding to the store.
 
         Args:
             message_data (MessageData): The message data to store
+
+        Returns:
+            int: The id of the stored row
+        """
+        return self.add_messages([message_data])[0]
+
+    def add_messages(self, batch: List[MessageData]) -> List[int]:
+        """
+        Add a batch of messages to the store in a single transaction.
+
+        Args:
+            batch (List[MessageData]): The messages to store
+
+        Returns:
+            List[int]: The ids of the stored rows, in batch order
         """
-        self.storage_provider.store_embedding(message_data)
+        positions: Dict[str, List[int]] = {}
+        for position, message_data in enumerate(batch):
+            positions.setdefault(self._collection_name(message_data.message_type), []).append(position)
+
+        row_ids: List[int] = [0] * len(batch)
+        for name, group in positions.items():
+            messages = [batch[position] for position in group]
+            group_ids = self.collections[name].storage_provider.store_embeddings(messages)
+            cache = self._caches[name]
+            for position, row_id, message_data in zip(group, group_ids, messages):
+                row_ids[position] = row_id
+                if cache:
+                    cache.append(
+                        row_id,
+                        message_data.message,
+                        message_data.embedding,
+                        message_data.message_type,
+                        message_data.chat_id,
+                    )
+        return row_ids
+
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        """
+        Find which content hashes are already stored, e.g. to skip unchanged knowledge base entries.
+
+        Args:
+            hashes (list): content_hash() values to look up
+            message_type (str, optional): Filter by message type
+
+        Returns:
+            Set[str]: The given hashes held by at least one stored row
+        """
+        found = set()
+        for name in self._searched_collections(message_type):
+            found |= self.collections[name].storage_provider.find_content_hashes(hashes, message_type)
+        return found
+
+    def delete_orphaned_chunks(self, message_type: str) -> int:
+        """
+        Delete the first chunks an interrupted write of a split source left without their other chunks.
+
+        Args:
+            message_type (str): Type of the chunked rows, e.g. 'knowledge_base'
+
+        Returns:
+            int: Number of deleted rows
+        """
+        name = self._collection_name(message_type)
+        storage_provider = self.collections[name].storage_provider
+        ids = storage_provider.find_orphaned_chunks(message_type)
+        if not ids:
+            return 0
+        storage_provider.delete_messages(ids)
+        if self._caches[name]:
+            self._caches[name].remove(ids)
+        logger.info(f"Deleted {len(ids)} orphaned {message_type} chunk(s)")
+        return len(ids)
 
     def find_similar_messages(
-        self, embedding: List[float], threshold: float = 0.8, message_type: str = None, chat_id: str = None
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
     ) -> List[Dict[str, Any]]:
         """
         Find messages similar to the given embedding.
@@ -535,18 +2554,120 @@ class MessageStore:
             threshold (float): Similarity threshold (0-1) to consider a message as similar
             message_type (str, optional): Filter by message type
             chat_id (str, optional): Filter by chat ID
+            top_k (int, optional): Return at most this many messages, the most similar first
 
         Returns:
             list: List of dictionaries containing similar messages and their similarity scores
         """
-        return self.storage_provider.find_similar(embedding, threshold, message_type, chat_id)
+        names = self._searched_collections(message_type)
+        results = []
+        for name in names:
+            results += self._find_similar_in(name, embedding, threshold, message_type, chat_id, top_k)
+        if len(names) > 1:
+            results.sort(key=lambda row: row["similarity"], reverse=True)
+            results = results[:top_k] if top_k else results
+        return results
+
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        Keyword search over stored messages, ranked by relevance.
+
+        Needs no embedding, so it also works while the embedding service is unavailable. Only
+        collections whose provider was configured with full_text_search return results.
+
+        Args:
+            text (str): Free-text query
+            message_type (str, optional): Filter by message type
+            chat_id (str, optional): Filter by chat ID
+            limit (int): Maximum number of messages to return
+
+        Returns:
+            list: Messages with id and score, most relevant first
+        """
+        names = self._searched_collections(message_type)
+        results = []
+        for name in names:
+            results += self.collections[name].storage_provider.search_text(text, message_type, chat_id, limit)
+        if len(names) > 1:
+            results.sort(key=lambda row: row["score"], reverse=True)
+            results = results[:limit]
+        return results
+
+    def hybrid_search(
+        self,
+        text: str,
+        embedding: Optional[List[float]] = None,
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = 10,
+        keyword_weight: float = 1.0,
+        vector_weight: float = 1.0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Combine keyword (BM25) and embedding search with reciprocal rank fusion.
+
+        Keyword search catches exact terms such as ticker symbols and names that embeddings blur,
+        vector search catches paraphrases. Without an embedding only the keyword ranking is used.
+        Keyword matches scoring below the provider's min_text_score are only counted for messages
+        the vector search found too.
+
+        Args:
+            text (str): The query text
+            embedding (list, optional): The query embedding, None for a keyword-only search
+            threshold (float): Minimum similarity of vector matches
+            message_type (str, optional): Filter by message type
+            chat_id (str, optional): Filter by chat ID
+            top_k (int): Maximum number of messages to return
+            keyword_weight (float): Weight of the keyword ranking in the fusion
+            vector_weight (float): Weight of the vector ranking in the fusion
+
+        Returns:
+            list: Messages with their fused score and, for vector matches, their similarity
+        """
+        # Fetch deeper candidate lists than top_k so items ranked moderately in both lists can surface
+        candidates = top_k * 3
+        keyword_matches = self.search_text(text, message_type, chat_id, candidates)
+        vector_matches = []
+        if embedding is not None:
+            vector_matches = self.find_similar_messages(embedding, threshold, message_type, chat_id, candidates)
+
+        similarities = {match["message"]: match["similarity"] for match in vector_matches}
+        # Weak keyword matches only add to the rank of messages the vector search found as well
+        keyword_matches = [match for match in keyword_matches if match["relevant"] or match["message"] in similarities]
+        fused = reciprocal_rank_fusion(
+            [[match["message"] for match in keyword_matches], [match["message"] for match in vector_matches]],
+            [keyword_weight, vector_weight],
+        )
+        return [
+            {"message": message, "score": score, "similarity": similarities.get(message)}
+            for message, score in fused[:top_k]
+        ]
+
+    def _find_similar_in(
+        self, name: str, embedding: List[float], threshold: float, message_type: str, chat_id: str, top_k: int
+    ) -> List[Dict[str, Any]]:
+        storage_provider = self.collections[name].storage_provider
+        cache = self._caches[name]
+        if cache:
+            key = (message_type or None, chat_id or None)
+            partition = cache.get(key) or cache.load(key, storage_provider.iter_embeddings(message_type, chat_id))
+            return partition.search(embedding, threshold, top_k, self._search_executor) if partition else []
+        return storage_provider.find_similar(embedding, threshold, message_type, chat_id, top_k)
 
     def __del__(self):
         """Cleanup resources when the store is destroyed"""
-        self.storage_provider.close()
+        self.close()
 
     def find_messages(
-        self, message_type: str = None, original_query: str = None, chat_id: str = None, limit: int = None
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
     ) -> List[Dict]:
         """
         Find messages matching the given criteria.
@@ -556,8 +2677,35 @@ class MessageStore:
             original_query (str, optional): The original query to match against
             chat_id (str, optional): The chat ID to filter by
             limit (int, optional): Maximum number of messages to return, ordered by most recent
+            include_embeddings (bool): Also load original_embedding, otherwise it is None
 
         Returns:
             List[Dict]: List of matching messages with their metadata
         """
-        return self.storage_provider.find_messages(message_type, original_query, chat_id, limit)
+        if not self.write_behind:
+            return self._find_stored(message_type, original_query, chat_id, limit, include_embeddings)
+
+        # Snapshot the queue first: a message flushed in between then shows up twice rather than not at all
+        pending = self._pending_matches(message_type, original_query, chat_id, include_embeddings)
+        stored = self._find_stored(message_type, original_query, chat_id, limit, include_embeddings)
+        if not pending:
+            return stored
+        stored_keys = {(row["message"], timestamp_key(row["timestamp"])) for row in stored}
+        merged = [row for row in pending if (row["message"], timestamp_key(row["timestamp"])) not in stored_keys]
+        merged += stored
+        merged.sort(key=lambda row: timestamp_key(row["timestamp"]), reverse=True)
+        return merged[:limit] if limit else merged
+
+    def _find_stored(
+        self, message_type: str, original_query: str, chat_id: str, limit: int, include_embeddings: bool
+    ) -> List[Dict]:
+        names = self._searched_collections(message_type)
+        results = []
+        for name in names:
+            results += self.collections[name].storage_provider.find_messages(
+                message_type, original_query, chat_id, limit, include_embeddings
+            )
+        if len(names) > 1:
+            results.sort(key=lambda row: timestamp_key(row["timestamp"]), reverse=True)
+            results = results[:limit] if limit else results
+        return results
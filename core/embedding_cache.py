@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from core.vector_search import EMBEDDING_DTYPE, decode_embedding, encode_embedding
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmbeddingCacheConfig:
+    """Configuration for the persistent embedding cache"""
+
+    db_path: str = "embedding_cache.db"
+    # Embeddings kept in the in-memory LRU tier in front of the database
+    memory_items: int = 10000
+    # Least recently used rows are evicted once the stored vectors exceed this size
+    max_bytes: int = 268435456
+    # Eviction frees space down to this fraction of max_bytes so it does not run on every insert
+    evict_to: float = 0.9
+    # last_used of memory-tier hits is written back in one batch at most this often (seconds)
+    touch_interval: float = 60.0
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """Content address of an embedding: SHA-256 of the model name and the exact text"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with an in-memory LRU tier over a local SQLite file.
+
+    Entries are keyed by (model, hash of text), so identical text is only embedded once across
+    runs and processes. Vectors are stored as float32, the precision every storage provider
+    keeps anyway.
+    """
+
+    def __init__(self, config: EmbeddingCacheConfig = None):
+        self.config = config or EmbeddingCacheConfig()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        # Keys served from memory since last_used was last written, with the time of their latest hit
+        self._touched: Dict[bytes, float] = {}
+        self._touched_at = time.time()
+        self.conn = sqlite3.connect(self.config.db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key BLOB PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS embedding_cache_last_used_idx ON embedding_cache (last_used)"
+            )
+        self._disk_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM embedding_cache").fetchone()[0]
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.config.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of several texts.
+
+        Returns:
+            List[Optional[List[float]]]: The cached embedding of every text, None for misses
+        """
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self._touched[key] = now
+            missing = list({key for key in keys if key not in found})
+            disk_keys = []
+            try:
+                # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start : start + 500]
+                    rows = self.conn.execute(
+                        f"SELECT key, embedding FROM embedding_cache WHERE key IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                    for key, embedding in rows:
+                        vector = decode_embedding(embedding)
+                        found[key] = vector
+                        disk_keys.append(key)
+                        self._remember(key, vector)
+                self._touched.update((key, now) for key in disk_keys)
+                # Disk hits are written right away, memory hits ride along or wait for touch_interval
+                if disk_keys or now - self._touched_at >= self.config.touch_interval:
+                    self._write_touches(now)
+            except sqlite3.Error as e:
+                # A broken cache only costs API calls, it must never fail the embedding itself
+                logger.warning(f"Embedding cache lookup failed: {str(e)}")
+            disk_hits = set(disk_keys)
+            for key in keys:
+                if key not in found:
+                    self._stats["misses"] += 1
+                elif key in disk_hits:
+                    self._stats["disk_hits"] += 1
+                    # Later duplicates of the same text in this call were served from memory
+                    disk_hits.discard(key)
+                else:
+                    self._stats["memory_hits"] += 1
+        return [found[key].tolist() if key in found else None for key in keys]
+
+    def _write_touches(self, now: float) -> None:
+        """Write the last_used times of the hits recorded since the last write"""
+        if self._touched:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?",
+                    [(used, key) for key, used in self._touched.items()],
+                )
+            self._touched.clear()
+        self._touched_at = now
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """Store freshly generated embeddings and evict old rows if the cache grew past max_bytes"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                blob, _ = encode_embedding(embedding)
+                self._remember(key, np.frombuffer(blob, dtype=EMBEDDING_DTYPE))
+                rows.append((key, model, blob, now))
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?)", rows)
+                self._disk_bytes += sum(len(row[2]) for row in rows)
+                if self._disk_bytes > self.config.max_bytes:
+                    self._evict()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache write failed: {str(e)}")
+
+    def _evict(self) -> None:
+        """Delete least recently used rows until the cache is back under evict_to * max_bytes"""
+        # Recent memory hits must not look unused to the eviction order
+        self._write_touches(time.time())
+        # Other processes share the file, so start from the actual size
+        self._disk_bytes = self._stored_bytes()
+        excess = self._disk_bytes - int(self.config.max_bytes * self.config.evict_to)
+        if excess <= 0:
+            return
+        keys, freed = [], 0
+        for key, size in self.conn.execute("SELECT key, LENGTH(embedding) FROM embedding_cache ORDER BY last_used"):
+            keys.append(key)
+            freed += size
+            if freed >= excess:
+                break
+        with self.conn:
+            self.conn.executemany("DELETE FROM embedding_cache WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            self._memory.pop(key, None)
+        self._disk_bytes -= freed
+        self._stats["evictions"] += len(keys)
+        logger.info(f"Evicted {len(keys)} cached embedding(s), {freed} bytes")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit and miss counters since the cache was opened, with the overall hit rate"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["lookups"] = lookups
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["memory_items"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+            return stats
+
+    def clear(self) -> None:
+        """Drop every cached embedding"""
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            with self.conn:
+                self.conn.execute("DELETE FROM embedding_cache")
+            self._disk_bytes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._write_touches(time.time())
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache write failed: {str(e)}")
+            self._memory.clear()
+            self.conn.close()
+
+
+def cache_config_from_env() -> Optional[EmbeddingCacheConfig]:
+    """
+    Cache settings from EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_MB and EMBEDDING_CACHE_MEMORY_ITEMS.
+
+    Returns None, disabling the cache, when EMBEDDING_CACHE_PATH is set to an empty value.
+    """
+    db_path = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+    if not db_path:
+        return None
+    return EmbeddingCacheConfig(
+        db_path=db_path,
+        memory_items=int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 10000)),
+        max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", 256)) * 1024 * 1024),
+    )
@@ -24,7 +24,8 @@ logger.info("Environment variables reloaded image generation")
 # Constants
 HEURIST_BASE_URL = os.getenv("HEURIST_BASE_URL")
 HEURIST_API_KEY = os.getenv("HEURIST_API_KEY")
-SEQUENCER_API_ENDPOINT = "http://sequencer.heurist.xyz/submit_job"
+HEURIST_SEQUENCER_URL = os.getenv("HEURIST_SEQUENCER_URL") or "http://sequencer.heurist.xyz"
+SEQUENCER_API_ENDPOINT = f"{HEURIST_SEQUENCER_URL}/submit_job"
 PROMPT_MODEL_ID = "mistralai/mixtral-8x7b-instruct"
 
 AVAILABLE_IMAGE_MODELS = ["AnimagineXL", "BrainDance", "BluePencilRealistic", "ArthemyComics", "AAMXLAnimeMix"]
@@ -96,7 +97,7 @@ def generate_image_convo_prompt(original_tweet: str, reply: str) -> str:
 async def generate_image_smartgen(prompt: str) -> dict:
     """Generate an image using SmartGen with enhanced parameters."""
     try:
-        async with SmartGen(api_key=HEURIST_API_KEY) as generator:
+        async with SmartGen(api_key=HEURIST_API_KEY, base_url=HEURIST_SEQUENCER_URL) as generator:
             response = await generator.generate_image(
                 description=prompt,
                 image_model=IMAGE_MODEL_ID,
@@ -0,0 +1,137 @@
+import json
+import re
+from typing import Any, Dict, Iterator, List
+
+# Characters read from the file at a time while streaming
+READ_SIZE = 1 << 20
+# Words, numbers and single punctuation marks: close to, and slightly below, subword token counts
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def iter_json_items(path: str, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """
+    Stream the elements of a top-level JSON array without loading the whole file.
+
+    Only one element and a read buffer are held in memory at a time, so multi-GB knowledge files
+    can be ingested. Any other top-level value is yielded as a single item.
+
+    Args:
+        path: Path to the JSON file
+        read_size: Characters read from the file at a time
+
+    Yields:
+        The decoded array elements, in file order
+
+    Raises:
+        json.JSONDecodeError: The file is not valid JSON
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = ""
+        while not buffer:
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            buffer = chunk.lstrip()
+        if not buffer.startswith("["):
+            yield json.loads(buffer + f.read())
+            return
+
+        position, eof, wanted = 1, False, read_size
+        while True:
+            # Skip whitespace and the comma separating elements
+            while True:
+                while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ","):
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = f.read(read_size), 0
+                eof = not buffer
+            if position >= len(buffer):
+                raise json.JSONDecodeError("Unterminated array", buffer, position)
+            if buffer[position] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # A number cut off by the end of the buffer may continue in the next read
+                complete = eof or (end < len(buffer) and (buffer[end].isspace() or buffer[end] in ",]"))
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # Grow the read size so a single huge element is not decoded over and over
+                chunk = f.read(wanted)
+                eof = not chunk
+                buffer, position, wanted = buffer[position:] + chunk, 0, wanted * 2
+                continue
+
+            yield item
+            position, wanted = end, read_size
+            # Drop consumed text once it dominates the buffer
+            if position > read_size:
+                buffer, position = buffer[position:], 0
+
+
+def item_text(item: Dict[str, Any]) -> str:
+    """
+    Text stored for a knowledge base item: every key-value pair, nested structures as JSON.
+
+    Args:
+        item: One object of the knowledge file
+
+    Returns:
+        str: "key: value" lines separated by blank lines
+    """
+    parts = []
+    for key, value in item.items():
+        if isinstance(value, (str, int, float, bool)):
+            parts.append(f"{key}: {value}")
+        elif isinstance(value, (list, dict)):
+            # Handle nested structures by converting to string
+            parts.append(f"{key}: {json.dumps(value)}")
+    return "\n\n".join(parts)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate number of model tokens in a text"""
+    return sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+
+
+def chunk_text(text: str, max_tokens: int = 256, overlap: int = 32) -> List[str]:
+    """
+    Split a text into overlapping chunks of at most max_tokens tokens.
+
+    Chunks are slices of the original text, so formatting is kept. A chunk ends at the last line
+    break in the second half of its window when there is one, so "key: value" lines stay
+    together where possible. Consecutive chunks share `overlap` tokens, so a fact cut by a chunk
+    boundary is still found whole in one of them.
+
+    Args:
+        text: The text to split
+        max_tokens: Maximum tokens per chunk, as counted by count_tokens
+        overlap: Tokens repeated at the start of the next chunk, less than max_tokens
+
+    Returns:
+        List[str]: The chunks in text order, [text] when it fits in one chunk
+    """
+    if overlap >= max_tokens:
+        raise ValueError(f"Chunk overlap ({overlap}) must be smaller than the chunk size ({max_tokens})")
+    spans = [match.span() for match in _TOKEN_PATTERN.finditer(text)]
+    if len(spans) <= max_tokens:
+        return [text]
+
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + max_tokens, len(spans))
+        if end < len(spans):
+            for boundary in range(end, start + max_tokens // 2, -1):
+                if "\n" in text[spans[boundary - 1][1] : spans[boundary][0]]:
+                    end = boundary
+                    break
+        chunks.append(text[spans[start][0] : spans[end - 1][1]])
+        if end == len(spans):
+            return chunks
+        start = max(end - overlap, start + 1)
@@ -0,0 +1,365 @@
+"""
+Streaming, resumable migration of an existing embeddings database into any storage provider.
+
+The source table is read through a read-only connection with keyset pagination, so databases of
+any schema version (including the original JSON-text embeddings) can be migrated without being
+modified or loaded into memory. Progress and the source -> target id map are kept in a small
+SQLite checkpoint file: an interrupted run continues from the last committed batch, and a final
+pass verifies every migrated row against the source.
+
+Usage:
+    python -m core.migrate embeddings.db --target-type sqlite --target embeddings_v2.db
+    python -m core.migrate embeddings.db --target-type sqlite --target embeddings_q.db --quantization int8
+    python -m core.migrate embeddings.db --target-type segment --target embeddings_segments
+    python -m core.migrate embeddings.db --target-type postgres
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from core.embedding import (
+    MessageData,
+    PostgresConfig,
+    PostgresVectorStorage,
+    SQLiteConfig,
+    SQLiteVectorStorage,
+    VectorStorageProvider,
+    timestamp_key,
+)
+from core.segment_store import SegmentConfig, SegmentVectorStorage
+from core.vector_search import decode_embedding, dequantize_embedding
+
+logger = logging.getLogger(__name__)
+
+# Columns copied when the source has them; older schema versions lack the later ones
+SOURCE_COLUMNS = [
+    "id",
+    "message",
+    "embedding",
+    "timestamp",
+    "message_type",
+    "chat_id",
+    "source_interface",
+    "original_query",
+    "original_embedding",
+    "response_type",
+    "key_topics",
+    "tool_call",
+    "embedding_q",
+    "embedding_scale",
+    "original_message_id",
+    "content_hash",
+    "parent_id",
+]
+# Metadata compared by verify, besides message, type, chat and the embedding itself
+VERIFIED_COLUMNS = ["timestamp", "original_query", "response_type", "key_topics", "tool_call", "content_hash"]
+
+
+@dataclass
+class MigrationResult:
+    # Rows copied by this run and in total, including earlier interrupted runs
+    migrated: int
+    total: int
+    # Rows of the source table when the run finished
+    source_rows: int
+
+
+class EmbeddingMigration:
+    """
+    Copy the rows of a SQLite message_embeddings table into a storage provider in batches.
+
+    The target must not be written by anything else while a migration is in progress: rows after
+    the last checkpointed target id are treated as the remains of an interrupted batch.
+    """
+
+    def __init__(
+        self,
+        source_path: str,
+        target: VectorStorageProvider,
+        checkpoint_path: str,
+        source_table: str = "message_embeddings",
+        batch_size: int = 1000,
+    ):
+        self.source_path = source_path
+        self.target = target
+        self.checkpoint_path = checkpoint_path
+        self.source_table = source_table
+        self.batch_size = batch_size
+        self.source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        available = {row[1] for row in self.source.execute(f"PRAGMA table_info({source_table})")}
+        if not available:
+            raise ValueError(f"{source_path} has no table {source_table}")
+        self.columns = [column for column in SOURCE_COLUMNS if column in available]
+        self.checkpoint = sqlite3.connect(checkpoint_path)
+        with self.checkpoint:
+            self.checkpoint.execute("CREATE TABLE IF NOT EXISTS migration_state (key TEXT PRIMARY KEY, value INTEGER)")
+            self.checkpoint.execute(
+                "CREATE TABLE IF NOT EXISTS id_map (source_id INTEGER PRIMARY KEY, target_id INTEGER NOT NULL)"
+            )
+
+    def _state(self, key: str) -> Optional[int]:
+        row = self.checkpoint.execute("SELECT value FROM migration_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _target_ids(self, after_id: int) -> Iterator[int]:
+        for batch in self.target.iter_embeddings(batch_size=self.batch_size, after_id=after_id):
+            for row in batch:
+                yield row["id"]
+
+    def _iter_source(self, after_id: int = 0) -> Iterator[List[Dict[str, Any]]]:
+        """Stream source rows in id order, decoded into plain values"""
+        while True:
+            rows = self.source.execute(
+                f"SELECT {', '.join(self.columns)} FROM {self.source_table} WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, self.batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield [self._decode(dict(zip(self.columns, row))) for row in rows]
+
+    @staticmethod
+    def _decode(row: Dict[str, Any]) -> Dict[str, Any]:
+        if row["embedding"]:
+            row["embedding"] = decode_embedding(row["embedding"])
+        else:
+            # Stored without full precision: only the quantized codes are left, int8 rows have a scale
+            scale = row.get("embedding_scale")
+            mode = "int8" if scale is not None else "float16"
+            row["embedding"] = dequantize_embedding(row["embedding_q"], mode, scale)
+        if row.get("original_embedding"):
+            row["original_embedding"] = decode_embedding(row["original_embedding"]).tolist()
+        if row.get("key_topics"):
+            row["key_topics"] = json.loads(row["key_topics"])
+        return row
+
+    def _target_id(self, source_id: Optional[int], batch_ids: Dict[int, int]) -> Optional[int]:
+        """Target id of an already copied source row, None when it was not copied"""
+        if not source_id:
+            return None
+        if source_id in batch_ids:
+            return batch_ids[source_id]
+        mapped = self.checkpoint.execute("SELECT target_id FROM id_map WHERE source_id = ?", (source_id,)).fetchone()
+        return mapped[0] if mapped else None
+
+    def _message_data(self, row: Dict[str, Any], batch_ids: Dict[int, int]) -> MessageData:
+        return MessageData(
+            message=row["message"],
+            embedding=row["embedding"].tolist(),
+            timestamp=row["timestamp"],
+            message_type=row["message_type"],
+            chat_id=row.get("chat_id"),
+            source_interface=row.get("source_interface"),
+            original_query=row.get("original_query"),
+            original_embedding=row.get("original_embedding"),
+            response_type=row.get("response_type"),
+            key_topics=row.get("key_topics"),
+            tool_call=row.get("tool_call"),
+            original_message_id=self._target_id(row.get("original_message_id"), batch_ids),
+            content_hash=row.get("content_hash"),
+            parent_id=self._target_id(row.get("parent_id"), batch_ids),
+        )
+
+    def _store_batch(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        Store a batch of source rows in order, returning their target ids.
+
+        A row referencing an earlier row of the same batch (a response its query, a chunk its first
+        chunk) starts a new insert, so the referenced row already has its target id.
+        """
+        batch_ids: Dict[int, int] = {}
+        target_ids: List[int] = []
+        pending: Dict[int, Dict[str, Any]] = {}
+
+        def flush() -> None:
+            stored = self.target.store_embeddings([self._message_data(row, batch_ids) for row in pending.values()])
+            batch_ids.update(zip(pending, stored))
+            target_ids.extend(stored)
+            pending.clear()
+
+        for row in rows:
+            if row.get("original_message_id") in pending or row.get("parent_id") in pending:
+                flush()
+            pending[row["id"]] = row
+        if pending:
+            flush()
+        return target_ids
+
+    def run(self) -> MigrationResult:
+        """
+        Copy every source row not migrated yet, resuming from the checkpoint.
+
+        Returns:
+            MigrationResult: Rows copied by this run, in total and in the source
+        """
+        baseline = self._state("baseline_target_id")
+        if baseline is None:
+            # Rows already in the target are left alone; only ids after them belong to this migration
+            baseline = max(self._target_ids(0), default=0)
+            with self.checkpoint:
+                self.checkpoint.execute("INSERT INTO migration_state VALUES ('baseline_target_id', ?)", (baseline,))
+        last_source_id = self._state("last_source_id") or 0
+        last_target_id = self._state("last_target_id") or baseline
+        # A batch written to the target but not checkpointed is removed and copied again
+        leftover = list(self._target_ids(last_target_id))
+        if leftover:
+            logger.warning(f"Removing {len(leftover)} row(s) of an interrupted batch from the target")
+            self.target.delete_messages(leftover)
+        if last_source_id:
+            logger.info(f"Resuming migration after source id {last_source_id}")
+
+        migrated = 0
+        try:
+            for rows in self._iter_source(last_source_id):
+                target_ids = self._store_batch(rows)
+                last_source_id, last_target_id = rows[-1]["id"], max(target_ids)
+                with self.checkpoint:
+                    self.checkpoint.executemany(
+                        "INSERT OR REPLACE INTO id_map VALUES (?, ?)",
+                        [(row["id"], target_id) for row, target_id in zip(rows, target_ids)],
+                    )
+                    self.checkpoint.executemany(
+                        "INSERT OR REPLACE INTO migration_state VALUES (?, ?)",
+                        [("last_source_id", last_source_id), ("last_target_id", last_target_id)],
+                    )
+                migrated += len(rows)
+                logger.info(f"Migrated {migrated} row(s) this run, up to source id {last_source_id}")
+        except Exception as e:
+            logger.error(f"Migration failed after source id {last_source_id}: {str(e)}")
+            raise
+        total = self.checkpoint.execute("SELECT COUNT(*) FROM id_map").fetchone()[0]
+        source_rows = self.source.execute(f"SELECT COUNT(*) FROM {self.source_table}").fetchone()[0]
+        return MigrationResult(migrated=migrated, total=total, source_rows=source_rows)
+
+    def verify(self, tolerance: float = 1e-4) -> List[str]:
+        """
+        Compare every migrated row with its source row, streaming both sides.
+
+        Args:
+            tolerance (float): Largest accepted 1 - cosine similarity between source and target embeddings,
+                raise it when the target keeps quantized vectors only
+
+        Returns:
+            List[str]: One description per mismatch, empty when the migration is complete and exact
+        """
+        problems = []
+        baseline = self._state("baseline_target_id") or 0
+        batches = self.target.iter_embeddings(batch_size=self.batch_size, after_id=baseline)
+        targets = (row for batch in batches for row in batch)
+        target_row = next(targets, None)
+        for rows in self._iter_source():
+            placeholders = ", ".join("?" * len(rows))
+            id_map = dict(
+                self.checkpoint.execute(
+                    f"SELECT source_id, target_id FROM id_map WHERE source_id IN ({placeholders})",
+                    [row["id"] for row in rows],
+                )
+            )
+            metadata = self.target.fetch_messages(list(id_map.values()), include_metadata=True)
+            for row in rows:
+                target_id = id_map.get(row["id"])
+                if target_id is None:
+                    problems.append(f"source row {row['id']} was not migrated")
+                    continue
+                # Target ids grow with source ids, so both sides are walked once in the same order
+                while target_row is not None and target_row["id"] < target_id:
+                    target_row = next(targets, None)
+                if target_row is None or target_row["id"] != target_id or target_id not in metadata:
+                    problems.append(f"source row {row['id']} is missing from the target (id {target_id})")
+                    continue
+                stored = metadata[target_id]
+                for column in ["message", "message_type", "chat_id"] + VERIFIED_COLUMNS:
+                    source_value, target_value = row.get(column), stored.get(column)
+                    # Postgres returns timestamps as aware datetimes, SQLite as the stored ISO strings
+                    if column == "timestamp" and source_value and target_value:
+                        source_value, target_value = timestamp_key(source_value), timestamp_key(target_value)
+                    if column in row and source_value != target_value:
+                        problems.append(f"source row {row['id']}: {column} differs")
+                source_vector, target_vector = row["embedding"], target_row["embedding"]
+                if source_vector.shape != target_vector.shape:
+                    problems.append(f"source row {row['id']}: embedding dimension differs")
+                    continue
+                norms = np.linalg.norm(source_vector) * np.linalg.norm(target_vector)
+                similarity = float(np.dot(source_vector, target_vector) / norms) if norms else 1.0
+                if 1 - similarity > tolerance:
+                    problems.append(f"source row {row['id']}: embedding differs (cosine {similarity:.6f})")
+        return problems
+
+    def close(self) -> None:
+        self.source.close()
+        self.checkpoint.close()
+
+
+def build_target(args: argparse.Namespace) -> VectorStorageProvider:
+    if args.target_type == "sqlite":
+        return SQLiteVectorStorage(
+            SQLiteConfig(
+                db_path=args.target,
+                table_name=args.target_table,
+                quantization=args.quantization,
+                store_full_precision=not args.drop_full_precision,
+            )
+        )
+    if args.target_type == "segment":
+        return SegmentVectorStorage(SegmentConfig(directory=args.target, table_name=args.target_table))
+    return PostgresVectorStorage(
+        PostgresConfig(
+            host=os.getenv("VECTOR_DB_HOST", "localhost"),
+            port=int(os.getenv("VECTOR_DB_PORT", 5432)),
+            database=os.getenv("VECTOR_DB_NAME"),
+            user=os.getenv("VECTOR_DB_USER"),
+            password=os.getenv("VECTOR_DB_PASSWORD"),
+            table_name=args.target_table,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Existing SQLite database, opened read-only")
+    parser.add_argument("--source-table", default="message_embeddings")
+    parser.add_argument("--target-type", choices=["sqlite", "segment", "postgres"], default="sqlite")
+    parser.add_argument("--target", help="Database file (sqlite) or directory (segment), unused for postgres")
+    parser.add_argument("--target-table", default="message_embeddings")
+    parser.add_argument("--quantization", choices=["float16", "int8"], help="Quantized copy for sqlite targets")
+    parser.add_argument("--drop-full-precision", action="store_true", help="Keep only the quantized copy")
+    parser.add_argument("--checkpoint", help="Progress file, defaults to <source>.migration")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Accepted 1 - cosine when verifying")
+    parser.add_argument("--skip-verify", action="store_true")
+    args = parser.parse_args()
+    if args.target_type != "postgres" and not args.target:
+        parser.error("--target is required for sqlite and segment targets")
+    if args.target and os.path.abspath(args.target) == os.path.abspath(args.source):
+        parser.error("The target must differ from the source")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    target = build_target(args)
+    target.initialize()
+    migration = EmbeddingMigration(
+        args.source, target, args.checkpoint or f"{args.source}.migration", args.source_table, args.batch_size
+    )
+    try:
+        result = migration.run()
+        logger.info(f"Migrated {result.migrated} row(s), {result.total} of {result.source_rows} in total")
+        if not args.skip_verify:
+            problems = migration.verify(args.tolerance)
+            for problem in problems[:50]:
+                logger.error(problem)
+            if problems:
+                raise SystemExit(f"Verification failed: {len(problems)} mismatch(es)")
+            logger.info("Verification passed")
+    finally:
+        migration.close()
+        target.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from core.embedding import MessageData, RetentionPolicy, SQLiteConfig, SQLiteVectorStorage, VectorStorageProvider
+from core.vector_search import DEFAULT_SHARD_ROWS, EMBEDDING_DTYPE, cosine_scores, select_top
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Filter results of _allowed_ids kept per manifest version
+ALLOWED_IDS_CACHE_SIZE = 64
+
+
+@dataclass
+class SegmentConfig:
+    """Configuration for the memory-mapped segment store"""
+
+    directory: str = "embeddings_segments"
+    table_name: str = "message_embeddings"
+    # Segments smaller than this are merged together once there are more than merge_threshold of them
+    segment_rows: int = 100000
+    merge_threshold: int = 16
+    # A merge only takes in an older segment holding at most merge_ratio times the rows of the newer
+    # segments merged with it, so segments grow in tiers and every row is rewritten O(log n) times
+    merge_ratio: float = 1.0
+    # FTS5 index on the metadata table, required by search_text
+    full_text_search: bool = False
+    # BM25 score a keyword-only match needs to enter hybrid_search results
+    min_text_score: float = 1.0
+    # Threads scoring segments (split into shards of shard_rows rows) in parallel, 1 scores inline
+    search_workers: int = 1
+    shard_rows: int = DEFAULT_SHARD_ROWS
+
+
+class _Segment:
+    """One sealed segment: memory-mapped vectors, ids and norms"""
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        # mmap_mode="r" maps the files read-only, so every process shares the same page-cache copy
+        self.vectors = np.load(os.path.join(directory, f"{name}.vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(directory, f"{name}.ids.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(directory, f"{name}.norms.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class SegmentVectorStorage(VectorStorageProvider):
+    """
+    Storage provider keeping vectors in append-only, memory-mapped .npy segments.
+
+    Metadata (message text, type, chat, ...) lives in an SQLite table next to the segments. Every
+    write seals a new segment and publishes it through an atomically replaced manifest; small
+    segments of similar size are merged as later writes arrive. Several processes can open the same
+    directory: they map the same files and pick up new segments when the manifest changes, and a
+    restart only has to read the manifest. Only one process may write at a time.
+
+    Deleted rows are recorded as tombstones in the manifest and dropped when their segment is merged.
+    """
+
+    def __init__(self, config: SegmentConfig = None):
+        self.config = config or SegmentConfig()
+        self.metadata = SQLiteVectorStorage(
+            SQLiteConfig(
+                db_path=os.path.join(self.config.directory, "metadata.db"),
+                table_name=self.config.table_name,
+                external_vectors=True,
+                full_text_search=self.config.full_text_search,
+                min_text_score=self.config.min_text_score,
+            )
+        )
+        self.manifest_path = os.path.join(self.config.directory, MANIFEST_NAME)
+        self._manifest: Dict[str, Any] = {"dim": None, "next_segment": 1, "segments": [], "tombstones": []}
+        self._manifest_version: Optional[tuple] = None
+        self._segments: List[_Segment] = []
+        self._tombstones = np.empty(0, dtype=np.int64)
+        self._lock = threading.RLock()
+        self._search_executor: Optional[ThreadPoolExecutor] = None
+        self._allowed_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+
+    def initialize(self) -> None:
+        """Open the metadata table and map the segments listed in the manifest"""
+        try:
+            os.makedirs(self.config.directory, exist_ok=True)
+            self.metadata.initialize()
+            if self.config.search_workers > 1 and self._search_executor is None:
+                self._search_executor = ThreadPoolExecutor(
+                    max_workers=self.config.search_workers, thread_name_prefix="segment-search"
+                )
+            self._refresh()
+            indexed = max((int(segment.ids[-1]) for segment in self._segments if len(segment)), default=0)
+            stored = self.metadata.conn.execute(f"SELECT MAX(id) FROM {self.config.table_name}").fetchone()[0] or 0
+            if stored > indexed:
+                logger.warning(f"Rows after id {indexed} have metadata but no vectors and are not searchable")
+            logger.info(f"Opened {len(self._segments)} segment(s) in {self.config.directory}")
+        except Exception as e:
+            logger.error(f"Failed to initialize segment storage: {str(e)}")
+            raise
+
+    def _refresh(self) -> None:
+        """Reload the manifest when another writer (or this one) has published a new version"""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return
+        # os.replace gives every published manifest a new inode, which catches same-mtime updates
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if version == self._manifest_version:
+                return
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            loaded = {segment.name: segment for segment in self._segments}
+            self._segments = [
+                loaded.get(entry["name"]) or _Segment(self.config.directory, entry["name"])
+                for entry in manifest["segments"]
+            ]
+            self._tombstones = np.asarray(manifest["tombstones"], dtype=np.int64)
+            self._manifest = manifest
+            self._manifest_version = version
+            self._allowed_cache.clear()
+
+    def _publish(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_version = None
+        self._refresh()
+
+    def _write_segment(self, name: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+        for suffix, array in (
+            ("ids", np.asarray(ids, dtype=np.int64)),
+            ("vectors", np.ascontiguousarray(vectors, dtype=EMBEDDING_DTYPE)),
+            ("norms", np.linalg.norm(vectors, axis=1).astype(EMBEDDING_DTYPE)),
+        ):
+            path = os.path.join(self.config.directory, f"{name}.{suffix}.npy")
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(f"{path}.tmp", path)
+
+    def _remove_segment_files(self, name: str) -> None:
+        for suffix in ("ids", "vectors", "norms"):
+            try:
+                os.remove(os.path.join(self.config.directory, f"{name}.{suffix}.npy"))
+            except OSError as e:
+                # Still mapped by a reader on platforms that forbid it; the file is simply left behind
+                logger.warning(f"Could not remove merged segment file {name}.{suffix}.npy: {str(e)}")
+
+    def store_embedding(self, message_data: MessageData) -> int:
+        return self.store_embeddings([message_data])[0]
+
+    def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        """Store metadata in SQLite, then seal the vectors into a new segment"""
+        if not batch:
+            return []
+        try:
+            vectors = np.asarray([message_data.embedding for message_data in batch], dtype=EMBEDDING_DTYPE)
+            with self._lock:
+                self._refresh()
+                if self._manifest["dim"] not in (None, vectors.shape[1]):
+                    raise ValueError(f"Expected {self._manifest['dim']}-dimensional embeddings, got {vectors.shape[1]}")
+                # Vectors live in the segments only, the metadata table is configured with external_vectors
+                row_ids = self.metadata.store_embeddings(batch)
+                manifest = dict(self._manifest, dim=vectors.shape[1])
+                name = f"segment-{manifest['next_segment']:08d}"
+                self._write_segment(name, np.asarray(row_ids), vectors)
+                manifest["next_segment"] += 1
+                manifest["segments"] = manifest["segments"] + [{"name": name, "rows": len(row_ids)}]
+                self._publish(manifest)
+                if self._small_segments() > self.config.merge_threshold:
+                    self.merge_segments()
+            return row_ids
+        except Exception as e:
+            logger.error(f"Failed to store message: {str(e)}")
+            raise
+
+    def _small_segments(self) -> int:
+        return sum(1 for entry in self._manifest["segments"] if entry["rows"] < self.config.segment_rows)
+
+    def merge_segments(self, force: bool = False) -> None:
+        """
+        Merge consecutive small segments and drop tombstoned rows from them.
+
+        Args:
+            force (bool): Rewrite every segment holding tombstones, even when few segments are small
+        """
+        with self._lock:
+            self._refresh()
+            tombstones = self._tombstones
+            dirty = set()
+            if force:
+                groups, dirty = self._compaction_groups(tombstones)
+            else:
+                groups = self._tiered_groups()
+
+            manifest = dict(self._manifest)
+            segments = list(manifest["segments"])
+            replaced: Dict[int, Optional[Dict[str, Any]]] = {}
+            merged_names = []
+            for group in groups:
+                if len(group) < 2 and not dirty.intersection(group):
+                    continue
+                ids = np.concatenate([self._segments[index].ids for index in group])
+                vectors = np.concatenate([self._segments[index].vectors for index in group])
+                keep = ~np.isin(ids, tombstones)
+                name = f"segment-{manifest['next_segment']:08d}"
+                manifest["next_segment"] += 1
+                self._write_segment(name, ids[keep], vectors[keep])
+                replaced[group[0]] = {"name": name, "rows": int(keep.sum())}
+                for index in group[1:]:
+                    replaced[index] = None
+                merged_names += [segments[index]["name"] for index in group]
+            if not merged_names:
+                return
+
+            manifest["segments"] = [
+                replaced[index] if index in replaced else entry
+                for index, entry in enumerate(segments)
+                if replaced.get(index, entry) is not None
+            ]
+            # Tombstones only need to outlive the segments that still hold their rows
+            remaining = set()
+            for index in range(len(segments)):
+                if index not in replaced:
+                    remaining.update(self._segments[index].ids.tolist())
+            manifest["tombstones"] = [int(row_id) for row_id in tombstones if int(row_id) in remaining]
+            self._publish(manifest)
+            for name in merged_names:
+                self._remove_segment_files(name)
+            logger.info(f"Merged {len(merged_names)} segment(s), {len(manifest['segments'])} remaining")
+
+    def _compaction_groups(self, tombstones: np.ndarray) -> Tuple[List[List[int]], Set[int]]:
+        """Every run of small or tombstoned segments, packed into groups of up to segment_rows rows"""
+        groups: List[List[int]] = [[]]
+        dirty = set()
+        rows = 0
+        for index, entry in enumerate(self._manifest["segments"]):
+            if len(tombstones) and np.isin(self._segments[index].ids, tombstones).any():
+                dirty.add(index)
+            if entry["rows"] >= self.config.segment_rows and index not in dirty:
+                groups.append([])
+                rows = 0
+                continue
+            if rows + entry["rows"] > self.config.segment_rows and groups[-1]:
+                groups.append([])
+                rows = 0
+            groups[-1].append(index)
+            rows += entry["rows"]
+        return groups, dirty
+
+    def _tiered_groups(self) -> List[List[int]]:
+        """
+        The newest segments of every run of small segments, back to the first one much larger than them.
+
+        Merging similar sizes only, like a binary counter, keeps a stream of small writes from
+        rewriting the same growing segment on every merge.
+        """
+        segments = self._manifest["segments"]
+        groups = []
+        run: List[int] = []
+        for index in range(len(segments) + 1):
+            if index < len(segments) and segments[index]["rows"] < self.config.segment_rows:
+                run.append(index)
+                continue
+            group: List[int] = []
+            rows = 0
+            for candidate in reversed(run):
+                size = segments[candidate]["rows"]
+                if group and (size > rows * self.config.merge_ratio or rows + size > self.config.segment_rows):
+                    break
+                group.insert(0, candidate)
+                rows += size
+            if len(group) > 1:
+                groups.append(group)
+            run = []
+        return groups
+
+    def _allowed_ids(
+        self, message_type: str = None, chat_id: str = None, version: Optional[tuple] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Ids matching the filters, None when no filter applies.
+
+        Rows only become searchable, or stop being searchable, with a new manifest, so the result is
+        cached for the manifest version it was computed under.
+        """
+        if not message_type and not chat_id:
+            return None
+        key = (version, message_type, chat_id)
+        with self._lock:
+            if version is not None and key in self._allowed_cache:
+                self._allowed_cache.move_to_end(key)
+                return self._allowed_cache[key]
+        query_conditions, query_params = [], []
+        if message_type:
+            query_conditions.append("message_type = ?")
+            query_params.append(message_type)
+        if chat_id:
+            query_conditions.append("chat_id = ?")
+            query_params.append(chat_id)
+        rows = self.metadata.conn.execute(
+            f"SELECT id FROM {self.config.table_name} WHERE {' AND '.join(query_conditions)}", tuple(query_params)
+        ).fetchall()
+        allowed = np.fromiter((row_id for (row_id,) in rows), dtype=np.int64, count=len(rows))
+        if version is not None:
+            with self._lock:
+                self._allowed_cache[key] = allowed
+                if len(self._allowed_cache) > ALLOWED_IDS_CACHE_SIZE:
+                    self._allowed_cache.popitem(last=False)
+        return allowed
+
+    def _live_mask(
+        self, ids: np.ndarray, allowed: Optional[np.ndarray], tombstones: Optional[np.ndarray] = None
+    ) -> Optional[np.ndarray]:
+        tombstones = self._tombstones if tombstones is None else tombstones
+        mask = None
+        if len(tombstones):
+            mask = ~np.isin(ids, tombstones)
+        if allowed is not None:
+            allowed_mask = np.isin(ids, allowed)
+            mask = allowed_mask if mask is None else mask & allowed_mask
+        return mask
+
+    def _shard_top(
+        self,
+        segment: _Segment,
+        start: int,
+        embedding: List[float],
+        threshold: float,
+        top_k: Optional[int],
+        allowed: Optional[np.ndarray],
+        tombstones: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        end = start + self.config.shard_rows
+        ids = np.asarray(segment.ids[start:end])
+        scores = cosine_scores(segment.vectors[start:end], segment.norms[start:end], embedding)
+        mask = self._live_mask(ids, allowed, tombstones)
+        if mask is not None:
+            scores[~mask] = -np.inf
+        matches = select_top(scores, threshold, top_k)
+        return ids[matches], scores[matches]
+
+    def find_similar(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+    ) -> List[Dict[str, Any]]:
+        """Score every live row of every mapped segment shard by shard, then merge the per-shard top_k"""
+        try:
+            self._refresh()
+            with self._lock:
+                segments, tombstones, version = list(self._segments), self._tombstones, self._manifest_version
+            allowed = self._allowed_ids(message_type, chat_id, version)
+            embedding = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+            shards = [
+                (segment, start, embedding, threshold, top_k, allowed, tombstones)
+                for segment in segments
+                for start in range(0, len(segment), self.config.shard_rows)
+            ]
+            if self._search_executor is not None and len(shards) > 1:
+                partials = list(self._search_executor.map(lambda shard: self._shard_top(*shard), shards))
+            else:
+                partials = [self._shard_top(*shard) for shard in shards]
+            if not partials:
+                return []
+            ids = np.concatenate([partial[0] for partial in partials])
+            scores = np.concatenate([partial[1] for partial in partials])
+            order = select_top(scores, threshold, top_k)
+            rows = self.metadata.fetch_messages([int(row_id) for row_id in ids[order]])
+            return [
+                {"message": rows[int(ids[i])]["message"], "similarity": float(scores[i])}
+                for i in order
+                if int(ids[i]) in rows
+            ]
+        except Exception as e:
+            logger.error(f"Failed to find similar messages: {str(e)}")
+            raise
+
+    def close(self) -> None:
+        """Close the metadata connection and unmap the segments"""
+        with self._lock:
+            self._segments = []
+            self._manifest_version = None
+        if self._search_executor is not None:
+            self._search_executor.shutdown(wait=False)
+            self._search_executor = None
+        self.metadata.close()
+
+    def find_messages(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict[str, Any]]:
+        return self.metadata.find_messages(message_type, original_query, chat_id, limit, include_embeddings)
+
+    def iter_embeddings(
+        self, message_type: str = None, chat_id: str = None, batch_size: int = 1000, after_id: int = 0
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Stream live rows in id order straight from the mapped segments"""
+        self._refresh()
+        with self._lock:
+            segments, version = list(self._segments), self._manifest_version
+        allowed = self._allowed_ids(message_type, chat_id, version)
+        for segment in segments:
+            if not len(segment) or segment.ids[-1] <= after_id:
+                continue
+            mask = np.asarray(segment.ids) > after_id
+            live = self._live_mask(np.asarray(segment.ids), allowed)
+            if live is not None:
+                mask &= live
+            positions = np.flatnonzero(mask)
+            for start in range(0, len(positions), batch_size):
+                chunk = positions[start : start + batch_size]
+                rows = self.metadata.fetch_messages([int(row_id) for row_id in segment.ids[chunk]])
+                batch = [
+                    {
+                        "id": int(segment.ids[position]),
+                        "message": rows[int(segment.ids[position])]["message"],
+                        "message_type": rows[int(segment.ids[position])]["message_type"],
+                        "chat_id": rows[int(segment.ids[position])]["chat_id"],
+                        "embedding": np.array(segment.vectors[position]),
+                    }
+                    for position in chunk
+                    if int(segment.ids[position]) in rows
+                ]
+                if batch:
+                    yield batch
+
+    def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        return self.metadata.fetch_messages(ids, include_metadata)
+
+    def _add_tombstones(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            self._refresh()
+            manifest = dict(self._manifest)
+            manifest["tombstones"] = sorted(set(manifest["tombstones"]) | {int(row_id) for row_id in ids})
+            self._publish(manifest)
+
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        return self.metadata.find_content_hashes(hashes, message_type)
+
+    def find_message_timestamps(self, messages: List[str], message_type: str) -> List[Tuple[int, str, Any]]:
+        return self.metadata.find_message_timestamps(messages, message_type)
+
+    def find_orphaned_chunks(self, message_type: str) -> List[int]:
+        return self.metadata.find_orphaned_chunks(message_type)
+
+    def delete_messages(self, ids: List[int]) -> int:
+        """Delete metadata rows and tombstone their vectors"""
+        deleted = self.metadata.delete_messages(ids)
+        self._add_tombstones(ids)
+        return deleted
+
+    def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        deleted = self.metadata.delete_expired(policy)
+        self._add_tombstones(deleted)
+        return deleted
+
+    def compact(self, reindex: bool = False) -> None:
+        """Rewrite segments holding tombstones and compact the metadata database"""
+        self.merge_segments(force=True)
+        self.metadata.compact(reindex)
+
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        return self.metadata.search_text(text, message_type, chat_id, limit)
+
+    def collection(self, name: str, **overrides) -> "SegmentVectorStorage":
+        """Segment storage for a named collection in its own subdirectory"""
+        return SegmentVectorStorage(
+            replace(self.config, **{"directory": os.path.join(self.config.directory, name), **overrides})
+        )
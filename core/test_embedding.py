@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime, timedelta
+
+from core.embedding import MessageData, MessageStore, SQLiteConfig, SQLiteVectorStorage, WriteBehindConfig
+
+
+class PostgresShapedStorage(SQLiteVectorStorage):
+    """SQLite storage returning timezone-aware datetimes, as psycopg2 does for TIMESTAMPTZ columns"""
+
+    def __init__(self, config: SQLiteConfig):
+        super().__init__(config)
+        self.hold_writes = False
+        self.written = threading.Event()
+        self.release = threading.Event()
+
+    def store_embeddings(self, batch):
+        ids = super().store_embeddings(batch)
+        if self.hold_writes:
+            # Committed but not yet acknowledged: the rows are both stored and still queued
+            self.written.set()
+            self.release.wait(5)
+        return ids
+
+    def find_messages(self, *args, **kwargs):
+        rows = super().find_messages(*args, **kwargs)
+        for row in rows:
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"]).astimezone()
+        return rows
+
+
+def message(text: str, timestamp: datetime) -> MessageData:
+    return MessageData(
+        message=text,
+        embedding=[1.0, 0.0, 0.0],
+        timestamp=timestamp.isoformat(),
+        message_type="user_message",
+        chat_id="chat",
+        source_interface="test",
+        original_query=None,
+        original_embedding=None,
+        response_type=None,
+        key_topics=None,
+        tool_call=None,
+    )
+
+
+def test_find_messages_merges_queued_rows_with_postgres_timestamps(tmp_path):
+    storage = PostgresShapedStorage(SQLiteConfig(db_path=str(tmp_path / "embeddings.db")))
+    store = MessageStore(storage, write_behind=WriteBehindConfig())
+    now = datetime.now()
+    try:
+        store.add_message(message("stored", now - timedelta(minutes=2)))
+        storage.hold_writes = True
+        store.queue_message(message("flushed", now - timedelta(minutes=1)))
+        assert storage.written.wait(5)
+        # "flushed" is committed but still queued, so find_messages sees it on both sides of the merge
+        store.queue_message(message("queued", now))
+
+        results = store.find_messages(chat_id="chat")
+
+        assert [row["message"] for row in results] == ["queued", "flushed", "stored"]
+        assert [row["message"] for row in store.find_messages(chat_id="chat", limit=2)] == ["queued", "flushed"]
+    finally:
+        storage.release.set()
+        store.close()
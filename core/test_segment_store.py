@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from core.embedding import MessageData
+from core.segment_store import SegmentConfig, SegmentVectorStorage
+
+
+def message(text: str, embedding) -> MessageData:
+    return MessageData(
+        message=text,
+        embedding=embedding,
+        timestamp=datetime.now().isoformat(),
+        message_type="knowledge_base",
+        chat_id="chat",
+        source_interface="test",
+        original_query=None,
+        original_embedding=None,
+        response_type=None,
+        key_topics=None,
+        tool_call=None,
+    )
+
+
+def test_segment_store_reopens_after_writes(tmp_path):
+    config = SegmentConfig(directory=str(tmp_path / "segments"))
+    storage = SegmentVectorStorage(config)
+    storage.initialize()
+    storage.store_embeddings([message("first", [1.0, 0.0, 0.0]), message("second", [0.0, 1.0, 0.0])])
+    storage.close()
+
+    reopened = SegmentVectorStorage(config)
+    reopened.initialize()
+    try:
+        results = reopened.find_similar([1.0, 0.0, 0.0], threshold=0.5)
+
+        assert [row["message"] for row in results] == ["first"]
+    finally:
+        reopened.close()
+
+
+def test_segment_metadata_keeps_no_vectors(tmp_path):
+    storage = SegmentVectorStorage(SegmentConfig(directory=str(tmp_path / "segments")))
+    storage.initialize()
+    try:
+        storage.store_embeddings([message("first", [1.0, 0.0, 0.0])])
+
+        rows = storage.metadata.conn.execute(
+            "SELECT length(embedding), embedding_norm, embedding_q FROM message_embeddings"
+        ).fetchall()
+
+        assert rows == [(0, None, None)]
+    finally:
+        storage.close()
@@ -0,0 +1,217 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.vector_search import EMBEDDING_DTYPE, sharded_top
+
+logger = logging.getLogger(__name__)
+
+# (message_type, chat_id) filter a partition was loaded for, None meaning "any"
+PartitionKey = Tuple[Optional[str], Optional[str]]
+
+
+class _PendingLoad:
+    """Writes and deletes seen while a partition is being read, replayed before it is registered"""
+
+    def __init__(self, key: PartitionKey):
+        self.key = key
+        self.appended: List[Tuple[int, str, Sequence[float]]] = []
+        self.removed: List[int] = []
+
+
+class EmbeddingMatrix:
+    """Contiguous, growable float32 matrix holding the embeddings of one cache partition"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self.size = 0
+        self._vectors = np.empty((max(capacity, 1), dim), dtype=EMBEDDING_DTYPE)
+        self._norms = np.empty(max(capacity, 1), dtype=EMBEDDING_DTYPE)
+        self._ids = np.empty(max(capacity, 1), dtype=np.int64)
+        self.messages: List[str] = []
+        self._message_bytes = 0
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: self.size]
+
+    @property
+    def norms(self) -> np.ndarray:
+        return self._norms[: self.size]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self.size]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size of the partition"""
+        return self._vectors.nbytes + self._norms.nbytes + self._ids.nbytes + self._message_bytes
+
+    def _grow(self, needed: int, dim: int) -> None:
+        if self.size == 0 and dim != self.dim:
+            # Partitions cached while empty learn their dimension from the first stored row
+            self.dim = dim
+            self._vectors = np.empty((self._vectors.shape[0], dim), dtype=EMBEDDING_DTYPE)
+        capacity = self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._vectors = np.resize(self._vectors, (capacity, self.dim))
+        self._norms = np.resize(self._norms, capacity)
+        self._ids = np.resize(self._ids, capacity)
+
+    def append(self, row_id: int, message: str, vector: Sequence[float]) -> None:
+        """Append one embedding, growing the backing arrays geometrically"""
+        vector = np.asarray(vector, dtype=EMBEDDING_DTYPE)
+        self._grow(self.size + 1, vector.shape[0])
+        self._vectors[self.size] = vector
+        self._norms[self.size] = np.linalg.norm(vector)
+        self._ids[self.size] = row_id
+        self.messages.append(message)
+        self._message_bytes += len(message)
+        self.size += 1
+
+    def extend(self, row_ids: Sequence[int], messages: Sequence[str], vectors: np.ndarray) -> None:
+        """Append a batch of embeddings with a single copy"""
+        count = len(row_ids)
+        if count == 0:
+            return
+        vectors = np.asarray(vectors, dtype=EMBEDDING_DTYPE)
+        self._grow(self.size + count, vectors.shape[1])
+        self._vectors[self.size : self.size + count] = vectors
+        self._norms[self.size : self.size + count] = np.linalg.norm(vectors, axis=1)
+        self._ids[self.size : self.size + count] = row_ids
+        self.messages.extend(messages)
+        self._message_bytes += sum(len(message) for message in messages)
+        self.size += count
+
+    def remove(self, row_ids: Sequence[int]) -> int:
+        """Drop the given rows, keeping the remaining ones contiguous and in order"""
+        keep = ~np.isin(self.ids, row_ids)
+        removed = self.size - int(keep.sum())
+        if removed == 0:
+            return 0
+        size = self.size - removed
+        self._vectors[:size] = self.vectors[keep]
+        self._norms[:size] = self.norms[keep]
+        self._ids[:size] = self.ids[keep]
+        self.messages = [message for message, kept in zip(self.messages, keep) if kept]
+        self._message_bytes = sum(len(message) for message in self.messages)
+        self.size = size
+        return removed
+
+    def search(
+        self, embedding: Sequence[float], threshold: float, top_k: int = None, executor: Optional[Executor] = None
+    ) -> List[Dict[str, Any]]:
+        """Score the whole partition against the query and return matches above threshold, best first"""
+        if self.size == 0:
+            return []
+        matches, scores = sharded_top(self.vectors, self.norms, embedding, threshold, top_k, executor)
+        return [{"message": self.messages[i], "similarity": float(score)} for i, score in zip(matches, scores)]
+
+
+class EmbeddingMatrixCache:
+    """
+    In-process cache of embedding matrices partitioned by (message_type, chat_id).
+
+    Partitions are loaded on first use, kept up to date as new rows are stored and evicted least
+    recently used first once the total size exceeds max_bytes. The cache only sees writes made
+    through the owning MessageStore, so it must not be shared with other writer processes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._partitions: "OrderedDict[PartitionKey, EmbeddingMatrix]" = OrderedDict()
+        self._loading: List[_PendingLoad] = []
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(partition.nbytes for partition in self._partitions.values())
+
+    def get(self, key: PartitionKey) -> Optional[EmbeddingMatrix]:
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                self._partitions.move_to_end(key)
+            return partition
+
+    def load(self, key: PartitionKey, batches: Iterable[List[Dict[str, Any]]]) -> Optional[EmbeddingMatrix]:
+        """
+        Build a partition from batches of stored rows and keep it if it fits within the memory bound.
+
+        Rows stored or deleted through this cache while the batches are read are applied before the
+        partition is registered, so none of them is lost. Empty partitions are cached as well.
+
+        Returns:
+            EmbeddingMatrix: The loaded partition
+        """
+        pending = _PendingLoad(key)
+        with self._lock:
+            self._loading.append(pending)
+        try:
+            partition = EmbeddingMatrix(0)
+            for batch in batches:
+                if not batch:
+                    continue
+                vectors = np.vstack([row["embedding"] for row in batch])
+                partition.extend([row["id"] for row in batch], [row["message"] for row in batch], vectors)
+        finally:
+            with self._lock:
+                self._loading.remove(pending)
+
+        with self._lock:
+            loaded = set(partition.ids.tolist())
+            for row_id, message, vector in pending.appended:
+                if row_id not in loaded:
+                    partition.append(row_id, message, vector)
+            if pending.removed:
+                partition.remove(np.asarray(pending.removed, dtype=np.int64))
+            if partition.nbytes > self.max_bytes:
+                logger.warning(
+                    f"Embedding partition {key} needs {partition.nbytes} bytes, more than the cache bound "
+                    f"of {self.max_bytes}; serving it uncached"
+                )
+                return partition
+            self._partitions[key] = partition
+            self._evict()
+        return partition
+
+    def append(self, row_id: int, message: str, vector: Sequence[float], message_type: str, chat_id: str) -> None:
+        """Append a newly stored row to every loaded partition whose filter it matches"""
+        with self._lock:
+            for (partition_type, partition_chat), partition in self._partitions.items():
+                if partition_type not in (None, message_type) or partition_chat not in (None, chat_id):
+                    continue
+                partition.append(row_id, message, vector)
+            for pending in self._loading:
+                if pending.key[0] in (None, message_type) and pending.key[1] in (None, chat_id):
+                    pending.appended.append((row_id, message, vector))
+            self._evict()
+
+    def remove(self, row_ids: Sequence[int]) -> None:
+        """Drop deleted rows from every loaded partition"""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.remove(row_ids)
+            for pending in self._loading:
+                pending.removed.extend(row_ids.tolist())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._partitions.clear()
+
+    def _evict(self) -> None:
+        total = sum(partition.nbytes for partition in self._partitions.values())
+        while total > self.max_bytes and self._partitions:
+            key, partition = self._partitions.popitem(last=False)
+            total -= partition.nbytes
+            logger.info(f"Evicted embedding partition {key} ({partition.nbytes} bytes)")
@@ -0,0 +1,506 @@
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from core.embedding import MessageData, RetentionPolicy, VectorStorageProvider
+from core.vector_search import EMBEDDING_DTYPE, select_top
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IVFConfig:
+    """Configuration for the inverted-file (IVF) approximate nearest-neighbour index"""
+
+    index_path: str = "embeddings.ivf.npz"
+    # Number of inverted lists, defaults to sqrt(rows) when the index is trained
+    n_lists: Optional[int] = None
+    # Lists probed per query: higher means better recall and slower queries
+    n_probe: int = 8
+    # Keep probing past n_probe until a filtered query has seen this many candidates
+    min_candidates: int = 100
+    # Exhaustive search is used until the index holds this many rows
+    min_train_rows: int = 2000
+    # Sample size used to train the centroids
+    train_sample: int = 50000
+    kmeans_iterations: int = 10
+    # Retrain once the index has grown by this factor since the last training
+    retrain_growth: float = 4.0
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=EMBEDDING_DTYPE)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _spherical_kmeans(vectors: np.ndarray, n_lists: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Train unit-length centroids on normalized vectors with cosine (dot product) assignment"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        counts = np.bincount(assignment, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        order = np.argsort(assignment, kind="stable")
+        present = np.flatnonzero(counts)
+        sums[present] = np.add.reduceat(vectors[order], np.concatenate([[0], np.cumsum(counts[present])[:-1]]))
+        empty = counts == 0
+        # Re-seed empty lists with random points so every centroid stays useful
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class _InvertedList:
+    """Growable arrays holding the normalized vectors and filter codes of one IVF list"""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.size = 0
+        self.vectors = np.empty((capacity, dim), dtype=EMBEDDING_DTYPE)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.type_codes = np.empty(capacity, dtype=np.int32)
+        self.chat_codes = np.empty(capacity, dtype=np.int32)
+
+    def extend(self, ids: np.ndarray, vectors: np.ndarray, type_codes: np.ndarray, chat_codes: np.ndarray) -> None:
+        count = len(ids)
+        needed = self.size + count
+        capacity = self.vectors.shape[0]
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+            self.ids = np.resize(self.ids, capacity)
+            self.type_codes = np.resize(self.type_codes, capacity)
+            self.chat_codes = np.resize(self.chat_codes, capacity)
+        self.vectors[self.size : needed] = vectors
+        self.ids[self.size : needed] = ids
+        self.type_codes[self.size : needed] = type_codes
+        self.chat_codes[self.size : needed] = chat_codes
+        self.size = needed
+
+    def remove(self, ids: np.ndarray) -> int:
+        keep = ~np.isin(self.ids[: self.size], ids)
+        size = int(keep.sum())
+        removed = self.size - size
+        if removed:
+            self.vectors[:size] = self.vectors[: self.size][keep]
+            self.ids[:size] = self.ids[: self.size][keep]
+            self.type_codes[:size] = self.type_codes[: self.size][keep]
+            self.chat_codes[:size] = self.chat_codes[: self.size][keep]
+            self.size = size
+        return removed
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return (
+            self.vectors[: self.size],
+            self.ids[: self.size],
+            self.type_codes[: self.size],
+            self.chat_codes[: self.size],
+        )
+
+
+class _PendingChanges:
+    """Rows added to and removed from the index while new centroids are trained"""
+
+    def __init__(self):
+        self.added: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        self.removed: List[np.ndarray] = []
+
+
+class IVFIndex:
+    """
+    Inverted-file index over normalized embeddings built with NumPy.
+
+    Vectors are assigned to the nearest of n_lists k-means centroids. A query only scores the
+    lists whose centroids are closest to it, trading recall for latency through n_probe.
+    message_type and chat_id are kept as integer codes next to every vector so filters are
+    applied while scanning. Retraining runs in a background thread; queries and inserts keep
+    using the current centroids until the new lists are swapped in.
+    """
+
+    def __init__(self, config: IVFConfig):
+        self.config = config
+        self.dim: Optional[int] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[_InvertedList] = []
+        self.trained_rows = 0
+        self.max_id = 0
+        self._vocab: Dict[str, Dict[str, int]] = {"message_type": {}, "chat_id": {}}
+        self._lock = threading.RLock()
+        # Serializes writers of the index file, which are not holding _lock while writing
+        self._save_lock = threading.Lock()
+        self._pending: Optional[_PendingChanges] = None
+        self._training_thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return sum(inverted_list.size for inverted_list in self.lists)
+
+    def _code(self, field: str, value: Optional[str], create: bool = True) -> int:
+        if not value:
+            return -1
+        vocab = self._vocab[field]
+        if value not in vocab and create:
+            vocab[value] = len(vocab)
+        return vocab.get(value, -2)
+
+    def add(
+        self, ids: Sequence[int], vectors: np.ndarray, message_types: Sequence[str], chat_ids: Sequence[str]
+    ) -> None:
+        """Insert a batch of embeddings into their nearest lists"""
+        if len(ids) == 0:
+            return
+        vectors = _normalize(np.atleast_2d(vectors))
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.centroids = np.zeros((1, self.dim), dtype=EMBEDDING_DTYPE)
+                self.lists = [_InvertedList(self.dim)]
+            ids = np.asarray(ids, dtype=np.int64)
+            type_codes = np.array([self._code("message_type", value) for value in message_types], dtype=np.int32)
+            chat_codes = np.array([self._code("chat_id", value) for value in chat_ids], dtype=np.int32)
+            self._distribute(self.lists, self.centroids, ids, vectors, type_codes, chat_codes)
+            self.max_id = max(self.max_id, int(ids.max()))
+            if self._pending is not None:
+                self._pending.added.append((ids, vectors, type_codes, chat_codes))
+
+            size = len(self)
+            if self.trained_rows == 0:
+                due = size >= self.config.min_train_rows
+            else:
+                due = size >= self.trained_rows * self.config.retrain_growth
+            if due and self._pending is None:
+                self.train_in_background()
+
+    def train_in_background(self) -> None:
+        """Start retraining in a daemon thread unless a training run is already in progress"""
+        with self._lock:
+            if self._training_thread is not None and self._training_thread.is_alive():
+                return
+            self._training_thread = threading.Thread(target=self.train, name="ivf-training", daemon=True)
+            self._training_thread.start()
+
+    def wait_for_training(self) -> None:
+        """Block until a background training run has finished"""
+        thread = self._training_thread
+        if thread is not None:
+            thread.join()
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """Remove deleted rows from their lists; centroids are kept until the next retraining"""
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.removed.append(ids)
+            return sum(inverted_list.remove(ids) for inverted_list in self.lists)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        if len(centroids) == 1:
+            return np.zeros(len(vectors), dtype=np.int64)
+        # Chunked so assigning millions of rows never materializes the full score matrix
+        return np.concatenate(
+            [
+                np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+                for start in range(0, len(vectors), chunk_size)
+            ]
+        )
+
+    def _distribute(
+        self,
+        lists: List[_InvertedList],
+        centroids: np.ndarray,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        type_codes: np.ndarray,
+        chat_codes: np.ndarray,
+    ) -> None:
+        """Append rows to the lists of their nearest centroids"""
+        assignment = self._assign(vectors, centroids)
+        for list_no in np.unique(assignment):
+            rows = assignment == list_no
+            lists[list_no].extend(ids[rows], vectors[rows], type_codes[rows], chat_codes[rows])
+
+    def train(self) -> None:
+        """
+        (Re)train the centroids on the indexed vectors and redistribute every list.
+
+        k-means runs on a snapshot without holding the lock. Rows added or removed meanwhile are
+        replayed onto the new lists before they replace the current ones.
+        """
+        with self._lock:
+            if self._pending is not None:
+                return
+            vectors, ids, type_codes, chat_codes = self._all_rows()
+            size = len(ids)
+            if size == 0:
+                return
+            self._pending = _PendingChanges()
+        try:
+            n_lists = self.config.n_lists or int(np.sqrt(size))
+            n_lists = max(1, min(n_lists, size))
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(size, min(size, self.config.train_sample), replace=False)]
+            n_lists = min(n_lists, len(sample))
+            logger.info(f"Training IVF index with {n_lists} lists on {len(sample)} of {size} vectors")
+            centroids = _spherical_kmeans(sample, n_lists, self.config.kmeans_iterations)
+            lists = [_InvertedList(self.dim) for _ in range(n_lists)]
+            self._distribute(lists, centroids, ids, vectors, type_codes, chat_codes)
+
+            with self._lock:
+                for added in self._pending.added:
+                    self._distribute(lists, centroids, *added)
+                for removed in self._pending.removed:
+                    for inverted_list in lists:
+                        inverted_list.remove(removed)
+                self.centroids, self.lists, self.trained_rows = centroids, lists, size
+                self._pending = None
+        except Exception as e:
+            logger.error(f"Failed to train IVF index: {str(e)}")
+            with self._lock:
+                self._pending = None
+            raise
+        self.save()
+
+    def _all_rows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        views = [inverted_list.view() for inverted_list in self.lists]
+        if not views:
+            empty = np.empty(0, dtype=np.int64)
+            return np.empty((0, self.dim or 0), dtype=EMBEDDING_DTYPE), empty, empty, empty
+        return tuple(np.concatenate(parts) for parts in zip(*views))
+
+    def search(
+        self,
+        embedding: Sequence[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+        n_probe: int = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Find indexed rows similar to the query.
+
+        Returns:
+            List[Tuple[int, float]]: (row id, similarity) pairs above threshold, best first
+        """
+        with self._lock:
+            if not self.lists:
+                return []
+            type_code = self._code("message_type", message_type, create=False)
+            chat_code = self._code("chat_id", chat_id, create=False)
+            if type_code == -2 or chat_code == -2:
+                return []
+            filtered = type_code != -1 or chat_code != -1
+
+            query = _normalize(np.asarray(embedding, dtype=EMBEDDING_DTYPE))
+            order = np.argsort(-(self.centroids @ query))
+            n_probe = n_probe or self.config.n_probe
+
+            found_ids, found_scores = [], []
+            candidates = 0
+            for probed, list_no in enumerate(order):
+                if probed >= n_probe and (not filtered or candidates >= self.config.min_candidates):
+                    break
+                vectors, ids, type_codes, chat_codes = self.lists[list_no].view()
+                if len(ids) == 0:
+                    continue
+                mask = np.ones(len(ids), dtype=bool)
+                if type_code != -1:
+                    mask &= type_codes == type_code
+                if chat_code != -1:
+                    mask &= chat_codes == chat_code
+                if filtered:
+                    if not mask.any():
+                        continue
+                    vectors, ids = vectors[mask], ids[mask]
+                candidates += len(ids)
+                scores = vectors @ query
+                above = scores >= threshold
+                found_ids.append(ids[above])
+                found_scores.append(scores[above])
+
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        scores = np.concatenate(found_scores)
+        order = select_top(scores, threshold, top_k)
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def save(self) -> None:
+        """Persist the index atomically to config.index_path"""
+        with self._save_lock:
+            # Snapshot under the lock, write without it so queries are not blocked by disk I/O
+            with self._lock:
+                if self.dim is None:
+                    return
+                vectors, ids, type_codes, chat_codes = self._all_rows()
+                centroids = self.centroids
+                list_sizes = np.array([inverted_list.size for inverted_list in self.lists], dtype=np.int64)
+                meta = json.dumps({"trained_rows": self.trained_rows, "max_id": self.max_id, "vocab": self._vocab})
+            tmp_path = f"{self.config.index_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    centroids=centroids,
+                    list_sizes=list_sizes,
+                    vectors=vectors,
+                    ids=ids,
+                    type_codes=type_codes,
+                    chat_codes=chat_codes,
+                    meta=np.array(meta),
+                )
+            os.replace(tmp_path, self.config.index_path)
+            logger.info(f"Saved IVF index with {len(ids)} vectors to {self.config.index_path}")
+
+    def load(self) -> bool:
+        """Load a persisted index, returning False when there is none"""
+        if not os.path.exists(self.config.index_path):
+            return False
+        with self._lock, np.load(self.config.index_path) as data:
+            meta = json.loads(str(data["meta"]))
+            self.centroids = data["centroids"]
+            self.dim = self.centroids.shape[1]
+            self.trained_rows = meta["trained_rows"]
+            self.max_id = meta["max_id"]
+            self._vocab = meta["vocab"]
+            vectors, ids = data["vectors"], data["ids"]
+            type_codes, chat_codes = data["type_codes"], data["chat_codes"]
+            self.lists = []
+            start = 0
+            for size in data["list_sizes"]:
+                inverted_list = _InvertedList(self.dim, capacity=max(int(size), 16))
+                end = start + int(size)
+                inverted_list.extend(ids[start:end], vectors[start:end], type_codes[start:end], chat_codes[start:end])
+                self.lists.append(inverted_list)
+                start = end
+        logger.info(f"Loaded IVF index with {len(self)} vectors from {self.config.index_path}")
+        return True
+
+
+class IndexedVectorStorage(VectorStorageProvider):
+    """
+    Storage provider that serves find_similar from an IVF index.
+
+    Rows are persisted by the wrapped provider, which stays the source of truth. The index only
+    holds vectors and filter codes; it is saved after training and on close, and any rows newer
+    than the saved index are caught up from the provider on initialize.
+    """
+
+    def __init__(self, storage_provider: VectorStorageProvider, config: IVFConfig = None):
+        self.storage_provider = storage_provider
+        self.config = config or IVFConfig()
+        self.index = IVFIndex(self.config)
+
+    def initialize(self) -> None:
+        """Initialize the wrapped provider, load the persisted index and index any rows it is missing"""
+        self.storage_provider.initialize()
+        self.index.load()
+        added = 0
+        for batch in self.storage_provider.iter_embeddings(after_id=self.index.max_id, batch_size=5000):
+            self.index.add(
+                [row["id"] for row in batch],
+                np.vstack([row["embedding"] for row in batch]),
+                [row["message_type"] for row in batch],
+                [row["chat_id"] for row in batch],
+            )
+            added += len(batch)
+        if added:
+            logger.info(f"Indexed {added} rows missing from the IVF index")
+            self.index.save()
+
+    def store_embedding(self, message_data: MessageData) -> int:
+        return self.store_embeddings([message_data])[0]
+
+    def store_embeddings(self, batch: List[MessageData]) -> List[int]:
+        row_ids = self.storage_provider.store_embeddings(batch)
+        if row_ids:
+            self.index.add(
+                row_ids,
+                np.asarray([message_data.embedding for message_data in batch]),
+                [message_data.message_type for message_data in batch],
+                [message_data.chat_id for message_data in batch],
+            )
+        return row_ids
+
+    def find_similar(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        message_type: str = None,
+        chat_id: str = None,
+        top_k: int = None,
+    ) -> List[Dict[str, Any]]:
+        """Find similar messages by probing the nearest IVF lists"""
+        matches = self.index.search(embedding, threshold, message_type, chat_id, top_k)
+        rows = self.storage_provider.fetch_messages([row_id for row_id, _ in matches])
+        return [
+            {"message": rows[row_id]["message"], "similarity": similarity}
+            for row_id, similarity in matches
+            if row_id in rows
+        ]
+
+    def close(self) -> None:
+        """Persist the index and close the wrapped provider"""
+        self.index.wait_for_training()
+        self.index.save()
+        self.storage_provider.close()
+
+    def find_messages(
+        self,
+        message_type: str = None,
+        original_query: str = None,
+        chat_id: str = None,
+        limit: int = None,
+        include_embeddings: bool = False,
+    ) -> List[Dict[str, Any]]:
+        return self.storage_provider.find_messages(message_type, original_query, chat_id, limit, include_embeddings)
+
+    def iter_embeddings(
+        self, message_type: str = None, chat_id: str = None, batch_size: int = 1000, after_id: int = 0
+    ) -> Iterator[List[Dict[str, Any]]]:
+        return self.storage_provider.iter_embeddings(message_type, chat_id, batch_size, after_id)
+
+    def fetch_messages(self, ids: List[int], include_metadata: bool = False) -> Dict[int, Dict[str, Any]]:
+        return self.storage_provider.fetch_messages(ids, include_metadata)
+
+    def find_content_hashes(self, hashes: List[str], message_type: str = None) -> Set[str]:
+        return self.storage_provider.find_content_hashes(hashes, message_type)
+
+    def find_message_timestamps(self, messages: List[str], message_type: str) -> List[Tuple[int, str, Any]]:
+        return self.storage_provider.find_message_timestamps(messages, message_type)
+
+    def find_orphaned_chunks(self, message_type: str) -> List[int]:
+        return self.storage_provider.find_orphaned_chunks(message_type)
+
+    def delete_messages(self, ids: List[int]) -> int:
+        """Delete rows from the wrapped provider and the index"""
+        deleted = self.storage_provider.delete_messages(ids)
+        self.index.remove(ids)
+        return deleted
+
+    def search_text(
+        self, text: str, message_type: str = None, chat_id: str = None, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        return self.storage_provider.search_text(text, message_type, chat_id, limit)
+
+    def delete_expired(self, policy: RetentionPolicy) -> List[int]:
+        """Delete expired rows from the wrapped provider and the index"""
+        deleted = self.storage_provider.delete_expired(policy)
+        if deleted:
+            self.index.remove(deleted)
+        return deleted
+
+    def compact(self, reindex: bool = False) -> None:
+        """Compact the wrapped provider; with reindex the IVF centroids are retrained as well"""
+        self.storage_provider.compact(reindex)
+        if reindex:
+            self.index.train()
+        else:
+            self.index.save()
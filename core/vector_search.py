@@ -0,0 +1,238 @@
+import json
+from concurrent.futures import Executor
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Embeddings are persisted and scored as float32 regardless of what the API returns
+EMBEDDING_DTYPE = np.float32
+
+
+def encode_embedding(embedding: Sequence[float]) -> Tuple[bytes, float]:
+    """
+    Encode an embedding as a raw float32 blob together with its L2 norm.
+
+    Args:
+        embedding (list): The embedding vector
+
+    Returns:
+        tuple: (blob, norm) ready to be written to the database
+    """
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    return vector.tobytes(), float(np.linalg.norm(vector))
+
+
+def decode_embedding(value: Union[bytes, str]) -> np.ndarray:
+    """
+    Decode a stored embedding into a float32 vector.
+
+    Accepts both the binary format and the legacy JSON text format.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+    return np.asarray(json.loads(value), dtype=EMBEDDING_DTYPE)
+
+
+def stack_embeddings(values: List[Union[bytes, str]]) -> np.ndarray:
+    """
+    Stack stored embeddings into one contiguous (n, dim) float32 matrix.
+
+    Binary rows are concatenated and reinterpreted in a single copy, legacy JSON rows are decoded one by one.
+    """
+    if not values:
+        return np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+    if all(isinstance(value, bytes) for value in values):
+        return np.frombuffer(b"".join(values), dtype=EMBEDDING_DTYPE).reshape(len(values), -1)
+    return np.vstack([decode_embedding(value) for value in values])
+
+
+def fill_norms(matrix: np.ndarray, norms: List[Optional[float]]) -> np.ndarray:
+    """
+    Build the norm vector for a matrix, computing any norm that was not stored.
+    """
+    result = np.array([np.nan if norm is None else norm for norm in norms], dtype=EMBEDDING_DTYPE)
+    missing = np.isnan(result)
+    if missing.any():
+        result[missing] = np.linalg.norm(matrix[missing], axis=1)
+    return result
+
+
+def cosine_scores(matrix: np.ndarray, norms: np.ndarray, query: Sequence[float]) -> np.ndarray:
+    """
+    Score every row of a matrix against a query with a single matrix-vector product.
+
+    Args:
+        matrix (np.ndarray): (n, dim) float32 embedding matrix
+        norms (np.ndarray): Precomputed L2 norm of every row
+        query (list): The query embedding
+
+    Returns:
+        np.ndarray: Cosine similarity of every row, 0 for zero-length vectors
+    """
+    query = np.asarray(query, dtype=EMBEDDING_DTYPE)
+    query_norm = np.linalg.norm(query)
+    if matrix.shape[0] == 0 or query_norm == 0:
+        return np.zeros(matrix.shape[0], dtype=EMBEDDING_DTYPE)
+    denominator = norms * query_norm
+    scores = matrix @ query
+    np.divide(scores, denominator, out=scores, where=denominator > 0)
+    scores[denominator <= 0] = 0.0
+    return scores
+
+
+def select_top(scores: np.ndarray, threshold: float, top_k: Optional[int] = None) -> np.ndarray:
+    """
+    Select the indices of the best scores above threshold, best first.
+
+    With top_k set, argpartition keeps the selection O(n) and only the k winners are sorted.
+
+    Args:
+        scores (np.ndarray): Similarity of every candidate
+        threshold (float): Minimum similarity to keep
+        top_k (int, optional): Maximum number of indices to return
+
+    Returns:
+        np.ndarray: Indices into scores
+    """
+    matches = np.flatnonzero(scores >= threshold)
+    if top_k is not None and len(matches) > top_k:
+        if top_k <= 0:
+            return matches[:0]
+        matches = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+    return matches[np.argsort(-scores[matches], kind="stable")]
+
+
+# Rows scored per task by sharded_top; large enough that each task is one substantial BLAS call
+DEFAULT_SHARD_ROWS = 65536
+
+
+def _shard_top(
+    matrix: np.ndarray, norms: np.ndarray, query: Sequence[float], threshold: float, top_k: Optional[int], offset: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    scores = cosine_scores(matrix, norms, query)
+    matches = select_top(scores, threshold, top_k)
+    return matches + offset, scores[matches]
+
+
+def sharded_top(
+    matrix: np.ndarray,
+    norms: np.ndarray,
+    query: Sequence[float],
+    threshold: float,
+    top_k: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    shard_rows: int = DEFAULT_SHARD_ROWS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score a matrix against a query shard by shard and merge the partial top-k results.
+
+    Every shard keeps its own top_k, so the merged selection is exact. The matrix-vector product
+    releases the GIL, which lets a thread pool spread the shards over several cores.
+
+    Args:
+        matrix (np.ndarray): (n, dim) float32 embedding matrix
+        norms (np.ndarray): Precomputed L2 norm of every row
+        query (list): The query embedding
+        threshold (float): Minimum similarity to keep
+        top_k (int, optional): Maximum number of rows to return
+        executor (Executor, optional): Pool the shards run on, scored inline when None
+        shard_rows (int): Rows per shard
+
+    Returns:
+        tuple: (row indices, scores), best first
+    """
+    query = np.asarray(query, dtype=EMBEDDING_DTYPE)
+    if executor is None or matrix.shape[0] <= shard_rows:
+        return _shard_top(matrix, norms, query, threshold, top_k, 0)
+    futures = []
+    for start in range(0, matrix.shape[0], shard_rows):
+        end = start + shard_rows
+        futures.append(executor.submit(_shard_top, matrix[start:end], norms[start:end], query, threshold, top_k, start))
+    partials = [future.result() for future in futures]
+    indices = np.concatenate([partial[0] for partial in partials])
+    scores = np.concatenate([partial[1] for partial in partials])
+    order = select_top(scores, threshold, top_k)
+    return indices[order], scores[order]
+
+
+# Quantized storage formats: codes are stored per row, int8 rows also keep their scale
+QUANTIZED_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def quantize_embedding(embedding: Sequence[float], mode: str) -> Tuple[bytes, Optional[float]]:
+    """
+    Quantize an embedding for compact storage.
+
+    float16 halves the size; int8 quarters it using a symmetric per-vector scale (max |x| -> 127).
+
+    Returns:
+        tuple: (codes blob, scale) where scale is None for float16
+    """
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    if mode == "float16":
+        return vector.astype(np.float16).tobytes(), None
+    if mode == "int8":
+        scale = float(np.abs(vector).max()) or 1.0
+        codes = np.clip(np.rint(vector / scale * 127), -127, 127).astype(np.int8)
+        return codes.tobytes(), scale
+    raise ValueError(f"Unsupported quantization: {mode}")
+
+
+def dequantize_embedding(codes: bytes, mode: str, scale: Optional[float] = None) -> np.ndarray:
+    """Reconstruct an approximate float32 embedding from its quantized codes"""
+    vector = np.frombuffer(codes, dtype=QUANTIZED_DTYPES[mode]).astype(EMBEDDING_DTYPE)
+    if mode == "int8":
+        vector *= (scale or 1.0) / 127
+    return vector
+
+
+def stack_quantized(values: List[bytes], mode: str) -> np.ndarray:
+    """Stack quantized codes into one (n, dim) matrix without converting them to float32"""
+    dtype = QUANTIZED_DTYPES[mode]
+    if not values:
+        return np.empty((0, 0), dtype=dtype)
+    return np.frombuffer(b"".join(values), dtype=dtype).reshape(len(values), -1)
+
+
+def quantized_cosine_scores(codes: np.ndarray, query: Sequence[float], chunk_size: int = 4096) -> np.ndarray:
+    """
+    Score quantized rows against a query.
+
+    Rows are upcast to float32 one chunk at a time so the full matrix is never expanded. The int8
+    scale cancels out of the cosine, so codes can be scored as they are.
+    """
+    query = np.asarray(query, dtype=EMBEDDING_DTYPE)
+    query_norm = np.linalg.norm(query)
+    scores = np.zeros(codes.shape[0], dtype=EMBEDDING_DTYPE)
+    if query_norm == 0:
+        return scores
+    for start in range(0, codes.shape[0], chunk_size):
+        block = codes[start : start + chunk_size].astype(EMBEDDING_DTYPE)
+        denominator = np.linalg.norm(block, axis=1) * query_norm
+        np.divide(block @ query, denominator, out=scores[start : start + chunk_size], where=denominator > 0)
+    return scores
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]], weights: Optional[List[float]] = None, k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of the same items with weighted reciprocal rank fusion.
+
+    Every item scores sum(weight / (k + rank)) over the rankings it appears in, so lists with
+    incomparable scores (cosine similarity, BM25) can be combined without normalizing them.
+
+    Args:
+        rankings (list): Lists of item keys, best first
+        weights (list, optional): Weight of every ranking, 1.0 each by default
+        k (int): Damping constant, larger values flatten the contribution of top ranks
+
+    Returns:
+        list: (key, fused score) pairs, best first
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
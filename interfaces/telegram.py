@@ -31,7 +31,7 @@ class TelegramAgent(CoreAgent):
             super().__init__()
 
         # Initialize telegram specific stuff
-        self.app = Application.builder().token(TELEGRAM_API_TOKEN).build()
+        self.app = Application.builder().token(TELEGRAM_API_TOKEN).post_shutdown(self._post_shutdown).build()
         self._setup_handlers()
         self.register_interface("telegram", self)
 
@@ -176,6 +176,10 @@ class TelegramAgent(CoreAgent):
             elif text_response:
                 await update.message.reply_text(text_response.replace('"', ""))
 
+    async def _post_shutdown(self, application: Application) -> None:
+        """Close the message store once polling has stopped"""
+        await self.close()
+
     def run(self):
         """Start the bot"""
         logger.info("Starting Telegram bot...")